@@ -2,15 +2,29 @@
 ASGI config for app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The ASGI service serves the read heavy endpoints with async views, see
+app/urls_asgi.py, and streams alert events to connected clients.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
 import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings_asgi')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from tinychain.sse import alert_event_stream  # noqa: E402
+
+ALERT_EVENTS_PATH = '/api/tinychain/alerts/stream/'
+
+
+async def application(scope, receive, send):
+    # Django 3.1 cannot stream a response asynchronously, the event
+    # stream is an ASGI application of its own
+    if scope['type'] == 'http' and scope['path'] == ALERT_EVENTS_PATH:
+        return await alert_event_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
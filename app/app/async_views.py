@@ -0,0 +1,50 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+# Threads that run the database work of the async views, every thread holds
+# its own database connection
+executor = ThreadPoolExecutor(max_workers=settings.ASGI_DATABASE_THREADS,
+                              thread_name_prefix='database')
+
+
+def call_with_connection(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_database_thread(func, *args, **kwargs):
+    """Run a blocking function on one of the database threads"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, functools.partial(
+        call_with_connection, func, *args, **kwargs))
+
+
+def async_view(view):
+    """Serve a view from the event loop of an ASGI worker
+
+    The ORM only runs synchronously, so the view and the rendering of its
+    response run on a database thread. Django would run a synchronous view
+    on the single thread it shares between all requests of the process,
+    here requests only wait for each other once every database thread is
+    busy.
+    """
+
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run_in_database_thread(render, request, *args, **kwargs)
+
+    return wrapper
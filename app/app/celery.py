@@ -3,6 +3,9 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
+from prometheus_client import CollectorRegistry, multiprocess, \
+    start_http_server
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
@@ -19,6 +22,30 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+def is_multiprocess():
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """Export the metrics the pool processes of the worker write to
+    PROMETHEUS_MULTIPROC_DIR, summed over the processes"""
+    if not is_multiprocess():
+        return
+
+    from django.conf import settings
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(settings.WORKER_METRICS_PORT, registry=registry)
+
+
+@worker_process_shutdown.connect
+def remove_process_metrics(pid=None, **kwargs):
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
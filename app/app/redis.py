@@ -0,0 +1,28 @@
+import threading
+
+from django_redis import get_redis_connection
+
+
+def redis_or_local(create_redis, create_local):
+    """Return a function that returns the single instance of this process
+
+    The instance is created on first use, by create_redis with the
+    connection of the default cache when the cache is Redis, otherwise by
+    create_local, which keeps the state in this process, as in tests.
+    """
+    instance = None
+    lock = threading.Lock()
+
+    def get_instance():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    try:
+                        instance = create_redis(
+                            get_redis_connection('default'))
+                    except NotImplementedError:
+                        instance = create_local()
+        return instance
+
+    return get_instance
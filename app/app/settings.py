@@ -137,6 +137,48 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 AUTH_USER_MODEL = 'core.User'
 
+REST_FRAMEWORK = {
+    # JSON unless the client asks for MessagePack in Accept or Content-Type
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'tinychain.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'tinychain.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Token bucket throttles, a rate allows a burst of that many requests
+    # that is refilled over the period, see core/throttling.py
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': '20/min',
+        'register': '20/hour',
+        'alert_write': '120/min',
+    },
+    # Proxies in front of the app, the client address is taken from
+    # X-Forwarded-For as added by the nearest of them
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '1')),
+}
+
+# Cache shared by the web and celery processes, only processes that run
+# next to Redis share it, others fall back to a local memory cache
+if os.environ.get('REDIS_HOST'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': (f"redis://{os.environ.get('REDIS_HOST')}:"
+                         f"{os.environ.get('REDIS_PORT', '6379')}/1"),
+        }
+    }
+
+# Seconds the user of an auth token is cached in the shared cache and in the
+# per process cache, and the number of tokens kept per process
+AUTH_TOKEN_CACHE_TTL = 300
+AUTH_TOKEN_LOCAL_TTL = 5
+AUTH_TOKEN_LOCAL_SIZE = 10000
+
 # REDIS related settings
 CELERY_BROKER_URL = 'redis://redis:6379'
 CELERY_RESULT_BACKEND = 'redis://redis:6379'
@@ -148,9 +190,72 @@ CELERY_BEAT_SCHEDULE = {
     'process-alerts': {
         'task': 'tinychain.tasks.process_alerts',
         'schedule': 300.0,
+    },
+    'deliver-notifications': {
+        'task': 'tinychain.tasks.deliver_notifications',
+        'schedule': 30.0,
+    },
+}
+
+# Verification emails are only sent when running in production
+if not DEBUG:
+    CELERY_BEAT_SCHEDULE['send-verification-emails'] = {
+        'task': 'core.tasks.send_verification_emails',
+        'schedule': 15.0,
     }
+
+# Port the celery workers export the metrics of their pool processes on,
+# when started with PROMETHEUS_MULTIPROC_DIR set (see worker.sh)
+WORKER_METRICS_PORT = 9100
+
+# Push delivery runs on its own queue, served by the notifications worker
+CELERY_TASK_ROUTES = {
+    'tinychain.tasks.deliver_notifications': {'queue': 'notifications'},
 }
 
+# Number of coinpairs requested in a single Kraken ticker call
+KRAKEN_TICKER_BATCH_SIZE = 20
+# Seconds a pair that Kraken does not know is left out of the ticker calls
+KRAKEN_UNKNOWN_PAIR_TTL = 3600
+
+# Seconds a cached price is served before it is fetched again, the lock
+# timeout bounds how long processes wait for a fetch by another process
+PRICE_CACHE_TTL = 60
+PRICE_CACHE_LOCK_TIMEOUT = 10
+# max-age in seconds of the public prices endpoint
+PRICE_CACHE_MAX_AGE = 10
+
+# Number of alerts read and written per database round trip
+ALERT_BATCH_SIZE = 1000
+
+# Seconds a process may evaluate the alerts of a pair before another process
+# can take over the pair
+ALERT_EVALUATION_LOCK_TIMEOUT = 60
+
+# Notifications of the outbox delivered per batch, the seconds a claimed
+# batch may take before it is delivered again, the delivery attempts before
+# a notification is dead lettered and the backoff between attempts that
+# doubles from the minimum up to the maximum (seconds)
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_CLAIM_TIMEOUT = 300
+NOTIFICATION_MAX_ATTEMPTS = 8
+NOTIFICATION_BACKOFF_MIN = 30
+NOTIFICATION_BACKOFF_MAX = 3600
+
+# Maximum number of alerts created or deleted by a single bulk request
+ALERT_BULK_MAX_SIZE = 100
+
+# Number of tasks the evaluation of the alerts is split into per run
+ALERT_SHARD_COUNT = int(os.environ.get('ALERT_SHARD_COUNT', '4'))
+
+# Streaming ticker feed used by the stream_prices command, the backoff
+# between reconnects doubles from the minimum up to the maximum (seconds)
+PRICE_STREAM_URL = 'wss://ws.kraken.com'
+PRICE_STREAM_BACKOFF_MIN = 1.0
+PRICE_STREAM_BACKOFF_MAX = 60.0
+# Seconds between checks for coinpairs that need a new subscription
+PRICE_STREAM_REFRESH = 30.0
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.gmail.com'
@@ -158,7 +263,57 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASSWORD')
 EMAIL_PORT = 587
 
+# Sender of the verification emails and the host of their link, with the
+# emails sent over one connection per batch and the attempts for an email
+# the mail server rejects
+VERIFICATION_EMAIL_FROM = 'tinychain_verify@gmail.com'
+VERIFICATION_EMAIL_BASE_URL = 'https://tinychain-api.simpletechture.nl'
+VERIFICATION_EMAIL_BATCH_SIZE = 100
+VERIFICATION_EMAIL_MAX_ATTEMPTS = 5
+
 PUSH_AUTH_KEY_PATH = os.environ.get('PUSH_AUTH_KEY_PATH')
 PUSH_AUTH_KEY_ID = os.environ.get('PUSH_AUTH_KEY_ID')
 PUSH_AUTH_TEAM_ID = os.environ.get('PUSH_AUTH_TEAM_ID')
 PUSH_AUTH_TOPIC = os.environ.get('PUSH_AUTH_TOPIC')
+# Number of threads, and database connections, per ASGI worker process that
+# run the database work of the async views
+ASGI_DATABASE_THREADS = int(os.environ.get('ASGI_DATABASE_THREADS', '10'))
+
+# Alert events kept per user for clients that resume a stream and the
+# seconds they are kept, the events queued per connection before a slow
+# client is disconnected and the seconds between heartbeats of a stream
+ALERT_EVENTS_HISTORY = 100
+ALERT_EVENTS_TTL = 86400
+ALERT_EVENTS_QUEUE_SIZE = 100
+ALERT_EVENTS_HEARTBEAT = 15.0
+
+# Seconds a signed provider token is reused, APNs rejects tokens older
+# than one hour
+PUSH_TOKEN_LIFETIME = 2700
+
+# Dotted path of the push backend of every device type, with the APNs
+# host of the asyncio backend, the number of requests it keeps in flight on
+# its connection and the seconds a backend waits for a response
+PUSH_APNS_BACKEND = os.environ.get('PUSH_APNS_BACKEND',
+                                   'tinychain.apns.AsyncAPNsBackend')
+PUSH_BACKENDS = {
+    'IOS': PUSH_APNS_BACKEND,
+    'MAC': PUSH_APNS_BACKEND,
+    'ADR': os.environ.get('PUSH_FCM_BACKEND', 'tinychain.fcm.FCMBackend'),
+    'WIN': os.environ.get('PUSH_WNS_BACKEND', 'tinychain.wns.WNSBackend'),
+}
+PUSH_APNS_HOST = os.environ.get('PUSH_APNS_HOST',
+                                'api.sandbox.push.apple.com')
+PUSH_APNS_PORT = int(os.environ.get('PUSH_APNS_PORT', '443'))
+PUSH_MAX_IN_FLIGHT = int(os.environ.get('PUSH_MAX_IN_FLIGHT', '100'))
+PUSH_REQUEST_TIMEOUT = 10.0
+
+# Requests the FCM and WNS backends send at once, over as many connections
+PUSH_HTTP_THREADS = int(os.environ.get('PUSH_HTTP_THREADS', '20'))
+
+# Service account key of the Firebase project that sends to Android devices
+FCM_CREDENTIALS_PATH = os.environ.get('FCM_CREDENTIALS_PATH')
+
+# Package SID and secret of the app that sends to Windows devices
+WNS_CLIENT_ID = os.environ.get('WNS_CLIENT_ID')
+WNS_CLIENT_SECRET = os.environ.get('WNS_CLIENT_SECRET')
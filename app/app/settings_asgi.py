@@ -0,0 +1,11 @@
+"""Settings of the ASGI service, see app/asgi.py"""
+from app.settings import *  # noqa: F401,F403
+from app.settings import MIDDLEWARE
+
+ROOT_URLCONF = 'app.urls_asgi'
+
+# Static files are served by the WSGI service. WhiteNoise only runs
+# synchronously, which would make every request of an ASGI worker wait for
+# the previous one
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+              if middleware != 'whitenoise.middleware.WhiteNoiseMiddleware']
@@ -0,0 +1,24 @@
+"""URL configuration of the ASGI service
+
+Serves the read heavy endpoints with async views and every other URL like
+app.urls does.
+"""
+from django.urls import path
+
+from app.async_views import async_view
+from app.urls import urlpatterns as wsgi_urlpatterns
+from tinychain import views as tinychain_views
+from user import views as user_views
+
+urlpatterns = [
+    path('api/user/me/',
+         async_view(user_views.ManageUserView.as_view())),
+    path('api/tinychain/prices/',
+         async_view(tinychain_views.PriceListView.as_view())),
+    path('api/tinychain/alerts/',
+         async_view(tinychain_views.AlertViewSet.as_view(
+             {'get': 'list', 'post': 'create'}))),
+    path('api/tinychain/devicetokens/',
+         async_view(tinychain_views.DeviceTokenViewSet.as_view(
+             {'get': 'list', 'post': 'create'}))),
+] + wsgi_urlpatterns
@@ -36,3 +36,4 @@ admin.site.register(models.User, UserAdmin)
 admin.site.register(models.Alert)
 admin.site.register(models.DeviceToken)
 admin.site.register(models.NotificationHistory)
+admin.site.register(models.NotificationOutbox)
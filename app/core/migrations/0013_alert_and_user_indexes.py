@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:58
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_alert_is_notified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='apple_user_id',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='verification_id',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_notified', False)), fields=['user'], name='core_alert_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['user', 'coinpair', 'id'], name='core_alert_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['coinpair', 'indicator', 'limit'], name='core_alert_evaluation_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def queue_pending_alerts(apps, schema_editor):
+    """Queue the alerts that became active but were not pushed yet"""
+    Alert = apps.get_model('core', 'Alert')
+    NotificationOutbox = apps.get_model('core', 'NotificationOutbox')
+    pending = Alert.objects.filter(is_active=True, is_notified=False)
+    NotificationOutbox.objects.bulk_create(
+        (NotificationOutbox(alert_id=alert_id)
+         for alert_id in pending.values_list('id', flat=True).iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_alert_and_user_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('PENDING', 'PENDING'), ('DEAD', 'DEAD')], default='PENDING', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('alert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.alert')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notificationoutbox',
+            index=models.Index(condition=models.Q(state='PENDING'), fields=['next_attempt_at'], name='core_outbox_due_idx'),
+        ),
+        migrations.RunPython(queue_pending_alerts,
+                             migrations.RunPython.noop),
+    ]
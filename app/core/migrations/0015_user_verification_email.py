@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_sent(apps, schema_editor):
+    """The existing users were sent their email when they signed up"""
+    User = apps.get_model('core', 'User')
+    User.objects.update(verification_email_sent_at=django.utils.timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='verification_email_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='verification_email_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_sent, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_verified', False), ('verification_email_sent_at', None)), fields=['id'], name='core_user_verify_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+def drop_duplicates(apps, schema_editor):
+    """Keep the oldest pending notification of every alert"""
+    NotificationOutbox = apps.get_model('core', 'NotificationOutbox')
+    pending = NotificationOutbox.objects.filter(state='PENDING')
+    seen = set()
+    duplicates = []
+    for entry_id, alert_id in pending.order_by('id').values_list(
+            'id', 'alert_id').iterator():
+        if alert_id in seen:
+            duplicates.append(entry_id)
+        seen.add(alert_id)
+    NotificationOutbox.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_user_verification_email'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notificationoutbox',
+            constraint=models.UniqueConstraint(condition=models.Q(state='PENDING'), fields=('alert',), name='core_outbox_pending_alert_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_outbox_pending_alert_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devicetoken',
+            index=models.Index(fields=['user', 'device_type', 'id'], name='core_devicetoken_listing_idx'),
+        ),
+    ]
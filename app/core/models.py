@@ -1,12 +1,11 @@
 import uuid
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 
-from core.tasks import send_verification_email
-
 
 class UserManager(BaseUserManager):
 
@@ -50,27 +49,27 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_apple_user = models.BooleanField(default=False)
-    apple_user_id = models.CharField(max_length=255, default='')
+    apple_user_id = models.CharField(max_length=255, default='',
+                                     db_index=True)
     is_verified = models.BooleanField(default=False)
-    verification_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    verification_id = models.UUIDField(default=uuid.uuid4, editable=False,
+                                       db_index=True)
+    verification_email_sent_at = models.DateTimeField(null=True, blank=True)
+    verification_email_attempts = models.PositiveSmallIntegerField(default=0)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
-
-def user_post_save(sender, instance, signal, *args, **kwargs):
-    if not (instance.is_verified or instance.is_apple_user):
-        send_verification_email.delay(instance.pk)
-
-
-def connect():
-    models.signals.post_save.connect(user_post_save, sender=User)
-
-
-"""Only connect email when running in production"""
-if not settings.DEBUG:
-    connect()
+    class Meta:
+        indexes = [
+            # users still waiting for their verification email
+            models.Index(fields=['id'],
+                         condition=models.Q(
+                             is_verified=False,
+                             verification_email_sent_at=None),
+                         name='core_user_verify_pending_idx'),
+        ]
 
 
 class Alert(models.Model):
@@ -89,6 +88,21 @@ class Alert(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        indexes = [
+            # alerts that became active but were not pushed yet
+            models.Index(fields=['user'],
+                         condition=models.Q(is_active=True,
+                                            is_notified=False),
+                         name='core_alert_pending_idx'),
+            # listing the alerts of a user in keyset order
+            models.Index(fields=['user', 'coinpair', 'id'],
+                         name='core_alert_listing_idx'),
+            # loading the limits of a coinpair for evaluation
+            models.Index(fields=['coinpair', 'indicator', 'limit'],
+                         name='core_alert_evaluation_idx'),
+        ]
+
     def __str__(self):
         return (f'({self.coinpair} {self.indicator} '
                 f'{self.limit:.2f}) -> Price = '
@@ -113,6 +127,45 @@ class NotificationHistory(models.Model):
         return f'{self.notified_at} {self.succeeded} {self.alert}'
 
 
+class NotificationOutbox(models.Model):
+    """Notification of a triggered alert waiting to be delivered"""
+
+    class States(models.TextChoices):
+        PENDING = 'PENDING', _('PENDING')
+        DEAD = 'DEAD', _('DEAD')
+
+    alert = models.ForeignKey(
+        Alert,
+        on_delete=models.CASCADE,
+    )
+    state = models.CharField(
+        max_length=7,
+        choices=States.choices,
+        default=States.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # notifications due for delivery, claimed in order
+            models.Index(fields=['next_attempt_at'],
+                         condition=models.Q(state='PENDING'),
+                         name='core_outbox_due_idx'),
+        ]
+        constraints = [
+            # an alert triggered by two evaluators at once is queued once
+            models.UniqueConstraint(fields=['alert'],
+                                    condition=models.Q(state='PENDING'),
+                                    name='core_outbox_pending_alert_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.state} {self.attempts} {self.alert}'
+
+
 class DeviceToken(models.Model):
     """Device token model to store device tokens"""
 
@@ -133,5 +186,12 @@ class DeviceToken(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        indexes = [
+            # listing the device tokens of a user in keyset order
+            models.Index(fields=['user', 'device_type', 'id'],
+                         name='core_devicetoken_listing_idx'),
+        ]
+
     def __str__(self):
         return f'{self.device_type} {self.token}'
@@ -1,35 +1,102 @@
 # main/tasks.py
 
-import logging
+import smtplib
 
-from django.urls import reverse
-from django.core.mail import EmailMultiAlternatives
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import Counter
+
 from app.celery import app
+from app.logger import get_module_logger
+
+
+logger = get_module_logger(__name__)
+
+verification_emails = Counter(
+    'tinychain_verification_emails_total',
+    'Verification emails sent or rejected by the mail server',
+    ['result'])
+
+# Failures of a single message, the connection is still usable after them
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                  smtplib.SMTPDataError, UnicodeError)
+
+
+def create_verification_email(user, html_template, text_template):
+    validate_link = reverse('user:validate')
+    context = {
+        'user': user,
+        'url': f'{settings.VERIFICATION_EMAIL_BASE_URL}{validate_link}'
+               f'?verification_id={user.verification_id}',
+    }
+    message = EmailMultiAlternatives(
+        'Verify your email address', text_template.render(context),
+        settings.VERIFICATION_EMAIL_FROM, [user.email])
+    message.attach_alternative(html_template.render(context), 'text/html')
+    return message
 
 
 @app.task
-def send_verification_email(user_id):
-    UserModel = get_user_model()
-    try:
-        base = 'https://tinychain-api.simpletechture.nl'
-        user = UserModel.objects.get(pk=user_id)
-        validate_link = reverse('user:validate')
-        url = f'{base}{validate_link}?verification_id={user.verification_id}'
-
-        subject = 'Verify your email address'
-        from_email = 'tinychain_verify@gmail.com'
-        to = user.email
-        text_content = 'Welcome to the TinyChain platform.'
-        html_content = f'<p>Hello {user.name},</p>'
-        html_content += '<p>Welcome to the TinyChain platform,'
-        html_content += 'please verify your email adress by clicking '
-        html_content += f'<a href="{url}">this</a> link.</p>'
-        html_content += '<p>Kind regards, <br> The TinyChain team.</p>'
-        msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
-        msg.attach_alternative(html_content, "text/html")
-        msg.content_subtype = "html"  # Main content is now text/html
-        msg.send()
-    except UserModel.DoesNotExist:
-        logging.warning(
-            f'Tried to send verify email to non-existing user {user_id}')
+def send_verification_emails():
+    """Send the pending verification emails, a batch at a time over a
+    single connection to the mail server
+
+    A message the server rejects is retried on the next run, up to
+    VERIFICATION_EMAIL_MAX_ATTEMPTS times. When the connection fails the
+    rest of the batch is left for the next run. Returns the number of
+    messages sent and failed.
+    """
+    stats = {'sent': 0, 'failed': 0}
+    html_template = get_template('core/verification_email.html')
+    text_template = get_template('core/verification_email.txt')
+
+    with transaction.atomic():
+        # locked until the batch is sent, so overlapping runs skip it
+        users = list(get_user_model().objects
+                     .select_for_update(skip_locked=True)
+                     .filter(is_verified=False, is_apple_user=False,
+                             verification_email_sent_at=None,
+                             verification_email_attempts__lt=(
+                                 settings.VERIFICATION_EMAIL_MAX_ATTEMPTS))
+                     .order_by('id')
+                     [:settings.VERIFICATION_EMAIL_BATCH_SIZE])
+        if not users:
+            return stats
+
+        sent = []
+        failed = []
+        try:
+            with get_connection() as connection:
+                for user in users:
+                    message = create_verification_email(
+                        user, html_template, text_template)
+                    try:
+                        connection.send_messages([message])
+                        sent.append(user.id)
+                    except MESSAGE_ERRORS as error:
+                        logger.warning(f'Could not send verification email '
+                                       f'to user {user.id}: {error}')
+                        failed.append(user.id)
+        except (smtplib.SMTPException, OSError) as error:
+            logger.warning(f'Mail server connection failed after '
+                           f'{len(sent) + len(failed)} of {len(users)} '
+                           f'verification emails: {error}')
+
+        UserModel = get_user_model()
+        UserModel.objects.filter(id__in=sent).update(
+            verification_email_sent_at=timezone.now())
+        UserModel.objects.filter(id__in=failed).update(
+            verification_email_attempts=F('verification_email_attempts') + 1)
+
+    stats['sent'] = len(sent)
+    stats['failed'] = len(failed)
+    for result in ('sent', 'failed'):
+        verification_emails.labels(result).inc(stats[result])
+    logger.info(f'Sent verification emails, {stats}')
+    return stats
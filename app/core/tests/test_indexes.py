@@ -0,0 +1,89 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from core.models import Alert, DeviceToken, User
+
+
+class IndexUsageTests(TestCase):
+    """Test that the hot queries are answered from their index"""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # tiny test tables are cheaper to scan, make the planner show
+            # which index it would pick for a real table
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl',
+            'test123'
+        )
+        for limit in (100.00, 200.00):
+            Alert.objects.create(user=self.user,
+                                 exchange='Kraken',
+                                 coinpair='XBT:EUR',
+                                 indicator='>',
+                                 limit=limit)
+
+    def assertUsesIndex(self, queryset, *names):
+        """Assert the plan scans one of the named indexes, a column that
+        only shows up in a filter of a table scan does not count"""
+        self.assertTrue(names, 'No index to scan')
+        plan = queryset.explain()
+        scans = '|'.join(re.escape(name) for name in names)
+        self.assertRegex(plan, rf'(Index Scan using|Index Only Scan using|'
+                               rf'Bitmap Index Scan on|USING INDEX|'
+                               rf'USING COVERING INDEX) ({scans})\b')
+
+    def column_indexes(self, model, column):
+        """Return the names of the indexes Django created for db_index"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table)
+        return [name for name, constraint in constraints.items()
+                if constraint['index'] and constraint['columns'] == [column]]
+
+    def test_pending_notifications(self):
+        """Test pending alerts use the partial index"""
+        alerts = Alert.objects.filter(is_active=True, is_notified=False)
+
+        self.assertUsesIndex(alerts, 'core_alert_pending_idx')
+
+    def test_alert_listing(self):
+        """Test listing the alerts of a user uses the listing index"""
+        alerts = Alert.objects.filter(user=self.user) \
+                              .order_by('-coinpair', '-id')
+
+        self.assertUsesIndex(alerts, 'core_alert_listing_idx')
+
+    def test_device_token_listing(self):
+        """Test listing the device tokens of a user uses the listing
+        index"""
+        tokens = DeviceToken.objects.filter(user=self.user) \
+                                    .order_by('-device_type', '-id')
+
+        self.assertUsesIndex(tokens, 'core_devicetoken_listing_idx')
+
+    def test_alert_evaluation(self):
+        """Test loading the limits of a pair uses the evaluation index"""
+        alerts = Alert.objects.filter(coinpair='XBT:EUR') \
+                              .values_list('id', 'indicator', 'limit')
+
+        self.assertUsesIndex(alerts, 'core_alert_evaluation_idx')
+
+    def test_apple_user_lookup(self):
+        """Test finding a user by apple id uses an index"""
+        users = User.objects.filter(apple_user_id='123123.232334aa')
+
+        self.assertUsesIndex(
+            users, *self.column_indexes(User, 'apple_user_id'))
+
+    def test_verification_lookup(self):
+        """Test finding a user by verification id uses an index"""
+        users = User.objects.filter(verification_id=self.user.verification_id)
+
+        self.assertUsesIndex(
+            users, *self.column_indexes(User, 'verification_id'))
@@ -0,0 +1,103 @@
+import smtplib
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+
+from core.tasks import send_verification_emails
+
+
+class RejectingEmailBackend(EmailBackend):
+    """locmem backend that counts its connections and rejects the
+    recipients in rejected"""
+    rejected = set()
+    opened = 0
+
+    def open(self):
+        RejectingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.rejected:
+                raise smtplib.SMTPRecipientsRefused(
+                    {message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+class DisconnectingEmailBackend(EmailBackend):
+    """locmem backend whose connection drops after the first message"""
+
+    def send_messages(self, messages):
+        if mail.outbox:
+            raise smtplib.SMTPServerDisconnected('Connection closed')
+        return super().send_messages(messages)
+
+
+class SendVerificationEmailsTest(TestCase):
+    """Test sending the pending verification emails in batches"""
+
+    def setUp(self):
+        RejectingEmailBackend.rejected = set()
+        RejectingEmailBackend.opened = 0
+        self.users = [get_user_model().objects.create_user(
+            f'user{index}@simpletechture.nl', 'test123',
+            name=f'User & {index}') for index in range(3)]
+
+    def test_pending_emails_sent(self):
+        """Test that every pending user is sent one email with the link to
+        verify the address, rendered from the templates"""
+        get_user_model().objects.create_apple_user(
+            'apple@simpletechture.nl', 'test123')
+
+        stats = send_verification_emails()
+
+        self.assertEqual(stats, {'sent': 3, 'failed': 0})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         [user.email for user in self.users])
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Verify your email address')
+        link = f'/api/user/validate/?verification_id=' \
+               f'{self.users[0].verification_id}'
+        self.assertIn(link, message.body)
+        self.assertIn('Hello User & 0,', message.body)
+        html, mimetype = message.alternatives[0]
+        self.assertEqual(mimetype, 'text/html')
+        self.assertIn(link, html)
+        self.assertIn('User &amp; 0', html)
+        self.assertEqual(send_verification_emails(), {'sent': 0,
+                                                      'failed': 0})
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(
+        EMAIL_BACKEND='core.tests.test_tasks.RejectingEmailBackend',
+        VERIFICATION_EMAIL_MAX_ATTEMPTS=2)
+    def test_rejected_email_retried(self):
+        """Test that the batch is sent over one connection and a rejected
+        email is retried until it runs out of attempts"""
+        RejectingEmailBackend.rejected = {self.users[1].email}
+
+        stats = send_verification_emails()
+
+        self.assertEqual(stats, {'sent': 2, 'failed': 1})
+        self.assertEqual(RejectingEmailBackend.opened, 1)
+        user = get_user_model().objects.get(id=self.users[1].id)
+        self.assertIsNone(user.verification_email_sent_at)
+        self.assertEqual(user.verification_email_attempts, 1)
+
+        self.assertEqual(send_verification_emails(), {'sent': 0,
+                                                      'failed': 1})
+        self.assertEqual(send_verification_emails(), {'sent': 0,
+                                                      'failed': 0})
+
+    @override_settings(
+        EMAIL_BACKEND='core.tests.test_tasks.DisconnectingEmailBackend')
+    def test_dropped_connection_left_pending(self):
+        """Test that the emails after a dropped connection are sent on the
+        next run"""
+        self.assertEqual(send_verification_emails(), {'sent': 1,
+                                                      'failed': 0})
+        self.assertEqual(get_user_model().objects.filter(
+            verification_email_sent_at=None,
+            verification_email_attempts=0).count(), 2)
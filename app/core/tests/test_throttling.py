@@ -0,0 +1,130 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from redis.exceptions import ConnectionError
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.throttling import LocalBuckets, RedisBuckets, get_buckets
+
+
+TOKEN_URL = reverse('user:token')
+CREATE_USER_URL = reverse('user:create')
+ALERTS_URL = reverse('tinychain:alert-list')
+
+RATES = {
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': '2/min',
+        'register': '2/min',
+        'alert_write': '2/min',
+    },
+    'NUM_PROXIES': 1,
+}
+
+
+def decisions(scope, decision):
+    return REGISTRY.get_sample_value('tinychain_throttle_decisions_total',
+                                     {'scope': scope, 'decision': decision})
+
+
+class BucketTests(SimpleTestCase):
+    """Test taking tokens from the buckets"""
+
+    def test_local_bucket_refills(self):
+        buckets = LocalBuckets()
+
+        self.assertEqual(buckets.take('key', 2, 1.0, 100.0), (True, 0))
+        self.assertEqual(buckets.take('key', 2, 1.0, 100.0), (True, 0))
+        self.assertEqual(buckets.take('key', 2, 1.0, 100.0), (False, 1.0))
+        self.assertEqual(buckets.take('key', 2, 1.0, 100.5), (False, 0.5))
+        self.assertEqual(buckets.take('key', 2, 1.0, 101.0), (True, 0))
+        self.assertEqual(buckets.take('other', 2, 1.0, 101.0), (True, 0))
+
+    def test_redis_bucket_runs_script(self):
+        client = mock.Mock()
+        client.register_script.return_value.return_value = [0, '2.5']
+
+        allowed, wait = RedisBuckets(client).take('key', 2, 1.0, 100.0)
+
+        self.assertEqual((allowed, wait), (False, 2.5))
+        client.register_script.return_value.assert_called_once_with(
+            keys=['key'], args=[2, 1.0, 100.0])
+
+
+@override_settings(REST_FRAMEWORK=RATES)
+class ThrottleApiTests(TestCase):
+    """Test the throttled endpoints"""
+
+    def setUp(self):
+        get_buckets().clear()
+        self.addCleanup(get_buckets().clear)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+
+    def test_token_throttled_with_retry_after(self):
+        """Test that the third token request within a minute is rejected"""
+        payload = {'email': 'test@simpletechture.nl', 'password': 'wrong'}
+        rejected = decisions('auth', 'rejected') or 0
+
+        for _ in range(2):
+            res = self.client.post(TOKEN_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '30')
+        self.assertEqual(decisions('auth', 'rejected'), rejected + 1)
+
+    def test_scopes_have_separate_buckets(self):
+        payload = {'email': 'test@simpletechture.nl', 'password': 'wrong'}
+        for _ in range(3):
+            self.client.post(TOKEN_URL, payload)
+
+        res = self.client.post(CREATE_USER_URL, {
+            'email': 'new@simpletechture.nl',
+            'password': 'testpass',
+            'name': 'name',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_clients_have_separate_buckets(self):
+        payload = {'email': 'test@simpletechture.nl', 'password': 'wrong'}
+        for _ in range(3):
+            self.client.post(TOKEN_URL, payload)
+
+        res = self.client.post(TOKEN_URL, payload,
+                               HTTP_X_FORWARDED_FOR='10.0.0.2')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_alert_writes_throttled_per_user(self):
+        """Test that only alert writes are throttled"""
+        self.client.force_authenticate(self.user)
+        payload = {'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+                   'indicator': '>', 'limit': 8000}
+
+        statuses = [self.client.post(ALERTS_URL, payload).status_code
+                    for _ in range(3)]
+        res = self.client.get(ALERTS_URL)
+
+        self.assertEqual(statuses, [status.HTTP_201_CREATED] * 2 +
+                         [status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_redis_failure_allows_requests(self):
+        buckets = mock.Mock()
+        buckets.take.side_effect = ConnectionError('Connection refused')
+        payload = {'email': 'test@simpletechture.nl', 'password': 'wrong'}
+
+        with mock.patch('core.throttling.get_buckets', return_value=buckets):
+            statuses = {self.client.post(TOKEN_URL, payload).status_code
+                        for _ in range(3)}
+
+        self.assertEqual(statuses, {status.HTTP_400_BAD_REQUEST})
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from app.logger import get_module_logger
+from app.redis import redis_or_local
+
+
+logger = get_module_logger(__name__)
+
+throttle_decisions = Counter(
+    'tinychain_throttle_decisions_total',
+    'Requests allowed or rejected by the throttles',
+    ['scope', 'decision'])
+
+# Takes a token from the bucket in KEYS[1], after adding the tokens refilled
+# since the last request. ARGV holds the capacity, the refill rate in tokens
+# per second and the current time. Returns whether a token was taken and the
+# seconds until the next token, as a string to keep the fraction.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by all processes, updated atomically in Redis"""
+
+    def __init__(self, client):
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, capacity, rate, now):
+        allowed, wait = self.script(keys=[key], args=[capacity, rate, now])
+        return bool(allowed), float(wait)
+
+
+class LocalBuckets:
+    """Token buckets kept in memory, every process throttles on its own"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True, 0
+            self.buckets[key] = (tokens, now)
+            return False, (1 - tokens) / rate
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+get_buckets = redis_or_local(RedisBuckets, LocalBuckets)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle with a token bucket per scope and client
+
+    The rate of the scope in DEFAULT_THROTTLE_RATES, e.g. '10/min', is both
+    the size of a burst and the number of requests refilled per period.
+    Authenticated clients are throttled per user, others per IP address.
+    When Redis fails requests are allowed.
+    """
+    scope = None
+    periods = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def allow_request(self, request, view):
+        capacity, period = self.parse_rate(
+            api_settings.DEFAULT_THROTTLE_RATES[self.scope])
+        key = f'throttle:{self.scope}:{self.get_cache_key(request)}'
+
+        try:
+            allowed, self.wait_time = get_buckets().take(
+                key, capacity, capacity / period, time.time())
+        except RedisError as error:
+            logger.warning(f'Could not throttle {self.scope}: {error}')
+            throttle_decisions.labels(self.scope, 'error').inc()
+            return True
+
+        throttle_decisions.labels(
+            self.scope, 'allowed' if allowed else 'rejected').inc()
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+    def get_cache_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def parse_rate(self, rate):
+        num, period = rate.split('/')
+        return int(num), self.periods[period[0]]
+
+
+class AuthThrottle(TokenBucketThrottle):
+    """Throttle the endpoints that check passwords or identifiers"""
+    scope = 'auth'
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    """Throttle the endpoints that create users"""
+    scope = 'register'
+
+
+class AlertWriteThrottle(TokenBucketThrottle):
+    """Throttle the requests that create or delete alerts"""
+    scope = 'alert_write'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        return super().allow_request(request, view)
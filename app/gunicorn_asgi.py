@@ -0,0 +1,10 @@
+# Gunicorn configuration of the ASGI service:
+# gunicorn -c gunicorn_asgi.py app.asgi:application
+import multiprocessing
+import os
+
+bind = ':8001'
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# An async worker keeps its CPU busy on its own, one worker per CPU
+workers = int(os.environ.get('ASGI_WORKERS', multiprocessing.cpu_count()))
@@ -0,0 +1 @@
+default_app_config = 'tinychain.apps.TinychainConfig'
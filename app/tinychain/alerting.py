@@ -1,105 +1,486 @@
 import collections
+from datetime import timedelta
 
 from app.logger import get_module_logger
-from core.models import Alert, DeviceToken
+from core.models import Alert, DeviceToken, NotificationOutbox
 from core import models
+from tinychain.events import publish_alerts
+from tinychain.index import ThresholdIndex, to_fixed_price
+from tinychain.prices import PriceCache
+from tinychain.push import get_push_backends, get_reason, \
+    send_notifications
+from tinychain.versions import bump_versions, get_pair_versions
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
 from decimal import Decimal
 
-from apns2.client import APNsClient
+from apns2.client import Notification
 from apns2.payload import Payload, PayloadAlert
-from apns2.credentials import TokenCredentials
+from prometheus_client import Counter
 
-import krakenex
+
+logger = get_module_logger(__name__)
+
+notification_deliveries = Counter(
+    'tinychain_notification_deliveries_total',
+    'Notifications of the outbox sent, retried or dead lettered',
+    ['result'])
+
+device_tokens_pruned = Counter(
+    'tinychain_device_tokens_pruned_total',
+    'Device tokens deleted after their push service rejected them for good',
+    ['device_type', 'reason'])
+
+# Alert.trigger_value is stored with 5 decimal places
+TRIGGER_VALUE_QUANTUM = Decimal('0.00001')
 
 
 class AlertProcessor:
 
-    kraken = krakenex.API()
+    STATE_FIELDS = ('is_active', 'is_notified', 'trigger_value')
 
-    def process(self):
-        alerts = Alert.objects.all().order_by('-exchange') \
-                                    .order_by('-coinpair')
+    def __init__(self, index=None):
+        self.index = ThresholdIndex() if index is None else index
+        self.prices = PriceCache()
+        self.triggered = []
 
-        for alert in alerts:
-            pair = self.create_ticker_pair(alert.coinpair)
-            price = Decimal(self.get_pair_price(pair))
+    def process(self, coinpairs=None):
+        """Evaluate the alerts of all coinpairs, or of the given ones"""
+        alerts = Alert.objects.all()
+        if coinpairs is not None:
+            alerts = alerts.filter(coinpair__in=coinpairs)
+
+        signatures = self.get_signatures(alerts)
+        return self.process_prices(self.get_prices(signatures), signatures)
+
+    def process_prices(self, prices, signatures=None):
+        """Evaluate the alerts of the pairs in a {coinpair: price} map
+
+        Evaluating a pair takes a lock in the cache until its state and
+        evaluated price are stored, so the stream and the periodic runs never
+        evaluate a pair at the same time. A pair that is locked by another
+        process is skipped, that process stores the state of the pair.
+        """
+        if signatures is None:
+            signatures = self.get_signatures(
+                Alert.objects.filter(coinpair__in=prices.keys()))
+
+        coinpairs = [coinpair for coinpair in prices
+                     if coinpair in signatures]
+        locked = [coinpair for coinpair in coinpairs
+                  if cache.add(self.lock_key(coinpair), True,
+                               settings.ALERT_EVALUATION_LOCK_TIMEOUT)]
+        self.pairs_locked = len(coinpairs) - len(locked)
+        try:
+            return self.process_pairs(prices, signatures, locked)
+        finally:
+            cache.delete_many([self.lock_key(coinpair)
+                               for coinpair in locked])
+
+    def process_pairs(self, prices, signatures, coinpairs):
+        keys = {coinpair: self.evaluated_key(coinpair)
+                for coinpair in coinpairs}
+        previous = cache.get_many(keys.values())
+        versions = get_pair_versions(coinpairs)
+
+        self.rows_scanned = 0
+        self.pairs_skipped = 0
+        self.triggered = []
+        changed = []
+        evaluated = {}
+        for coinpair in coinpairs:
+            price = prices[coinpair]
+            signature = signatures[coinpair]
+            version = versions[coinpair]
+            last = previous.get(keys[coinpair])
+            # edited limits invalidate what the previous evaluation crossed
+            if last is not None and last[3:] != (version,):
+                last = None
+
+            # a pair whose price did not move and whose alerts did not change
+            # keeps the state of its previous evaluation
+            if last is not None and Decimal(last[0]) == price and \
+                    tuple(last[1:3]) == signature:
+                self.pairs_skipped += 1
+                continue
+
+            changed.extend(self.process_pair(
+                coinpair, price, signature, last, version))
+            evaluated[keys[coinpair]] = (str(price), *signature, version)
+
+        self.rows_changed = len(changed)
+        if changed:
+            self.save_changed(changed, self.triggered)
+        cache.set_many(evaluated, timeout=None)
+
+        logger.info(f'Processed alerts, scanned {self.rows_scanned}, '
+                    f'changed {self.rows_changed}, '
+                    f'skipped {self.pairs_skipped} pairs, '
+                    f'{self.pairs_locked} pairs locked')
+
+        return {'scanned': self.rows_scanned, 'changed': self.rows_changed}
+
+    def get_signatures(self, alerts):
+        """Return the (count, max id) of the alerts per coinpair"""
+        rows = alerts.values('coinpair').order_by() \
+                     .annotate(count=Count('id'), max_id=Max('id'))
+        return {row['coinpair']: (row['count'], row['max_id'])
+                for row in rows}
+
+    def evaluated_key(self, coinpair):
+        return f'alerts:evaluated:{coinpair}'
+
+    def lock_key(self, coinpair):
+        return f'alerts:evaluating:{coinpair}'
+
+    def process_pair(self, coinpair, price, signature, evaluated,
+                     version=None):
+        """Evaluate the alerts of a pair, return the alerts that changed
+
+        evaluated is the (price, count, last alert id, version) of the
+        previous evaluation of the pair, shared through the cache so any
+        process can continue from there. Only the alerts whose limit lies
+        between that price and the current one and the alerts after the last
+        evaluated alert are read. Ids are taken in order but committed out of
+        order, when the count of the pair grew by more than the alerts read
+        after the last evaluated alert, the alerts that committed late are
+        found by reading the earlier alerts of the pair too.
+        """
+        fixed_price = to_fixed_price(price)
+        pair_index = self.sync_pair(coinpair, signature, version)
+
+        if evaluated is None:
+            count = evaluated_id = 0
+            crossed = set()
+        else:
+            previous, count, evaluated_id = evaluated[:3]
+            activated, deactivated = pair_index.crossed(
+                to_fixed_price(previous), fixed_price)
+            crossed = {alert_id for alert_id in activated | deactivated
+                       if alert_id <= evaluated_id}
+
+        changed = []
+        created = 0
+        for alert in self.pair_alerts(coinpair, crossed, evaluated_id,
+                                      signature[1]):
+            if alert.id > evaluated_id:
+                created += 1
+            if self.evaluate_alert(alert, pair_index, fixed_price, price):
+                changed.append(alert)
+
+        if count + created < signature[0]:
+            for alert in self.pair_alerts(coinpair, (), 0, evaluated_id):
+                if alert.id not in crossed and \
+                        self.evaluate_alert(alert, pair_index, fixed_price,
+                                            price):
+                    changed.append(alert)
+
+        return changed
+
+    def sync_pair(self, coinpair, signature, version=None):
+        """Return the index of the pair, up to date with its signature
+
+        The index is loaded again when the version of its limits changed or
+        when alerts committed late below its last alert, the alerts created
+        since it was last brought up to date are inserted.
+        """
+        pair_index = self.index.get(coinpair)
+        if pair_index is None or pair_index.version != version:
+            return self.load_pair(coinpair, signature, version)
+
+        if (pair_index.count, pair_index.max_id) != signature:
+            if pair_index.count + self.update_pair(
+                    coinpair, pair_index, signature[1]) < signature[0]:
+                return self.load_pair(coinpair, signature, version)
+            pair_index.count = signature[0]
 
-            limit = Decimal(alert.limit)
-            higher = '>' in alert.indicator and price > limit
-            lower = '<' in alert.indicator and price < limit
+        return pair_index
 
-            alert.is_active = higher or lower
+    def load_pair(self, coinpair, signature, version=None):
+        rows = Alert.objects.filter(coinpair=coinpair,
+                                    id__lte=signature[1]) \
+                            .values_list('id', 'indicator', 'limit')
+        pair_index = self.index.load(coinpair, rows, version)
+        pair_index.count = signature[0]
+        return pair_index
 
-            # reset the notified bit when going from active to not active
-            if alert.is_notified and not alert.is_active:
-                alert.is_notified = False
+    def update_pair(self, coinpair, pair_index, max_id):
+        """Insert the alerts after the last alert of the index up to max_id,
+        return their number"""
+        rows = Alert.objects.filter(coinpair=coinpair,
+                                    id__gt=pair_index.max_id,
+                                    id__lte=max_id) \
+                            .values_list('id', 'indicator', 'limit')
+        inserted = 0
+        for alert_id, indicator, limit in rows:
+            pair_index.insert(alert_id, indicator, limit)
+            inserted += 1
+        return inserted
 
-            alert.trigger_value = price if alert.is_active else 0
-            alert.save()
+    def pair_alerts(self, coinpair, crossed, after_id, max_id):
+        """Yield the crossed alerts and the alerts after after_id up to
+        max_id"""
+        alerts = Alert.objects.only('id', 'user', 'coinpair', 'indicator',
+                                    'limit', *self.STATE_FIELDS)
+        batch_size = settings.ALERT_BATCH_SIZE
 
+        crossed = sorted(crossed)
+        for start in range(0, len(crossed), batch_size):
+            yield from alerts.filter(id__in=crossed[start:start + batch_size])
+
+        if after_id < max_id:
+            yield from alerts.filter(coinpair=coinpair,
+                                     id__gt=after_id,
+                                     id__lte=max_id) \
+                             .iterator(chunk_size=batch_size)
+
+    def evaluate_alert(self, alert, pair_index, fixed_price, price):
+        self.rows_scanned += 1
+        return self.evaluate(alert,
+                             pair_index.is_active(alert.id, fixed_price),
+                             price)
+
+    def evaluate(self, alert, is_active, price):
+        """Apply the evaluated state to the alert, return True when the
+        state changed"""
+        # reset the notified bit when going from active to not active
+        is_notified = alert.is_notified and is_active
+
+        # an alert that stays active keeps the price it was triggered at,
+        # so evaluating the whole pair again only writes what crossed
+        if not is_active:
+            trigger_value = 0
+        elif alert.is_active:
+            trigger_value = alert.trigger_value
+        else:
+            trigger_value = price.quantize(TRIGGER_VALUE_QUANTUM)
+
+        state = (is_active, is_notified, trigger_value)
+        if state == (alert.is_active, alert.is_notified, alert.trigger_value):
+            return False
+
+        if is_active and not alert.is_active:
+            self.triggered.append(alert)
+        alert.is_active, alert.is_notified, alert.trigger_value = state
         return True
 
-    def create_ticker_pair(self, coinpair):
-        return f"X{coinpair.replace(':', 'Z')}"
+    def save_changed(self, alerts, triggered=()):
+        """Write back only the state columns of the changed alerts
+
+        The triggered alerts are queued in the notification outbox and the
+        queued notifications of the alerts that are no longer active are
+        dropped, in the same transaction.
+        """
+        deactivated = [alert.id for alert in alerts if not alert.is_active]
+        with transaction.atomic():
+            Alert.objects.bulk_update(alerts, self.STATE_FIELDS,
+                                      batch_size=settings.ALERT_BATCH_SIZE)
+            if deactivated:
+                NotificationOutbox.objects.filter(
+                    alert__in=deactivated,
+                    state=NotificationOutbox.States.PENDING).delete()
+            NotificationOutbox.objects.bulk_create(
+                [NotificationOutbox(alert=alert) for alert in triggered],
+                batch_size=settings.ALERT_BATCH_SIZE, ignore_conflicts=True)
+            bump_versions(alert.user_id for alert in alerts)
+            publish_alerts(alerts)
 
-    def get_pair_price(self, ticker):
-        result = self.kraken.query_public(f'Ticker?pair={ticker}')
-        ticker = result.get('result').get(ticker)
-        return ticker.get('a')[0]
+    def get_prices(self, coinpairs):
+        """Return a fresh {coinpair: price} map, shared through the cache"""
+        return self.prices.refresh(coinpairs)
 
 
 class Notifier:
+    """Delivers the notifications queued in the outbox
 
-    logger = get_module_logger(__name__)
+    Every call claims a batch of due notifications by moving their next
+    attempt past NOTIFICATION_CLAIM_TIMEOUT, so workers running side by side
+    never send the same notification and the batch of a worker that died is
+    sent again later. A notification that no device accepted is retried with
+    exponential backoff and dead lettered after NOTIFICATION_MAX_ATTEMPTS.
+    Device tokens that a push service reports as invalid for good are
+    deleted, so later notifications are no longer sent to them.
+    """
+
+    def __init__(self, backends=None):
+        self.backends = get_push_backends() if backends is None else backends
 
     def notifyAlerts(self):
-        active_silent_alerts = Alert.objects.all().filter(is_active=True,
-                                                          is_notified=False)
-        for alert in active_silent_alerts:
-            deviceTokens = DeviceToken.objects.all().filter(user=alert.user)
-            if deviceTokens.count() > 0:
-                payload_alert = PayloadAlert(
-                    title='Price alert',
-                    body=str(alert),
-                )
-
-                payload = Payload(alert=payload_alert,
-                                  sound='chime', badge=1)
-                result = self.send_push_message(
-                    deviceTokens[0].token, payload)
+        """Deliver a batch of due notifications, return the number of
+        notifications claimed, sent, retried and dead lettered"""
+        abandoned = self.dead_letter_abandoned()
+        entries = self.claim()
+        stats = {'claimed': len(entries), 'sent': 0, 'retried': 0,
+                 'dead': abandoned}
+        if not entries:
+            notification_deliveries.labels('dead').inc(abandoned)
+            return stats
+
+        alerts = [entry.alert for entry in entries]
+        user_tokens = collections.defaultdict(list)
+        device_tokens = DeviceToken.objects.filter(
+            user__in={alert.user_id for alert in alerts})
+        for user_id, token, device_type in device_tokens.values_list(
+                'user_id', 'token', 'device_type'):
+            user_tokens[user_id].append((token, device_type))
+
+        notifications = collections.defaultdict(list)
+        for alert in alerts:
+            payload = self.create_payload(alert)
+            for token, device_type in user_tokens.get(alert.user_id, ()):
+                notifications[device_type].append(
+                    Notification(token=token, payload=payload))
+
+        results = {}
+        if notifications:
+            results = self.send_push_messages(notifications)
+
+        sent = []
+        failed = []
+        for entry in entries:
+            alert_results = [str(results.get(token))
+                             for token, _ in user_tokens.get(
+                                 entry.alert.user_id, ())]
+            if any('Success' in result for result in alert_results):
+                sent.append(entry)
+            else:
+                entry.last_error = \
+                    (alert_results or ['No device token'])[0][:255]
+                failed.append(entry)
+
+        notified = [entry.alert for entry in sent]
+        with transaction.atomic():
+            Alert.objects.filter(id__in=[alert.id for alert in notified],
+                                 is_active=True) \
+                         .update(is_notified=True)
+            NotificationOutbox.objects.filter(
+                id__in=[entry.id for entry in sent]).delete()
+            dead = self.schedule_retries(failed)
+            pruned = self.prune_tokens(user_tokens, results)
+            self.save_alert_history(
+                [alert for alert in alerts if alert.user_id in user_tokens],
+                user_tokens, results)
+            bump_versions(alert.user_id for alert in notified)
+            for alert in notified:
                 alert.is_notified = True
-                alert.save()
+            publish_alerts(notified)
+
+        stats['sent'] = len(sent)
+        stats['retried'] = len(failed) - dead
+        stats['dead'] += dead
+        for result in ('sent', 'retried', 'dead'):
+            notification_deliveries.labels(result).inc(stats[result])
+        for device_type, reason in pruned:
+            device_tokens_pruned.labels(device_type, reason).inc()
+        logger.info(f'Delivered notifications, {stats}')
+
+        return stats
+
+    def dead_letter_abandoned(self):
+        """Dead letter the due notifications that are out of attempts,
+        claimed for the last time by a delivery that never completed, and
+        return their number"""
+        return NotificationOutbox.objects.filter(
+            state=NotificationOutbox.States.PENDING,
+            next_attempt_at__lte=timezone.now(),
+            attempts__gte=settings.NOTIFICATION_MAX_ATTEMPTS,
+        ).update(state=NotificationOutbox.States.DEAD,
+                 last_error='Delivery did not complete')
 
-                self.save_alert_history(result.get(deviceTokens[0].token),
-                                        alert, alert.user)
+    def claim(self):
+        """Claim the due notifications of the next batch"""
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(NotificationOutbox.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(state=NotificationOutbox.States.PENDING,
+                               next_attempt_at__lte=now)
+                       .order_by('next_attempt_at')
+                       .values_list('id', flat=True)
+                       [:settings.NOTIFICATION_BATCH_SIZE])
+            NotificationOutbox.objects.filter(id__in=ids).update(
+                attempts=F('attempts') + 1,
+                next_attempt_at=now + timedelta(
+                    seconds=settings.NOTIFICATION_CLAIM_TIMEOUT))
+
+        return list(NotificationOutbox.objects.filter(id__in=ids)
+                                              .select_related('alert__user'))
+
+    def schedule_retries(self, entries):
+        """Schedule the next attempt of the failed notifications, dead letter
+        the ones out of attempts and return their number"""
+        now = timezone.now()
+        dead = 0
+        for entry in entries:
+            if entry.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                entry.state = NotificationOutbox.States.DEAD
+                dead += 1
             else:
-                self.logger.info(
-                    'Could not send alert, no device token was found')
+                entry.next_attempt_at = now + self.backoff(entry.attempts)
 
-    def send_push_message(self, token, payload):
-        token_credentials = TokenCredentials(
-            auth_key_path=settings.PUSH_AUTH_KEY_PATH,
-            auth_key_id=settings.PUSH_AUTH_KEY_ID,
-            team_id=settings.PUSH_AUTH_TEAM_ID)
+        NotificationOutbox.objects.bulk_update(
+            entries, ('state', 'next_attempt_at', 'last_error'),
+            batch_size=settings.ALERT_BATCH_SIZE)
+        return dead
 
-        client = APNsClient(credentials=token_credentials, use_sandbox=True)
+    def prune_tokens(self, user_tokens, results):
+        """Delete the device tokens the backend of their device type
+        reported as invalid, return their (device_type, reason)"""
+        invalid = {}
+        for tokens in user_tokens.values():
+            for token, device_type in tokens:
+                backend = self.backends.get(device_type)
+                result = results.get(token)
+                if backend is not None and backend.is_invalid_token(result):
+                    invalid[token] = (device_type, get_reason(result))
 
-        Notification = collections.namedtuple(
-            'Notification', ['token', 'payload'])
-        notifications = [Notification(payload=payload, token=token)]
+        if invalid:
+            DeviceToken.objects.filter(token__in=invalid).delete()
+            logger.info(f'Pruned {len(invalid)} invalid device tokens')
+        return list(invalid.values())
 
-        res = client.send_notification_batch(
-            notifications=notifications, topic=settings.PUSH_AUTH_TOPIC)
+    def backoff(self, attempts):
+        """Return the delay after the given number of failed attempts"""
+        seconds = settings.NOTIFICATION_BACKOFF_MIN * 2 ** (attempts - 1)
+        return timedelta(
+            seconds=min(seconds, settings.NOTIFICATION_BACKOFF_MAX))
 
-        self.logger.info(res)
+    def create_payload(self, alert):
+        payload_alert = PayloadAlert(
+            title='Price alert',
+            body=str(alert),
+        )
+
+        return Payload(alert=payload_alert, sound='chime', badge=1)
+
+    def send_push_messages(self, notifications):
+        """Send {device_type: [notification]} with the backend of every
+        device type"""
+        res = send_notifications(notifications, settings.PUSH_AUTH_TOPIC,
+                                 self.backends)
+
+        logger.info(res)
 
         return res
 
-    def save_alert_history(self, result, alert, user):
-        models.NotificationHistory.objects.create(
-            user=user,
-            alert=alert,
-            succeeded='Success' in result,
-            notification_result=result
-        )
+    def save_alert_history(self, alerts, user_tokens, results):
+        """Store one history record per alert, successful when any of the
+        devices of the user accepted the notification"""
+        history = []
+        for alert in alerts:
+            alert_results = [str(results.get(token))
+                             for token, _ in user_tokens[alert.user_id]]
+            succeeded = [result for result in alert_results
+                         if 'Success' in result]
+            result = (succeeded or alert_results)[0]
+            history.append(models.NotificationHistory(
+                user=alert.user,
+                alert=alert,
+                succeeded=bool(succeeded),
+                notification_result=result
+            ))
+
+        models.NotificationHistory.objects.bulk_create(history)
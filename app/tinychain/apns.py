@@ -0,0 +1,369 @@
+import asyncio
+import json
+import os
+import ssl
+import threading
+
+from apns2.credentials import TokenCredentials
+from django.conf import settings
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import ConnectionTerminated, DataReceived, \
+    RemoteSettingsChanged, ResponseReceived, StreamEnded, StreamReset, \
+    WindowUpdated
+from h2.exceptions import ProtocolError, TooManyStreamsError
+from hpack import NeverIndexedHeaderTuple
+
+from app.logger import get_module_logger
+from tinychain.push import APNS_INVALID_TOKEN_REASONS, LocalPushBackend, \
+    PushBackend
+
+
+logger = get_module_logger(__name__)
+
+
+class Response:
+    """The status and body of a response, and the future of its result"""
+
+    def __init__(self, future):
+        self.future = future
+        self.status = None
+        self.body = b''
+
+
+class AsyncAPNsClient:
+    """APNs client that sends every notification of a batch as a stream of
+    one HTTP/2 connection
+
+    At most window requests are in flight at once. A single reader task
+    resolves the response of every stream, so a slow response only holds
+    its own slot of the window. The frames of all streams started in one
+    iteration of the event loop are written together.
+    """
+
+    def __init__(self, host, port, credentials, window, timeout,
+                 secure=True):
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.window = window
+        self.timeout = timeout
+        self.secure = secure
+        self.connection = None
+        self.writer = None
+        self.reading = None
+        self.flushing = False
+
+    @property
+    def connected(self):
+        return self.reading is not None and not self.reading.done()
+
+    async def connect(self):
+        """Open the connection, raise ConnectionResetError when it cannot
+        be opened in time"""
+        try:
+            await self.open()
+        except (OSError, asyncio.TimeoutError, ProtocolError) as error:
+            await self.close()
+            raise ConnectionResetError(
+                f'Could not connect to APNs: {type(error).__name__}: '
+                f'{error}') from error
+
+    async def open(self):
+        context = None
+        if self.secure:
+            context = ssl.create_default_context()
+            context.set_alpn_protocols(['h2'])
+        reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context),
+            self.timeout)
+
+        # the request headers are built well formed below, validating them
+        # costs more than encoding them
+        self.connection = H2Connection(config=H2Configuration(
+            client_side=True, header_encoding=None,
+            validate_outbound_headers=False,
+            normalize_outbound_headers=False))
+        self.connection.initiate_connection()
+        self.writer.write(self.connection.data_to_send())
+        self.responses = {}
+        self.available = asyncio.Event()
+        self.settled = asyncio.Event()
+        self.reading = asyncio.ensure_future(self.read(reader))
+
+        # the window is bounded by the streams the server allows at once
+        await asyncio.wait_for(self.settled.wait(), self.timeout)
+        if not self.connected:
+            raise ConnectionResetError('Connection closed')
+        self.in_flight = asyncio.Semaphore(min(
+            self.window,
+            self.connection.remote_settings.max_concurrent_streams))
+
+    async def close(self):
+        if self.connected:
+            try:
+                self.connection.close_connection()
+                self.writer.write(self.connection.data_to_send())
+            except ProtocolError:
+                pass
+            self.reading.cancel()
+            try:
+                await self.reading
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer.close()
+        self.reading = self.writer = None
+
+    async def send_notification_batch(self, notifications, topic):
+        """Send the notifications, return the result per token
+
+        The notifications that were lost with a dropped connection are
+        sent once more over a new connection. When no connection can be
+        opened the notifications not sent yet get the error as their result.
+        A notification without a timely response may have been delivered, it
+        is reported as failed and not sent again, the connection is only
+        replaced when none of its notifications got a response.
+        """
+        results = {}
+        pending = list(notifications)
+        for _ in range(2):
+            if not self.connected:
+                await self.close()
+                try:
+                    await self.connect()
+                except ConnectionResetError as error:
+                    logger.warning(str(error))
+                    results.update(dict.fromkeys(
+                        (notification.token for notification in pending),
+                        f'{type(error).__name__}: {error}'))
+                    break
+
+            outcomes = await asyncio.gather(
+                *(self.send(notification, topic) for notification in pending),
+                return_exceptions=True)
+
+            lost = []
+            timed_out = 0
+            for notification, outcome in zip(pending, outcomes):
+                if isinstance(outcome, asyncio.TimeoutError):
+                    outcome = f'{type(outcome).__name__}: {outcome}'
+                    timed_out += 1
+                elif isinstance(outcome, OSError):
+                    outcome = f'{type(outcome).__name__}: {outcome}'
+                    lost.append(notification)
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                results[notification.token] = outcome
+
+            if pending and timed_out == len(pending):
+                logger.warning('APNs did not respond, closing the connection')
+                await self.close()
+            if not lost:
+                break
+            logger.warning(f'APNs connection lost, resending {len(lost)} '
+                           f'notifications')
+            await self.close()
+            pending = lost
+
+        return results
+
+    async def send(self, notification, topic):
+        """Send one notification, return 'Success' or the reason APNs
+        rejected it"""
+        async with self.in_flight:
+            if not self.connected:
+                raise ConnectionResetError('Connection closed')
+
+            stream_id = self.connection.get_next_available_stream_id()
+            response = self.responses[stream_id] = Response(
+                asyncio.get_event_loop().create_future())
+            try:
+                try:
+                    self.connection.send_headers(
+                        stream_id, self.get_headers(notification, topic))
+                except TooManyStreamsError:
+                    # the server lowered its limit, a new connection
+                    # sizes the window from the new settings
+                    raise ConnectionResetError('Too many streams')
+                await self.send_body(stream_id, self.get_body(notification))
+                return await asyncio.wait_for(response.future, self.timeout)
+            except asyncio.TimeoutError:
+                if self.connected:
+                    self.connection.reset_stream(stream_id)
+                    self.schedule_flush()
+                raise
+            finally:
+                self.responses.pop(stream_id, None)
+
+    def schedule_flush(self):
+        if not self.flushing:
+            self.flushing = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flushing = False
+        if self.connected:
+            self.writer.write(self.connection.data_to_send())
+
+    def get_headers(self, notification, topic):
+        # the path differs for every token, keeping it out of the header
+        # compression table leaves room for the headers that repeat
+        headers = [
+            (b':method', b'POST'),
+            (b':scheme', b'https'),
+            (b':authority', self.host.encode()),
+            NeverIndexedHeaderTuple(
+                b':path', f'/3/device/{notification.token}'.encode()),
+            (b'apns-push-type', b'alert'),
+        ]
+        if topic is not None:
+            headers.append((b'apns-topic', topic.encode()))
+        authorization = self.credentials.get_authorization_header(topic)
+        if authorization is not None:
+            headers.append((b'authorization', authorization.encode()))
+        return headers
+
+    def get_body(self, notification):
+        return json.dumps(notification.payload.dict(), ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    async def send_body(self, stream_id, body):
+        """Send the body as the flow control windows allow"""
+        while True:
+            size = min(len(body),
+                       self.connection.local_flow_control_window(stream_id),
+                       self.connection.max_outbound_frame_size)
+            if size or not body:
+                self.connection.send_data(stream_id, body[:size],
+                                          end_stream=size == len(body))
+                self.schedule_flush()
+                body = body[size:]
+                if not body:
+                    return
+                continue
+
+            await self.wait_available()
+
+    async def wait_available(self):
+        """Wait until a stream or a flow control window frees up"""
+        if self.connected:
+            self.available.clear()
+            await self.available.wait()
+        if not self.connected:
+            raise ConnectionResetError('Connection closed')
+
+    async def read(self, reader):
+        error = ConnectionResetError('Connection closed by APNs')
+        try:
+            while True:
+                data = await reader.read(65535)
+                if not data:
+                    break
+                terminated = None
+                for event in self.connection.receive_data(data):
+                    if isinstance(event, ConnectionTerminated):
+                        terminated = event
+                    self.handle(event)
+                self.writer.write(self.connection.data_to_send())
+                if terminated is not None:
+                    error = ConnectionResetError(
+                        f'Connection terminated by APNs: '
+                        f'{terminated.additional_data}')
+                    break
+        except (OSError, ProtocolError) as exception:
+            error = ConnectionResetError(str(exception))
+        finally:
+            for response in self.responses.values():
+                if not response.future.done():
+                    response.future.set_exception(error)
+            self.available.set()
+            self.settled.set()
+
+    def handle(self, event):
+        if isinstance(event, RemoteSettingsChanged):
+            self.settled.set()
+        if isinstance(event, (WindowUpdated, RemoteSettingsChanged,
+                              StreamEnded, StreamReset)):
+            self.available.set()
+
+        response = self.responses.get(getattr(event, 'stream_id', None))
+        if response is None:
+            return
+
+        if isinstance(event, ResponseReceived):
+            response.status = dict(event.headers)[b':status']
+        elif isinstance(event, DataReceived):
+            response.body += event.data
+            self.connection.acknowledge_received_data(
+                event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, StreamEnded):
+            if not response.future.done():
+                response.future.set_result(self.get_result(response))
+        elif isinstance(event, StreamReset):
+            if not response.future.done():
+                response.future.set_exception(ConnectionResetError(
+                    f'Stream reset with error {event.error_code}'))
+
+    def get_result(self, response):
+        if response.status == b'200':
+            return 'Success'
+        try:
+            return json.loads(response.body)['reason']
+        except (ValueError, KeyError, TypeError):
+            return f'HTTP {response.status.decode()}'
+
+
+class AsyncAPNsBackend(PushBackend):
+    """Push backend that runs the asyncio APNs client on an event loop of
+    its own
+
+    The connection stays open between batches. Like APNsConnection, the
+    client is recreated after a fork.
+    """
+    invalid_token_reasons = APNS_INVALID_TOKEN_REASONS
+
+    def __init__(self):
+        self.loop = None
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        if self.client is None or self.pid != os.getpid():
+            credentials = TokenCredentials(
+                auth_key_path=settings.PUSH_AUTH_KEY_PATH,
+                auth_key_id=settings.PUSH_AUTH_KEY_ID,
+                team_id=settings.PUSH_AUTH_TEAM_ID,
+                token_lifetime=settings.PUSH_TOKEN_LIFETIME)
+
+            self.loop = asyncio.new_event_loop()
+            self.client = self.create_client(credentials)
+            self.pid = os.getpid()
+
+        return self.client
+
+    def create_client(self, credentials):
+        return AsyncAPNsClient(settings.PUSH_APNS_HOST,
+                               settings.PUSH_APNS_PORT,
+                               credentials,
+                               settings.PUSH_MAX_IN_FLIGHT,
+                               settings.PUSH_REQUEST_TIMEOUT)
+
+    def send_notification_batch(self, notifications, topic):
+        with self.lock:
+            client = self.get_client()
+            return self.loop.run_until_complete(
+                client.send_notification_batch(notifications, topic))
+
+    def close(self):
+        with self.lock:
+            if self.client is not None and self.pid == os.getpid():
+                self.loop.run_until_complete(self.client.close())
+                self.loop.close()
+            self.client = self.loop = None
+
+
+class LocalAPNsBackend(LocalPushBackend):
+    """Stand-in for APNs in tests"""
+    invalid_token_reasons = APNS_INVALID_TOKEN_REASONS
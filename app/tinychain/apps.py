@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class TinychainConfig(AppConfig):
     name = 'tinychain'
+
+    def ready(self):
+        from core.models import Alert, DeviceToken
+        from tinychain import versions
+
+        for model in (Alert, DeviceToken):
+            post_save.connect(versions.user_row_changed, sender=model)
+            post_delete.connect(versions.user_row_changed, sender=model)
+
+        post_save.connect(versions.alert_changed, sender=Alert)
@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from app.logger import get_module_logger
+from app.redis import redis_or_local
+
+
+logger = get_module_logger(__name__)
+
+ALERT_FIELDS = ('id', 'coinpair', 'indicator', 'limit', 'is_active',
+                'is_notified', 'trigger_value')
+
+
+def alert_event(alert):
+    data = {field: getattr(alert, field) for field in ALERT_FIELDS}
+    for field in ('limit', 'trigger_value'):
+        if data[field] is not None:
+            data[field] = str(data[field])
+    return {'event': 'alert', 'data': data}
+
+
+def price_event(coinpair, price):
+    return {'event': 'price',
+            'data': {'coinpair': coinpair, 'price': str(price)}}
+
+
+def parse_event_id(event_id):
+    """Return the (milliseconds, sequence) of an event id, or None"""
+    try:
+        milliseconds, sequence = event_id.split('-')
+        return int(milliseconds), int(sequence)
+    except (AttributeError, ValueError):
+        return None
+
+
+def publish_alerts(alerts):
+    """Publish the state of the alerts once the transaction commits"""
+    events = defaultdict(list)
+    for alert in alerts:
+        events[alert.user_id].append(alert_event(alert))
+    if events:
+        transaction.on_commit(lambda: get_broker().publish_alerts(events))
+
+
+def publish_prices(prices):
+    """Publish a {coinpair: price} map"""
+    if prices:
+        get_broker().publish_prices(
+            [price_event(coinpair, price)
+             for coinpair, price in prices.items()])
+
+
+class Subscription:
+    """The events of a user and of the coinpairs of the user, queued for a
+    single connection
+
+    Events are put from any thread. A connection that does not keep up
+    overflows and is closed, its client resumes with Last-Event-ID.
+    """
+
+    def __init__(self, user_id, coinpairs):
+        self.user_id = user_id
+        self.coinpairs = set(coinpairs)
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(settings.ALERT_EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.put_nowait, event)
+
+    def put_nowait(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        """Return the next event, None once the queue overflowed"""
+        event = await self.queue.get()
+        if self.overflowed:
+            return None
+        if event['event'] == 'alert':
+            self.coinpairs.add(event['data']['coinpair'])
+        return event
+
+
+class EventHub:
+    """Dispatches published events to the subscriptions of this process"""
+
+    def __init__(self):
+        self.users = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.users[subscription.user_id].add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.users.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.users[subscription.user_id]
+
+    def dispatch_user(self, user_id, event):
+        with self.lock:
+            subscriptions = list(self.users.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def dispatch_prices(self, events):
+        with self.lock:
+            subscriptions = [subscription
+                             for subscriptions in self.users.values()
+                             for subscription in subscriptions]
+        for subscription in subscriptions:
+            for event in events:
+                if event['data']['coinpair'] in subscription.coinpairs:
+                    subscription.put(event)
+
+
+# Subscriptions of the connections served by this process
+event_hub = EventHub()
+
+
+class RedisBroker:
+    """Events shared by all processes through Redis
+
+    Alert events are appended to a capped stream per user, which gives them
+    their id and keeps them for clients that resume, and are then published
+    on the channel of the user. Price events are only published. Every
+    process that serves connections runs a single listener thread.
+    """
+    prices_channel = 'events:prices'
+
+    def __init__(self, client):
+        self.client = client
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def stream_key(self, user_id):
+        return f'events:stream:{user_id}'
+
+    def user_channel(self, user_id):
+        return f'events:user:{user_id}'
+
+    def publish_alerts(self, events):
+        """Publish {user_id: [event]}"""
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for user_id, user_events in events.items():
+                for event in user_events:
+                    pipeline.xadd(self.stream_key(user_id),
+                                  {'event': json.dumps(event)},
+                                  maxlen=settings.ALERT_EVENTS_HISTORY,
+                                  approximate=True)
+                pipeline.expire(self.stream_key(user_id),
+                                settings.ALERT_EVENTS_TTL)
+            ids = iter(result for result in pipeline.execute()
+                       if not isinstance(result, bool))
+
+            pipeline = self.client.pipeline(transaction=False)
+            for user_id, user_events in events.items():
+                for event in user_events:
+                    event = dict(event, id=next(ids).decode())
+                    pipeline.publish(self.user_channel(user_id),
+                                     json.dumps(event))
+            pipeline.execute()
+        except RedisError as error:
+            logger.warning(f'Could not publish alert events: {error}')
+
+    def publish_prices(self, events):
+        try:
+            self.client.publish(self.prices_channel, json.dumps(events))
+        except RedisError as error:
+            logger.warning(f'Could not publish price events: {error}')
+
+    def history(self, user_id, last_event_id):
+        """Return the events of the user after last_event_id"""
+        position = parse_event_id(last_event_id)
+        if position is None:
+            return []
+
+        start = f'{position[0]}-{position[1] + 1}'
+        try:
+            entries = self.client.xrange(self.stream_key(user_id), min=start)
+        except RedisError as error:
+            logger.warning(f'Could not replay events of user {user_id}: '
+                           f'{error}')
+            return []
+        return [dict(json.loads(fields[b'event']), id=entry_id.decode())
+                for entry_id, fields in entries]
+
+    def start(self, hub):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self.listen, args=(hub,), daemon=True,
+                    name='events')
+                self.listener.start()
+
+    def listen(self, hub):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe('events:*')
+                for message in pubsub.listen():
+                    self.dispatch(hub, message)
+            except RedisError as error:
+                logger.warning(f'Event listener disconnected: {error}')
+                time.sleep(1)
+
+    def dispatch(self, hub, message):
+        channel = message['channel'].decode()
+        data = json.loads(message['data'])
+        if channel == self.prices_channel:
+            hub.dispatch_prices(data)
+        elif channel.startswith('events:user:'):
+            hub.dispatch_user(int(channel.rsplit(':', 1)[1]), data)
+
+
+class LocalBroker:
+    """Events delivered within this process, with the history of every
+    user kept in memory"""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.streams = defaultdict(
+            lambda: deque(maxlen=settings.ALERT_EVENTS_HISTORY))
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def publish_alerts(self, events):
+        for user_id, user_events in events.items():
+            for event in user_events:
+                with self.lock:
+                    event = dict(event, id=f'{int(time.time() * 1000)}-'
+                                           f'{next(self.sequence)}')
+                    self.streams[user_id].append(event)
+                self.hub.dispatch_user(user_id, event)
+
+    def publish_prices(self, events):
+        self.hub.dispatch_prices(events)
+
+    def history(self, user_id, last_event_id):
+        position = parse_event_id(last_event_id)
+        if position is None:
+            return []
+        with self.lock:
+            return [event for event in self.streams.get(user_id, ())
+                    if parse_event_id(event['id']) > position]
+
+    def start(self, hub):
+        pass
+
+    def clear(self):
+        with self.lock:
+            self.streams.clear()
+
+
+get_broker = redis_or_local(RedisBroker, lambda: LocalBroker(event_hub))
@@ -0,0 +1,88 @@
+import json
+import time
+
+import jwt
+from django.conf import settings
+
+from tinychain.push import HTTPPushBackend, LocalPushBackend, get_alert
+
+
+class FCMBackend(HTTPPushBackend):
+    """Push backend of Firebase Cloud Messaging
+
+    Notifications are sent with the HTTP v1 API, one request per device
+    token like the sendEach call of the Admin SDKs, in batches of at most
+    the 500 tokens that call takes. Access tokens are requested with a JWT
+    signed by the key of the service account in FCM_CREDENTIALS_PATH.
+    """
+    batch_size = 500
+    invalid_token_reasons = frozenset({'UNREGISTERED'})
+    scope = 'https://www.googleapis.com/auth/firebase.messaging'
+
+    def __init__(self):
+        super().__init__()
+        self.credentials = None
+
+    def is_configured(self):
+        return bool(settings.FCM_CREDENTIALS_PATH)
+
+    def get_credentials(self):
+        if self.credentials is None:
+            with open(settings.FCM_CREDENTIALS_PATH) as credentials_file:
+                self.credentials = json.load(credentials_file)
+        return self.credentials
+
+    def request_access_token(self):
+        credentials = self.get_credentials()
+        now = int(time.time())
+        assertion = jwt.encode({
+            'iss': credentials['client_email'],
+            'scope': self.scope,
+            'aud': credentials['token_uri'],
+            'iat': now,
+            'exp': now + 3600,
+        }, credentials['private_key'], algorithm='RS256')
+        if isinstance(assertion, bytes):
+            assertion = assertion.decode()
+
+        response = self.session.post(credentials['token_uri'], data={
+            'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+            'assertion': assertion,
+        }, timeout=settings.PUSH_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        token = response.json()
+        return token['access_token'], token['expires_in']
+
+    def send_notification(self, notification):
+        title, body = get_alert(notification.payload)
+        project = self.get_credentials()['project_id']
+        response = self.post(
+            f'https://fcm.googleapis.com/v1/projects/{project}'
+            f'/messages:send',
+            json={'message': {
+                'token': notification.token,
+                'notification': {'title': title, 'body': body},
+                'android': {'notification': {
+                    'sound': notification.payload.sound}},
+            }})
+        if response.status_code == 200:
+            return 'Success'
+        return self.get_error(response)
+
+    def get_error(self, response):
+        """Return the FCM error code of a rejected request, e.g.
+        UNREGISTERED, or else its status"""
+        try:
+            error = response.json()['error']
+        except (ValueError, KeyError, TypeError):
+            return f'HTTP {response.status_code}'
+        for detail in error.get('details', ()):
+            if 'errorCode' in detail:
+                return detail['errorCode']
+        return error.get('status', f'HTTP {response.status_code}')
+
+
+class LocalFCMBackend(LocalPushBackend):
+    """Stand-in for FCM in tests, with the batch size of FCM"""
+    batch_size = FCMBackend.batch_size
+    invalid_token_reasons = FCMBackend.invalid_token_reasons
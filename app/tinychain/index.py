@@ -0,0 +1,162 @@
+import bisect
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN
+
+
+# Alert.limit is stored with 5 decimal places
+DECIMAL_PLACES = 5
+
+
+class Thresholds:
+    """Alert ids kept sorted by the limit of the alert"""
+
+    def __init__(self):
+        self.limits = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def insert(self, limit, alert_id):
+        position = bisect.bisect_right(self.limits, limit)
+        self.limits.insert(position, limit)
+        self.ids.insert(position, alert_id)
+
+    def below(self, value):
+        """Return the ids of the alerts with a limit below value"""
+        return self.ids[:bisect.bisect_left(self.limits, value)]
+
+    def above(self, value):
+        """Return the ids of the alerts with a limit above value"""
+        return self.ids[bisect.bisect_right(self.limits, value):]
+
+    def between(self, low, high, inclusive_high):
+        """Return the ids of the alerts with low <= limit < high, or
+        low < limit <= high when inclusive_high is set"""
+        find = bisect.bisect_right if inclusive_high else bisect.bisect_left
+        return self.ids[find(self.limits, low):find(self.limits, high)]
+
+
+def to_fixed(value, rounding=ROUND_HALF_EVEN):
+    """Return value as an integer number of 1e-5 units"""
+    return int(Decimal(value).scaleb(DECIMAL_PLACES).to_integral_value(
+        rounding))
+
+
+def to_fixed_price(price):
+    """Return the price rounded down and up to fixed point
+
+    A limit is below the price exactly when it is below the rounded up price
+    and above it exactly when it is above the rounded down price, so prices
+    with more decimals than the limits still compare exactly.
+    """
+    return to_fixed(price, ROUND_FLOOR), to_fixed(price, ROUND_CEILING)
+
+
+class PairIndex:
+    """Thresholds of all alerts on a single coinpair
+
+    Limits are kept as fixed point integers, prices are passed in as the
+    (floor, ceiling) pair returned by to_fixed_price.
+    """
+
+    def __init__(self):
+        self.higher = Thresholds()
+        self.lower = Thresholds()
+        self.limits = {}
+        self.max_id = 0
+        # the number of alerts of the pair when the index was brought up to
+        # date, deleted alerts are not removed from the index
+        self.count = 0
+        self.version = None
+
+    def __len__(self):
+        return len(self.limits)
+
+    def thresholds(self, indicator):
+        if '>' in indicator:
+            return self.higher
+        if '<' in indicator:
+            return self.lower
+        return None
+
+    def insert(self, alert_id, indicator, limit):
+        if alert_id in self.limits:
+            return
+        limit = to_fixed(limit)
+        thresholds = self.thresholds(indicator)
+        if thresholds is not None:
+            thresholds.insert(limit, alert_id)
+        self.limits[alert_id] = (thresholds, limit)
+        self.max_id = max(self.max_id, alert_id)
+
+    def is_active(self, alert_id, price):
+        """Return True when the alert is active at price"""
+        thresholds, limit = self.limits.get(alert_id, (None, None))
+        if thresholds is self.higher:
+            return limit < price[1]
+        if thresholds is self.lower:
+            return limit > price[0]
+        return False
+
+    def active(self, price):
+        """Return the ids of all alerts that are active at price"""
+        return set(self.higher.below(price[1])) | \
+            set(self.lower.above(price[0]))
+
+    def crossed(self, previous, price):
+        """Return the ids that become active and inactive when the price
+        moves from previous to price"""
+        activated = set()
+        deactivated = set()
+
+        if price[1] > previous[1]:
+            activated.update(
+                self.higher.between(previous[1], price[1], False))
+        elif price[1] < previous[1]:
+            deactivated.update(
+                self.higher.between(price[1], previous[1], False))
+
+        if price[0] > previous[0]:
+            deactivated.update(
+                self.lower.between(previous[0], price[0], True))
+        elif price[0] < previous[0]:
+            activated.update(
+                self.lower.between(price[0], previous[0], True))
+
+        return activated, deactivated
+
+
+class ThresholdIndex:
+    """In-memory index of alert limits per coinpair
+
+    A pair is loaded from the database and tagged with the version of its
+    limits, it is loaded again when the version changed. Alerts created since
+    are inserted, deleted alerts stay in the index until the pair is loaded
+    again, their ids are simply no longer read.
+    """
+
+    def __init__(self):
+        self.pairs = {}
+
+    def __contains__(self, coinpair):
+        return coinpair in self.pairs
+
+    def get(self, coinpair):
+        return self.pairs.get(coinpair)
+
+    def load(self, coinpair, rows, version=None):
+        """Replace the pair with (id, indicator, limit) rows"""
+        pair_index = PairIndex()
+        for alert_id, indicator, limit in sorted(rows, key=lambda r: r[2]):
+            pair_index.insert(alert_id, indicator, limit)
+        pair_index.version = version
+
+        self.pairs[coinpair] = pair_index
+        return pair_index
+
+    def clear(self):
+        self.pairs.clear()
+
+
+# Index shared by everything running in this process
+alert_index = ThresholdIndex()
@@ -0,0 +1,22 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from tinychain.streaming import PriceStream
+
+
+class Command(BaseCommand):
+    """Django command to evaluate alerts on streamed price updates"""
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        self.stdout.write('Streaming prices...')
+        stream = PriceStream()
+
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stream.stop)
+        loop.run_until_complete(stream.run())
+
+        self.stdout.write(self.style.SUCCESS('Price stream stopped'))
@@ -0,0 +1,176 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from app.logger import get_module_logger
+from core.models import Alert
+from tinychain.events import publish_prices
+
+import krakenex
+
+
+logger = get_module_logger(__name__)
+
+# Kraken fails a ticker call as a whole when one of its pairs is unknown
+UNKNOWN_PAIR_ERROR = 'EQuery:Unknown asset pair'
+
+
+class PriceCache:
+    """Kraken prices shared by all processes through the cache
+
+    Every coinpair is stored with its fetch time and expires after
+    PRICE_CACHE_TTL seconds. Refreshing a pair takes a short lock in the
+    cache, so concurrent misses in different processes cause a single
+    upstream call while the others wait for its result. The coinpairs that
+    have alerts are kept in the cache too, stored by every run of the
+    refresher and read again from the database when they expire.
+    """
+
+    kraken = krakenex.API()
+    coinpairs_key = 'prices:coinpairs'
+
+    def get_coinpairs(self):
+        """Return the sorted coinpairs that have alerts"""
+        coinpairs = cache.get(self.coinpairs_key)
+        if coinpairs is None:
+            coinpairs = self.store_coinpairs(
+                Alert.objects.values_list('coinpair', flat=True).distinct())
+        return coinpairs
+
+    def store_coinpairs(self, coinpairs):
+        coinpairs = sorted(coinpairs)
+        cache.set(self.coinpairs_key, coinpairs, settings.PRICE_CACHE_TTL)
+        return coinpairs
+
+    def get_prices(self, coinpairs):
+        """Return the {coinpair: price} map, refreshing missing pairs"""
+        return {coinpair: Decimal(entry['price'])
+                for coinpair, entry in self.get_entries(coinpairs).items()}
+
+    def get_entries(self, coinpairs):
+        """Return {coinpair: {'price', 'fetched_at'}} for the coinpairs"""
+        entries = self.get_cached(coinpairs)
+        missing = [coinpair for coinpair in coinpairs
+                   if coinpair not in entries]
+        if missing:
+            self.refresh(missing)
+            entries.update(self.get_cached(missing))
+
+        return entries
+
+    def get_cached(self, coinpairs):
+        cached = cache.get_many([self.key(coinpair)
+                                 for coinpair in coinpairs])
+        return {coinpair: cached[self.key(coinpair)]
+                for coinpair in coinpairs if self.key(coinpair) in cached}
+
+    def refresh(self, coinpairs):
+        """Fetch the coinpairs from Kraken, return the {coinpair: price} map
+
+        Pairs that are being fetched by another process are not requested
+        again, their price is read from the cache once it is stored.
+        """
+        locked = [coinpair for coinpair in coinpairs
+                  if cache.add(self.lock_key(coinpair), True,
+                               settings.PRICE_CACHE_LOCK_TIMEOUT)]
+
+        prices = {}
+        if locked:
+            try:
+                prices = self.fetch(locked)
+                self.store(prices)
+            finally:
+                cache.delete_many([self.lock_key(coinpair)
+                                   for coinpair in locked])
+
+        waiting = [coinpair for coinpair in coinpairs
+                   if coinpair not in locked]
+        if waiting:
+            prices.update(self.wait_for(waiting))
+
+        return prices
+
+    def wait_for(self, coinpairs):
+        deadline = time.monotonic() + settings.PRICE_CACHE_LOCK_TIMEOUT
+        entries = self.get_cached(coinpairs)
+        while len(entries) < len(coinpairs) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            entries = self.get_cached(coinpairs)
+
+        return {coinpair: Decimal(entry['price'])
+                for coinpair, entry in entries.items()}
+
+    def store(self, prices):
+        """Store a {coinpair: price} map that was just received"""
+        fetched_at = time.time()
+        cache.set_many({
+            self.key(coinpair): {'price': str(price),
+                                 'fetched_at': fetched_at}
+            for coinpair, price in prices.items()
+        }, timeout=settings.PRICE_CACHE_TTL)
+        publish_prices(prices)
+
+    def key(self, coinpair):
+        return f'prices:{coinpair}'
+
+    def lock_key(self, coinpair):
+        return f'prices:{coinpair}:lock'
+
+    def unknown_key(self, ticker):
+        return f'prices:unknown:{ticker}'
+
+    def fetch(self, coinpairs):
+        """Return a {coinpair: price} map, one ticker call per batch"""
+        tickers = {self.create_ticker_pair(coinpair): coinpair
+                   for coinpair in coinpairs}
+        unknown = cache.get_many([self.unknown_key(ticker)
+                                  for ticker in tickers])
+        names = sorted(ticker for ticker in tickers
+                       if self.unknown_key(ticker) not in unknown)
+        batch_size = settings.KRAKEN_TICKER_BATCH_SIZE
+
+        prices = {}
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            for ticker, price in self.get_pair_prices(batch).items():
+                prices[tickers[ticker]] = Decimal(price)
+
+        missing = sorted(set(tickers.values()) - set(prices))
+        if missing:
+            logger.warning(f'No price found for {", ".join(missing)}')
+
+        return prices
+
+    def create_ticker_pair(self, coinpair):
+        return f"X{coinpair.replace(':', 'Z')}"
+
+    def get_pair_prices(self, tickers):
+        """Query the ticker of several pairs in a single request
+
+        A request that fails on an unknown pair is split in halves until the
+        unknown pairs are found, they are left out of the next requests for
+        KRAKEN_UNKNOWN_PAIR_TTL seconds.
+        """
+        result = self.kraken.query_public('Ticker',
+                                          {'pair': ','.join(tickers)})
+        errors = result.get('error') or []
+        if any(error.startswith(UNKNOWN_PAIR_ERROR) for error in errors):
+            if len(tickers) == 1:
+                logger.warning(f'Kraken does not know pair {tickers[0]}')
+                cache.set(self.unknown_key(tickers[0]), True,
+                          settings.KRAKEN_UNKNOWN_PAIR_TTL)
+                return {}
+
+            middle = len(tickers) // 2
+            prices = self.get_pair_prices(tickers[:middle])
+            prices.update(self.get_pair_prices(tickers[middle:]))
+            return prices
+
+        if errors:
+            logger.warning(f'Kraken ticker error: {errors}')
+
+        pairs = result.get('result') or {}
+        return {ticker: pairs[ticker].get('a')[0]
+                for ticker in tickers if ticker in pairs}
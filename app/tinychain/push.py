@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from apns2.client import APNsClient
+from apns2.credentials import TokenCredentials
+from apns2.payload import PayloadAlert
+from django.conf import settings
+from django.utils.module_loading import import_string
+from hyper.http20.exceptions import HTTP20Error
+from requests.adapters import HTTPAdapter
+
+from app.logger import get_module_logger
+
+
+logger = get_module_logger(__name__)
+
+
+# Reasons APNs gives for tokens that will never be delivered to again
+APNS_INVALID_TOKEN_REASONS = frozenset({'BadDeviceToken', 'Unregistered'})
+
+
+def get_reason(result):
+    """Return the reason of a result, apns2 returns ('Unregistered',
+    timestamp) for an unregistered token"""
+    return result[0] if isinstance(result, tuple) else result
+
+
+def get_alert(payload):
+    """Return the (title, body) of the alert of an APNs payload"""
+    if isinstance(payload.alert, PayloadAlert):
+        return payload.alert.title or '', payload.alert.body or ''
+    return '', payload.alert or ''
+
+
+class PushBackend:
+    """Sends batches of notifications to a push service
+
+    batch_size is the most notifications the service takes at once, None
+    when a batch can be of any size. invalid_token_reasons are the results
+    of tokens the service will never deliver to again.
+    """
+    batch_size = None
+    invalid_token_reasons = frozenset()
+
+    def is_configured(self):
+        """Return whether the settings to send with the backend are set"""
+        return True
+
+    def send(self, notifications, topic):
+        """Send the notifications in batches, return the result per token
+
+        The tokens of a batch that could not be sent get the error as their
+        result, whatever the error, so the other batches and backends are
+        still sent and their results recorded.
+        """
+        results = {}
+        size = self.batch_size or len(notifications) or 1
+        for start in range(0, len(notifications), size):
+            batch = notifications[start:start + size]
+            try:
+                results.update(self.send_notification_batch(batch, topic))
+            except Exception as error:
+                logger.exception(f'Could not send notifications with '
+                                 f'{type(self).__name__}: {error}')
+                results.update(dict.fromkeys(
+                    (notification.token for notification in batch),
+                    f'{type(error).__name__}: {error}'))
+        return results
+
+    def send_notification_batch(self, notifications, topic):
+        """Send the notifications, return the result per token"""
+        raise NotImplementedError
+
+    def is_invalid_token(self, result):
+        return get_reason(result) in self.invalid_token_reasons
+
+    def close(self):
+        pass
+
+
+class LocalPushBackend(PushBackend):
+    """Stand-in for a push service in tests
+
+    The batches are kept in sent instead of being sent. The tokens in
+    results get their result, all other tokens 'Success'.
+    """
+    sent = []
+    results = {}
+
+    def send_notification_batch(self, notifications, topic):
+        LocalPushBackend.sent.append((self, list(notifications)))
+        return {notification.token:
+                LocalPushBackend.results.get(notification.token, 'Success')
+                for notification in notifications}
+
+    @classmethod
+    def reset(cls):
+        cls.sent = []
+        cls.results = {}
+
+
+class HTTPPushBackend(PushBackend):
+    """Backend of a push service that takes one HTTP request per device
+
+    The requests of a batch are sent from PUSH_HTTP_THREADS threads over a
+    pool of kept alive connections, authorized with an OAuth access token
+    that is reused until it is about to expire.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_maxsize=settings.PUSH_HTTP_THREADS))
+        self.access_token = None
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def send_notification_batch(self, notifications, topic):
+        # a batch the service does not authorize is not sent at all
+        self.get_access_token()
+        with ThreadPoolExecutor(settings.PUSH_HTTP_THREADS) as executor:
+            results = executor.map(self.send_one, notifications)
+            return {notification.token: result
+                    for notification, result in zip(notifications, results)}
+
+    def send_one(self, notification):
+        try:
+            return self.send_notification(notification)
+        except (OSError, ValueError) as error:
+            return f'{type(error).__name__}: {error}'
+
+    def send_notification(self, notification):
+        """Send one notification, return 'Success' or the reason it was
+        rejected"""
+        raise NotImplementedError
+
+    def post(self, url, **kwargs):
+        """POST with the access token, with a new token once when the
+        service no longer accepts it"""
+        headers = kwargs.pop('headers', {})
+        for retry in (False, True):
+            response = self.session.post(
+                url, timeout=settings.PUSH_REQUEST_TIMEOUT,
+                headers=dict(headers, Authorization=(
+                    f'Bearer {self.get_access_token(refresh=retry)}')),
+                **kwargs)
+            if response.status_code != 401:
+                break
+        return response
+
+    def get_access_token(self, refresh=False):
+        with self.lock:
+            if refresh or self.access_token is None or \
+                    self.expires < time.time():
+                self.access_token, expires_in = self.request_access_token()
+                # renewed a minute early, before requests start failing
+                self.expires = time.time() + int(expires_in) - 60
+            return self.access_token
+
+    def request_access_token(self):
+        """Return a new (access token, seconds it is valid)"""
+        raise NotImplementedError
+
+    def close(self):
+        self.session.close()
+
+
+class APNsConnection(PushBackend):
+    """APNs client shared by all notifications sent from this process
+
+    The client keeps its HTTP/2 connection open between batches and the
+    credentials only sign a new provider token when the previous one is
+    about to expire. The client is recreated after a fork, so every Celery
+    worker process holds its own connection.
+    """
+    invalid_token_reasons = APNS_INVALID_TOKEN_REASONS
+
+    def __init__(self):
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None or self.pid != os.getpid():
+                credentials = TokenCredentials(
+                    auth_key_path=settings.PUSH_AUTH_KEY_PATH,
+                    auth_key_id=settings.PUSH_AUTH_KEY_ID,
+                    team_id=settings.PUSH_AUTH_TEAM_ID,
+                    token_lifetime=settings.PUSH_TOKEN_LIFETIME)
+
+                self.client = APNsClient(credentials=credentials,
+                                         use_sandbox=True)
+                self.pid = os.getpid()
+
+            return self.client
+
+    def send_notification_batch(self, notifications, topic):
+        """Send the batch, reconnecting once when the connection dropped"""
+        try:
+            return self.get_client().send_notification_batch(
+                notifications=notifications, topic=topic)
+        except (OSError, HTTP20Error) as error:
+            logger.warning(f'APNs connection lost, reconnecting: {error}')
+            self.close()
+
+        return self.get_client().send_notification_batch(
+            notifications=notifications, topic=topic)
+
+    def close(self):
+        with self.lock:
+            client, self.client = self.client, None
+            if client is not None and self.pid == os.getpid():
+                try:
+                    client._connection.close()
+                except (OSError, HTTP20Error):
+                    pass
+
+
+# Backends shared by everything running in this process, by dotted path
+backends = {}
+backends_lock = threading.Lock()
+
+
+def get_push_backend(path):
+    with backends_lock:
+        backend = backends.get(path)
+        if backend is None:
+            backend = backends[path] = import_string(path)()
+        return backend
+
+
+def get_push_backends():
+    """Return the backend of every device type in PUSH_BACKENDS, leaving
+    out the backends that are not configured"""
+    push_backends = {}
+    for device_type, path in settings.PUSH_BACKENDS.items():
+        backend = get_push_backend(path)
+        if backend.is_configured():
+            push_backends[device_type] = backend
+        else:
+            logger.warning(f'Push backend {path} of {device_type} is not '
+                           f'configured, disabled')
+    return push_backends
+
+
+def send_notifications(notifications, topic, push_backends):
+    """Send {device_type: [notification]} with the backends of the device
+    types, all backends at the same time, return the result per token"""
+    results = {}
+    batches = defaultdict(list)
+    for device_type, device_notifications in notifications.items():
+        backend = push_backends.get(device_type)
+        if backend is None:
+            logger.warning(f'No push backend for {device_type}')
+            results.update(dict.fromkeys(
+                (notification.token for notification in device_notifications),
+                f'No push backend for {device_type}'))
+        else:
+            batches[backend].extend(device_notifications)
+
+    if len(batches) == 1:
+        [(backend, backend_notifications)] = batches.items()
+        results.update(backend.send(backend_notifications, topic))
+    elif batches:
+        with ThreadPoolExecutor(len(batches)) as executor:
+            for backend_results in executor.map(
+                    lambda batch: batch[0].send(batch[1], topic),
+                    batches.items()):
+                results.update(backend_results)
+    return results
+
+
+def close_push_backends():
+    with backends_lock:
+        for backend in backends.values():
+            backend.close()
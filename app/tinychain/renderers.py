@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+import msgpack
+import orjson
+from rest_framework.utils import encoders
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer that encodes with orjson
+
+    Renders the same bytes as JSONRenderer for compact output that does not
+    escape non ASCII characters, which is the default, except that NaN and
+    infinite floats become null. Indented or ASCII escaped output and
+    values orjson cannot encode, such as lone surrogates, are rendered by
+    JSONRenderer instead.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | \
+        orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+
+        # Escape the line and paragraph separators like JSONRenderer does
+        return ret.replace('\u2028'.encode(), b'\\u2028') \
+                  .replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renderer for clients that accept application/msgpack
+
+    Decimals are encoded as strings, like the serializers represent them in
+    JSON, other types that are not native to MessagePack like JSONRenderer
+    encodes them.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self.encode, use_bin_type=True)
+
+    def encode(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return encoders.JSONEncoder().default(obj)
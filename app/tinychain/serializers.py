@@ -1,8 +1,30 @@
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from core.models import Alert, DeviceToken
 
 
+class AlertListSerializer(serializers.ListSerializer):
+    """Serializer for a batch of Alert objects created at once"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and \
+                len(data) > settings.ALERT_BULK_MAX_SIZE:
+            raise serializers.ValidationError({
+                'non_field_errors': [
+                    f'Ensure this list has no more than '
+                    f'{settings.ALERT_BULK_MAX_SIZE} alerts.'
+                ]
+            })
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        alerts = [Alert(**attrs) for attrs in validated_data]
+        return Alert.objects.bulk_create(
+            alerts, batch_size=settings.ALERT_BATCH_SIZE)
+
+
 class AlertSerializer(serializers.ModelSerializer):
     """Serializer for Alert objects"""
 
@@ -10,6 +32,42 @@ class AlertSerializer(serializers.ModelSerializer):
         model = Alert
         fields = ('id', 'exchange', 'coinpair', 'indicator', 'limit',)
         read_only_fields = ('id',)
+        list_serializer_class = AlertListSerializer
+
+
+class AlertBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for the ids or the filter of the alerts to delete
+
+    Either form deletes at most ALERT_BULK_MAX_SIZE alerts, a filter is
+    counted against the queryset of the alerts of the user in the context.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                required=False, allow_empty=False)
+    exchange = serializers.CharField(required=False)
+    coinpair = serializers.CharField(required=False)
+    indicator = serializers.CharField(required=False)
+
+    def validate_ids(self, ids):
+        if len(ids) > settings.ALERT_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure this list has no more than '
+                f'{settings.ALERT_BULK_MAX_SIZE} ids.')
+        return ids
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError(
+                'Provide the ids or a filter of the alerts to delete.')
+
+        if 'ids' not in attrs:
+            max_size = settings.ALERT_BULK_MAX_SIZE
+            matches = self.context['queryset'].filter(**attrs) \
+                                              .values('id')[:max_size + 1]
+            if len(matches) > max_size:
+                raise serializers.ValidationError(
+                    f'The filter matches more than {max_size} alerts, '
+                    f'delete them by ids or with a narrower filter.')
+        return attrs
 
 
 class DeviceTokenSerializer(serializers.ModelSerializer):
@@ -19,3 +77,61 @@ class DeviceTokenSerializer(serializers.ModelSerializer):
         model = DeviceToken
         fields = ('id', 'token', 'device_type',)
         read_only_fields = ('id',)
+
+
+class PriceSerializer(serializers.Serializer):
+    """Serializer for cached coinpair prices"""
+    coinpair = serializers.CharField()
+    price = serializers.CharField()
+    fetched_at = serializers.DateTimeField()
+
+
+class RowSerializer:
+    """Represent .values() rows exactly like a ModelSerializer represents
+    model instances
+
+    Values of string, integer and choice fields are passed on as read,
+    decimals that already have the decimal places of the field are only
+    formatted. Every other field converts its values with the field itself.
+    """
+    PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField,
+                          serializers.ChoiceField, serializers.ReadOnlyField)
+
+    def __init__(self, serializer_class):
+        self.fields = [
+            (name, field.source, self.get_converter(field))
+            for name, field in serializer_class().fields.items()
+            if not field.write_only
+        ]
+        self.sources = [source for name, source, convert in self.fields]
+
+    def get_converter(self, field):
+        if type(field) in self.PASSTHROUGH_FIELDS:
+            return None
+        if type(field) is serializers.DecimalField:
+            return self.get_decimal_converter(field)
+        return field.to_representation
+
+    def get_decimal_converter(self, field):
+        coerce_to_string = getattr(field, 'coerce_to_string',
+                                   api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce_to_string or field.localize or \
+                field.decimal_places is None:
+            return field.to_representation
+
+        exponent = -field.decimal_places
+
+        def to_representation(value):
+            if value.as_tuple().exponent != exponent:
+                return field.to_representation(value)
+            return format(value, 'f')
+
+        return to_representation
+
+    def to_representation(self, rows):
+        return [
+            {name: row[source] if convert is None or row[source] is None
+             else convert(row[source])
+             for name, source, convert in self.fields}
+            for row in rows
+        ]
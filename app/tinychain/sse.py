@@ -0,0 +1,154 @@
+import asyncio
+import json
+
+from django.conf import settings
+from rest_framework import exceptions
+
+from app.async_views import run_in_database_thread
+from core.models import Alert
+from tinychain.events import Subscription, event_hub, get_broker, \
+    parse_event_id, price_event
+from tinychain.prices import PriceCache
+from user.authentication import CachedTokenAuthentication
+
+
+def format_event(event):
+    """Return the Server-Sent Events message of an event"""
+    lines = []
+    if event.get('id'):
+        lines.append(f'id: {event["id"]}')
+    lines.append(f'event: {event["event"]}')
+    lines.append(f'data: {json.dumps(event["data"], separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class AlertEventStream:
+    """ASGI application that streams the alert and price events of the
+    authenticated user as Server-Sent Events
+
+    A connection first receives the cached prices of the coinpairs of the
+    user and, when it sends Last-Event-ID, the alert events it missed. An
+    idle connection only holds a queue and sends a comment every
+    ALERT_EVENTS_HEARTBEAT seconds.
+    """
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope['headers'])
+        user = await run_in_database_thread(
+            self.authenticate, headers.get(b'authorization', b''))
+        if user is None:
+            await self.send_unauthorized(send)
+            return
+
+        broker = get_broker()
+        broker.start(event_hub)
+        coinpairs = await run_in_database_thread(self.get_coinpairs, user)
+        subscription = Subscription(user.id, coinpairs)
+        event_hub.subscribe(subscription)
+        try:
+            last_event_id = headers.get(b'last-event-id', b'').decode('latin1')
+            events = await run_in_database_thread(
+                self.get_initial_events, broker, user, coinpairs,
+                last_event_id)
+
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            position = parse_event_id(last_event_id)
+            for event in events:
+                position = await self.send_event(send, event, position)
+            await self.stream(subscription, receive, send, position)
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    def authenticate(self, header):
+        auth = header.split()
+        if len(auth) != 2 or auth[0].lower() != b'token':
+            return None
+        try:
+            user, token = CachedTokenAuthentication().authenticate_credentials(
+                auth[1].decode('latin1'))
+        except exceptions.AuthenticationFailed:
+            return None
+        return user
+
+    def get_coinpairs(self, user):
+        return list(Alert.objects.filter(user=user)
+                                 .values_list('coinpair', flat=True)
+                                 .distinct())
+
+    def get_initial_events(self, broker, user, coinpairs, last_event_id):
+        prices = PriceCache().get_cached(coinpairs)
+        events = [price_event(coinpair, entry['price'])
+                  for coinpair, entry in sorted(prices.items())]
+        if last_event_id:
+            events.extend(broker.history(user.id, last_event_id))
+        return events
+
+    async def stream(self, subscription, receive, send, position):
+        disconnected = asyncio.ensure_future(self.wait_disconnected(receive))
+        try:
+            while True:
+                getter = asyncio.ensure_future(subscription.get())
+                done, pending = await asyncio.wait(
+                    {getter, disconnected},
+                    timeout=settings.ALERT_EVENTS_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                if disconnected in done:
+                    return
+                if getter not in done:
+                    await send({'type': 'http.response.body',
+                                'body': b': keepalive\n\n',
+                                'more_body': True})
+                    continue
+
+                event = getter.result()
+                if event is None:
+                    # the client resumes from the last event it received
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                position = await self.send_event(send, event, position)
+        finally:
+            disconnected.cancel()
+
+    async def send_event(self, send, event, position):
+        """Send the event unless it was already sent, return the position
+        of the last alert event"""
+        event_position = parse_event_id(event.get('id'))
+        if event_position is not None:
+            if position is not None and event_position <= position:
+                return position
+            position = event_position
+
+        await send({'type': 'http.response.body',
+                    'body': format_event(event),
+                    'more_body': True})
+        return position
+
+    async def wait_disconnected(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def send_unauthorized(self, send):
+        body = json.dumps({'detail': str(
+            exceptions.NotAuthenticated.default_detail)}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'www-authenticate', b'Token'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+alert_event_stream = AlertEventStream()
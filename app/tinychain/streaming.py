@@ -0,0 +1,137 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import websockets
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from app.logger import get_module_logger
+from core.models import Alert
+from tinychain.alerting import AlertProcessor
+from tinychain.index import alert_index
+from tinychain.tasks import deliver_notifications
+
+
+logger = get_module_logger(__name__)
+
+
+class PriceStream:
+    """Evaluate alerts on every update of a streaming ticker feed
+
+    Subscribes to the ticker channel of the Kraken WebSocket API for every
+    coinpair that has alerts. Price updates are coalesced per pair, so a burst
+    of ticks for one pair is evaluated once with the latest price. The
+    delivery of triggered alerts is left to the notifications queue.
+    """
+
+    def __init__(self, url=None, processor=None, notify=None):
+        self.url = url or settings.PRICE_STREAM_URL
+        self.processor = processor or AlertProcessor(alert_index)
+        self.notify = notify or deliver_notifications.delay
+        self.subscribed = set()
+        self.pending = {}
+        self.updated = None
+        self.stopped = None
+
+    async def run(self):
+        """Consume the feed until stopped, reconnecting with backoff"""
+        self.updated = asyncio.Event()
+        self.stopped = asyncio.Event()
+        evaluator = asyncio.ensure_future(self.evaluate())
+        delay = settings.PRICE_STREAM_BACKOFF_MIN
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    async with websockets.connect(self.url) as websocket:
+                        delay = settings.PRICE_STREAM_BACKOFF_MIN
+                        await self.consume(websocket)
+                except (OSError, websockets.WebSocketException) as error:
+                    logger.warning(f'Price stream disconnected: {error}')
+
+                if self.stopped.is_set():
+                    break
+
+                logger.info(f'Reconnecting to price stream in {delay}s')
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, settings.PRICE_STREAM_BACKOFF_MAX)
+        finally:
+            evaluator.cancel()
+
+    def stop(self):
+        if self.stopped is not None:
+            self.stopped.set()
+
+    async def consume(self, websocket):
+        self.subscribed = set()
+        await self.subscribe(websocket)
+
+        while not self.stopped.is_set():
+            try:
+                message = await asyncio.wait_for(
+                    websocket.recv(), settings.PRICE_STREAM_REFRESH)
+            except asyncio.TimeoutError:
+                await self.subscribe(websocket)
+                continue
+
+            self.handle(json.loads(message))
+
+    async def subscribe(self, websocket):
+        """Subscribe to the pairs that got alerts since the last call"""
+        coinpairs = await sync_to_async(self.get_coinpairs)()
+        new_pairs = sorted(set(coinpairs) - self.subscribed)
+        if not new_pairs:
+            return
+
+        await websocket.send(json.dumps({
+            'event': 'subscribe',
+            'pair': [self.create_feed_pair(pair) for pair in new_pairs],
+            'subscription': {'name': 'ticker'},
+        }))
+        self.subscribed.update(new_pairs)
+
+    def handle(self, message):
+        """Record the ask price of ticker messages"""
+        if isinstance(message, dict):
+            if message.get('event') == 'subscriptionStatus' and \
+                    message.get('status') == 'error':
+                logger.warning(f'Subscription failed: '
+                               f'{message.get("errorMessage")}')
+            return
+
+        if len(message) < 4 or message[-2] != 'ticker':
+            return
+
+        coinpair = message[-1].replace('/', ':')
+        self.pending[coinpair] = Decimal(message[1]['a'][0])
+        self.updated.set()
+
+    async def evaluate(self):
+        while True:
+            await self.updated.wait()
+            self.updated.clear()
+            prices, self.pending = self.pending, {}
+            try:
+                await sync_to_async(self.process_prices)(prices)
+            except Exception:
+                logger.exception('Could not evaluate streamed prices')
+
+    def process_prices(self, prices):
+        close_old_connections()
+        self.processor.prices.store(prices)
+        stats = self.processor.process_prices(prices)
+        if stats['changed']:
+            self.notify()
+        return stats
+
+    def get_coinpairs(self):
+        return list(Alert.objects.values_list('coinpair', flat=True)
+                                 .distinct())
+
+    def create_feed_pair(self, coinpair):
+        return coinpair.replace(':', '/')
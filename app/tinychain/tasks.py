@@ -1,13 +1,71 @@
 # main/tasks.py
+import zlib
+
+from celery import chord
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+
 from app.celery import app
+from core.models import Alert
 
 from tinychain import alerting
+from tinychain.index import alert_index
+from tinychain.prices import PriceCache
+from tinychain.push import close_push_backends
 
 
 @app.task
 def process_alerts():
-    alertProcessor = alerting.AlertProcessor()
-    alertProcessor.process()
+    """Fan out the evaluation of the alerts over one task per shard"""
+    coinpairs = list(Alert.objects.values_list('coinpair', flat=True)
+                                  .distinct())
+    PriceCache().store_coinpairs(coinpairs)
+    shards = shard_coinpairs(coinpairs, settings.ALERT_SHARD_COUNT)
+    if shards:
+        chord(process_alert_shard.s(shard) for shard in shards)(
+            notify_alerts.s())
+
+
+@app.task
+def process_alert_shard(coinpairs):
+    alertProcessor = alerting.AlertProcessor(alert_index)
+    return alertProcessor.process(coinpairs)
+
+
+@app.task
+def notify_alerts(shard_stats):
+    """Start the delivery of the notifications queued by the shards"""
+    deliver_notifications.delay()
 
+    return {
+        'shards': len(shard_stats),
+        'scanned': sum(stats['scanned'] for stats in shard_stats),
+        'changed': sum(stats['changed'] for stats in shard_stats),
+    }
+
+
+@app.task
+def deliver_notifications():
+    """Deliver the due notifications of the outbox, batch by batch"""
     notifier = alerting.Notifier()
-    notifier.notifyAlerts()
+    totals = {'claimed': 0, 'sent': 0, 'retried': 0, 'dead': 0}
+    while True:
+        stats = notifier.notifyAlerts()
+        for key in totals:
+            totals[key] += stats[key]
+        if stats['claimed'] < settings.NOTIFICATION_BATCH_SIZE:
+            return totals
+
+
+def shard_coinpairs(coinpairs, shard_count):
+    """Split the coinpairs in at most shard_count stable groups"""
+    shards = [[] for _ in range(shard_count)]
+    for coinpair in sorted(coinpairs):
+        shards[zlib.crc32(coinpair.encode()) % shard_count].append(coinpair)
+
+    return [shard for shard in shards if shard]
+
+
+@worker_process_shutdown.connect
+def close_push_connection(**kwargs):
+    close_push_backends()
@@ -1,7 +1,15 @@
-from django.contrib.auth import get_user_model
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-from core.models import Alert, DeviceToken, NotificationHistory
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Alert, DeviceToken, NotificationHistory, \
+    NotificationOutbox
 from tinychain.alerting import AlertProcessor, Notifier
 
 from unittest.mock import patch
@@ -11,6 +19,7 @@ class AlertProcessorTest(TestCase):
     """Test processing the alerts"""
 
     def setUp(self):
+        cache.clear()
         self.user = get_user_model().objects.create_user(
             'test@simpletechture.nl',
             'test123'
@@ -128,6 +137,398 @@ class AlertProcessorTest(TestCase):
         self.assertFalse(alert.is_active)
         self.assertFalse(alert.is_notified)
 
+    @patch('krakenex.API.query_public')
+    def test_price_fetched_once_per_pair(self, mock_query_public):
+        """Test that alerts on the same pair share one ticker call"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        for limit in (100.00, 150.00, 300.00):
+            Alert.objects.create(user=self.user,
+                                 exchange='Kraken',
+                                 coinpair='XBT:EUR',
+                                 indicator='>',
+                                 limit=limit)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        self.assertEqual(mock_query_public.call_count, 1)
+        self.assertEqual(Alert.objects.filter(is_active=True).count(), 2)
+
+    @patch('krakenex.API.query_public')
+    def test_distinct_pairs_batched(self, mock_query_public):
+        """Test that distinct pairs are requested in one batched call"""
+
+        mock_query_public.return_value = {
+            'error': [],
+            'result': {
+                'XXBTZEUR': {'a': ['9000.0', '1', '1.000']},
+                'XETHZEUR': {'a': ['200.0', '1', '1.000']},
+            }
+        }
+
+        btc = Alert.objects.create(user=self.user,
+                                   exchange='Kraken',
+                                   coinpair='XBT:EUR',
+                                   indicator='>',
+                                   limit=8000.00)
+        eth = Alert.objects.create(user=self.user,
+                                   exchange='Kraken',
+                                   coinpair='ETH:EUR',
+                                   indicator='<',
+                                   limit=150.00)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        mock_query_public.assert_called_once_with(
+            'Ticker', {'pair': 'XETHZEUR,XXBTZEUR'})
+        btc.refresh_from_db()
+        eth.refresh_from_db()
+        self.assertTrue(btc.is_active)
+        self.assertFalse(eth.is_active)
+
+    @patch('krakenex.API.query_public')
+    def test_unknown_pair_skipped(self, mock_query_public):
+        """Test that an unknown pair fails only its own alerts and is not
+        requested again"""
+
+        def query_public(method, data):
+            if 'XDOGEZEUR' in data['pair']:
+                return {'error': ['EQuery:Unknown asset pair']}
+            return self.generate_json(200.0)
+
+        mock_query_public.side_effect = query_public
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='DOGE:EUR',
+                                     indicator='>',
+                                     limit=0.10,
+                                     is_active=True)
+        btc = Alert.objects.create(user=self.user,
+                                   exchange='Kraken',
+                                   coinpair='XBT:EUR',
+                                   indicator='>',
+                                   limit=100.00)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        alert.refresh_from_db()
+        btc.refresh_from_db()
+        self.assertTrue(alert.is_active)
+        self.assertTrue(btc.is_active)
+
+        cache.delete('prices:XBT:EUR')
+        mock_query_public.reset_mock()
+        alert_processor.process()
+
+        mock_query_public.assert_called_once_with(
+            'Ticker', {'pair': 'XXBTZEUR'})
+
+    @patch('krakenex.API.query_public')
+    def test_unchanged_alerts_not_written(self, mock_query_public):
+        """Test that only alerts whose state changed are written back"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='>',
+                             limit=100.00)
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='<',
+                             limit=100.00)
+
+        alert_processor = AlertProcessor()
+        stats = alert_processor.process()
+        self.assertEqual(stats, {'scanned': 2, 'changed': 1})
+
+        stats = alert_processor.process()
+        self.assertEqual(stats, {'scanned': 0, 'changed': 0})
+        self.assertEqual(alert_processor.rows_changed, 0)
+
+    @patch('krakenex.API.query_public')
+    def test_only_crossed_alerts_read(self, mock_query_public):
+        """Test that a price move only reads the alerts it crossed"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        crossed = Alert.objects.create(user=self.user,
+                                       exchange='Kraken',
+                                       coinpair='XBT:EUR',
+                                       indicator='>',
+                                       limit=250.00)
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='>',
+                             limit=400.00)
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='<',
+                             limit=100.00)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        mock_query_public.return_value = self.generate_json(300.0)
+        stats = alert_processor.process()
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        crossed.refresh_from_db()
+        self.assertTrue(crossed.is_active)
+        self.assertEqual(crossed.trigger_value, 300)
+
+    @patch('krakenex.API.query_public')
+    def test_unmoved_pair_skipped(self, mock_query_public):
+        """Test that a run without price moves only reads the signatures"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        for limit in (100.00, 250.00):
+            Alert.objects.create(user=self.user,
+                                 exchange='Kraken',
+                                 coinpair='XBT:EUR',
+                                 indicator='>',
+                                 limit=limit)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = alert_processor.process()
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(stats, {'scanned': 0, 'changed': 0})
+        self.assertEqual(alert_processor.pairs_skipped, 1)
+
+    @patch('krakenex.API.query_public')
+    def test_new_alert_evaluated(self, mock_query_public):
+        """Test that an alert created between runs is evaluated"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='>',
+                             limit=400.00)
+
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=100.00)
+        stats = alert_processor.process()
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_active)
+
+    @patch('krakenex.API.query_public')
+    def test_new_alert_inserted_in_index(self, mock_query_public):
+        """Test that an alert created between runs is added to the index
+        of its pair instead of loading the pair again"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='>',
+                             limit=400.00)
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+        pair_index = alert_processor.index.get('XBT:EUR')
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=300.00)
+        alert_processor.process()
+        mock_query_public.return_value = self.generate_json(350.0)
+        stats = alert_processor.process()
+
+        self.assertIs(alert_processor.index.get('XBT:EUR'), pair_index)
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_active)
+
+    @patch('krakenex.API.query_public')
+    def test_deleted_alert_not_rescanned(self, mock_query_public):
+        """Test that deleting an alert does not evaluate its pair again"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        alerts = [Alert.objects.create(user=self.user,
+                                       exchange='Kraken',
+                                       coinpair='XBT:EUR',
+                                       indicator='>',
+                                       limit=limit)
+                  for limit in (100.00, 150.00, 400.00)]
+        alert_processor = AlertProcessor()
+        alert_processor.process()
+
+        alerts[0].delete()
+        stats = alert_processor.process()
+        self.assertEqual(stats, {'scanned': 0, 'changed': 0})
+
+        mock_query_public.return_value = self.generate_json(50.0)
+        stats = alert_processor.process()
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+
+    @patch('krakenex.API.query_public')
+    def test_rescan_keeps_trigger_value(self, mock_query_public):
+        """Test that evaluating a pair again does not rewrite the alerts
+        that stay active"""
+
+        mock_query_public.return_value = self.generate_json(200.0)
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=100.00)
+        AlertProcessor().process()
+
+        cache.clear()
+        mock_query_public.return_value = self.generate_json(250.0)
+        stats = AlertProcessor().process()
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 0})
+        alert.refresh_from_db()
+        self.assertEqual(alert.trigger_value, 200)
+
+    @patch('krakenex.API.query_public')
+    def test_processors_share_evaluated_price(self, mock_query_public):
+        """Test that processes continue from each other's evaluation"""
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=250.00)
+        first = AlertProcessor()
+        second = AlertProcessor()
+
+        mock_query_public.return_value = self.generate_json(200.0)
+        first.process()
+        mock_query_public.return_value = self.generate_json(300.0)
+        second.process()
+        mock_query_public.return_value = self.generate_json(200.0)
+        first.process()
+
+        alert.refresh_from_db()
+        self.assertFalse(alert.is_active)
+
+    def test_late_committed_alert_evaluated(self):
+        """Test that an alert committed after a later id was evaluated is
+        found without a price move, and that it is in the index"""
+        for alert_id in (1, 3):
+            Alert.objects.create(id=alert_id,
+                                 user=self.user,
+                                 exchange='Kraken',
+                                 coinpair='XBT:EUR',
+                                 indicator='>',
+                                 limit=400.00)
+        alert_processor = AlertProcessor()
+        alert_processor.process_prices({'XBT:EUR': Decimal('100')})
+
+        late = Alert.objects.create(id=2,
+                                    user=self.user,
+                                    exchange='Kraken',
+                                    coinpair='XBT:EUR',
+                                    indicator='>',
+                                    limit=20.00)
+        stats = alert_processor.process_prices({'XBT:EUR': Decimal('100')})
+
+        self.assertEqual(stats['changed'], 1)
+        late.refresh_from_db()
+        self.assertTrue(late.is_active)
+
+        stats = alert_processor.process_prices({'XBT:EUR': Decimal('10')})
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        late.refresh_from_db()
+        self.assertFalse(late.is_active)
+
+    def test_locked_pair_skipped(self):
+        """Test that a pair evaluated by another process is left to it"""
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=250.00)
+        alert_processor = AlertProcessor()
+        cache.add(alert_processor.lock_key('XBT:EUR'), True)
+
+        stats = alert_processor.process_prices({'XBT:EUR': Decimal('300')})
+
+        self.assertEqual(stats, {'scanned': 0, 'changed': 0})
+        self.assertEqual(alert_processor.pairs_locked, 1)
+        self.assertIsNone(
+            cache.get(alert_processor.evaluated_key('XBT:EUR')))
+
+        cache.delete(alert_processor.lock_key('XBT:EUR'))
+        stats = alert_processor.process_prices({'XBT:EUR': Decimal('300')})
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        self.assertIsNone(cache.get(alert_processor.lock_key('XBT:EUR')))
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_active)
+
+    @patch('krakenex.API.query_public')
+    def test_triggered_alert_queued_once(self, mock_query_public):
+        """Test that an alert is queued for notification when it becomes
+        active and dropped from the queue when it is no longer active"""
+
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=250.00)
+        alert_processor = AlertProcessor()
+
+        mock_query_public.return_value = self.generate_json(300.0)
+        alert_processor.process()
+        mock_query_public.return_value = self.generate_json(310.0)
+        alert_processor.process()
+
+        self.assertEqual(list(NotificationOutbox.objects.values_list(
+            'alert', 'state', 'attempts')), [(alert.id, 'PENDING', 0)])
+
+        mock_query_public.return_value = self.generate_json(200.0)
+        alert_processor.process()
+
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_concurrent_trigger_queued_once(self):
+        """Test that an alert triggered by two evaluators at once is
+        queued once"""
+        alert = Alert.objects.create(user=self.user,
+                                     exchange='Kraken',
+                                     coinpair='XBT:EUR',
+                                     indicator='>',
+                                     limit=250.00,
+                                     is_active=True)
+
+        AlertProcessor().save_changed([alert], [alert])
+        AlertProcessor().save_changed([alert], [alert])
+
+        self.assertEqual(NotificationOutbox.objects.filter(
+            alert=alert, state=NotificationOutbox.States.PENDING).count(), 1)
+
     def generate_json(self, price):
         return {
             "error": [],
@@ -173,6 +574,7 @@ class AlertProcessorTest(TestCase):
         }
 
 
+@override_settings(PUSH_BACKENDS={'IOS': 'tinychain.push.APNsConnection'})
 class NotifierTest(TestCase):
 
     def setUp(self):
@@ -195,24 +597,197 @@ class NotifierTest(TestCase):
                                           limit=100.00,
                                           is_active=True,
                                           trigger_value=105.23)
+        NotificationOutbox.objects.create(alert=self.alert)
 
     @patch('apns2.client.APNsClient.send_notification_batch')
     def test_sending_notification(self, mock_send_notification_batch):
-        mock_send_notification_batch.return_value = {self.token: 'Succes'}
+        mock_send_notification_batch.return_value = {self.token: 'Success'}
 
         notifier = Notifier()
         notifier.notifyAlerts()
 
         number_records = NotificationHistory.objects.all().count()
         self.assertEqual(number_records, 1)
+        self.alert.refresh_from_db()
+        self.assertTrue(self.alert.is_notified)
 
     @patch('apns2.client.APNsClient.send_notification_batch')
     def test_not_send_already_active(self, mock_send_notification_batch):
-        mock_send_notification_batch.return_value = {self.token: 'Succes'}
+        mock_send_notification_batch.return_value = {self.token: 'Success'}
 
         notifier = Notifier()
         notifier.notifyAlerts()
-        notifier.notifyAlerts()
 
+        self.alert.refresh_from_db()
+        self.assertTrue(self.alert.is_notified)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+        stats = notifier.notifyAlerts()
+
+        self.assertEqual(stats['claimed'], 0)
+        mock_send_notification_batch.assert_called_once()
         number_records = NotificationHistory.objects.all().count()
         self.assertEqual(number_records, 1)
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_single_batch_to_all_tokens(self, mock_send_notification_batch):
+        """Test that every token of every user is sent in one batch"""
+        other_token = ('b636d7119f09b48e4540604838'
+                       'e06610b6e05918f41c15cd8036faf28aee4e38')
+        DeviceToken.objects.create(user=self.user,
+                                   device_type='IOS',
+                                   token=other_token)
+        user2 = get_user_model().objects.create_user(
+            'other@simpletechture.nl',
+            'test123'
+        )
+        user2_token = ('c636d7119f09b48e4540604838'
+                       'e06610b6e05918f41c15cd8036faf28aee4e38')
+        DeviceToken.objects.create(user=user2,
+                                   device_type='IOS',
+                                   token=user2_token)
+        alert2 = Alert.objects.create(user=user2,
+                                      exchange='Kraken',
+                                      coinpair='ETH:EUR',
+                                      indicator='<',
+                                      limit=150.00,
+                                      is_active=True,
+                                      trigger_value=148.10)
+        NotificationOutbox.objects.create(alert=alert2)
+        mock_send_notification_batch.return_value = {
+            self.token: 'Success',
+            other_token: 'BadDeviceToken',
+            user2_token: 'Success',
+        }
+
+        notifier = Notifier()
+        notifier.notifyAlerts()
+
+        mock_send_notification_batch.assert_called_once()
+        notifications = mock_send_notification_batch.call_args[1][
+            'notifications']
+        self.assertEqual({notification.token
+                          for notification in notifications},
+                         {self.token, other_token, user2_token})
+        self.assertEqual(Alert.objects.filter(is_notified=True).count(), 2)
+        self.assertEqual(NotificationHistory.objects.filter(
+            succeeded=True).count(), 2)
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_queries_independent_of_alerts(self,
+                                           mock_send_notification_batch):
+        """Test that the number of queries does not grow with the alerts"""
+        mock_send_notification_batch.return_value = {self.token: 'Success'}
+
+        with CaptureQueriesContext(connection) as single:
+            Notifier().notifyAlerts()
+
+        Alert.objects.update(is_notified=False)
+        for limit in (90.00, 80.00, 70.00):
+            alert = Alert.objects.create(user=self.user,
+                                         exchange='Kraken',
+                                         coinpair='XBT:EUR',
+                                         indicator='>',
+                                         limit=limit,
+                                         is_active=True,
+                                         trigger_value=105.23)
+            NotificationOutbox.objects.create(alert=alert)
+        NotificationOutbox.objects.create(alert=self.alert)
+
+        with CaptureQueriesContext(connection) as many:
+            Notifier().notifyAlerts()
+
+        self.assertEqual(len(many), len(single))
+        self.assertEqual(Alert.objects.filter(is_notified=False).count(), 0)
+
+    @override_settings(NOTIFICATION_BACKOFF_MIN=30,
+                       NOTIFICATION_MAX_ATTEMPTS=2)
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_failed_notification_retried(self, mock_send_notification_batch):
+        """Test that a notification no device accepted is retried with
+        backoff and dead lettered when it runs out of attempts"""
+        mock_send_notification_batch.return_value = {
+            self.token: 'TooManyRequests'}
+
+        stats = Notifier().notifyAlerts()
+
+        self.assertEqual(stats, {'claimed': 1, 'sent': 0, 'retried': 1,
+                                 'dead': 0})
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.state, NotificationOutbox.States.PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, 'TooManyRequests')
+        self.assertGreater(entry.next_attempt_at,
+                           timezone.now() + timedelta(seconds=25))
+        self.assertEqual(Notifier().notifyAlerts()['claimed'], 0)
+
+        NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+        stats = Notifier().notifyAlerts()
+
+        self.assertEqual(stats['dead'], 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.state, NotificationOutbox.States.DEAD)
+        self.assertEqual(entry.attempts, 2)
+        self.alert.refresh_from_db()
+        self.assertFalse(self.alert.is_notified)
+        self.assertEqual(NotificationHistory.objects.filter(
+            succeeded=False).count(), 2)
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_connection_error_retried(self, mock_send_notification_batch):
+        """Test that a batch that could not be sent is retried"""
+        mock_send_notification_batch.side_effect = ConnectionResetError()
+
+        stats = Notifier().notifyAlerts()
+
+        self.assertEqual(stats['retried'], 1)
+        entry = NotificationOutbox.objects.get()
+        self.assertTrue(entry.last_error.startswith('ConnectionResetError'))
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_invalid_tokens_pruned(self, mock_send_notification_batch):
+        """Test that the tokens APNs rejected for good are deleted and the
+        tokens of temporary failures kept"""
+        bad_token = 'b' * 64
+        busy_token = 'c' * 64
+        for token in (bad_token, busy_token):
+            DeviceToken.objects.create(user=self.user, device_type='IOS',
+                                       token=token)
+        mock_send_notification_batch.return_value = {
+            self.token: ('Unregistered', '1600000000000'),
+            bad_token: 'BadDeviceToken',
+            busy_token: 'TooManyRequests',
+        }
+
+        Notifier().notifyAlerts()
+
+        self.assertEqual(
+            list(DeviceToken.objects.values_list('token', flat=True)),
+            [busy_token])
+        self.assertEqual(NotificationOutbox.objects.get().attempts, 1)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_abandoned_notification_dead_lettered(self):
+        """Test that a notification whose last delivery never completed is
+        dead lettered instead of claimed again"""
+        NotificationOutbox.objects.update(attempts=2)
+
+        stats = Notifier().notifyAlerts()
+
+        self.assertEqual(stats, {'claimed': 0, 'sent': 0, 'retried': 0,
+                                 'dead': 1})
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.state, NotificationOutbox.States.DEAD)
+        self.assertEqual(entry.attempts, 2)
+
+    def test_claimed_notification_not_claimed_again(self):
+        """Test that a claimed batch is left to its worker until the claim
+        times out"""
+        notifier = Notifier()
+
+        claimed = notifier.claim()
+
+        self.assertEqual([entry.alert for entry in claimed], [self.alert])
+        self.assertEqual(notifier.claim(), [])
+        NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(len(notifier.claim()), 1)
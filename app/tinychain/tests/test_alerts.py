@@ -1,16 +1,18 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Alert
 
+from tinychain.pagination import KeysetPagination
 from tinychain.serializers import AlertSerializer
 
 
 ALERTS_URL = reverse('tinychain:alert-list')
+BULK_URL = reverse('tinychain:alert-bulk')
 
 
 class PublicAlertsTests(TestCase):
@@ -52,11 +54,10 @@ class PrivateAlertsApiTests(TestCase):
 
         res = self.client.get(ALERTS_URL)
 
-        alerts = Alert.objects.all().order_by(
-            '-exchange').order_by('-coinpair')
+        alerts = Alert.objects.all().order_by('-coinpair', '-id')
         serializer = AlertSerializer(alerts, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_alerts_limited_to_user(self):
         """Test that alerts returned are for authenticated user"""
@@ -78,8 +79,46 @@ class PrivateAlertsApiTests(TestCase):
         res = self.client.get(ALERTS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['coinpair'], alert.coinpair)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['coinpair'], alert.coinpair)
+
+    def test_alerts_paginated_by_cursor(self):
+        """Test that following the next links returns every alert once"""
+        for coinpair in ('XBT:EUR', 'ETH:EUR', 'XBT:EUR', 'LTC:EUR',
+                         'XBT:EUR'):
+            Alert.objects.create(user=self.user,
+                                 exchange='Kraken',
+                                 coinpair=coinpair,
+                                 indicator='>',
+                                 limit=100.00)
+
+        ids = []
+        url = f'{ALERTS_URL}?page_size=2'
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            ids.extend(alert['id'] for alert in res.data['results'])
+            url = res.data['next']
+
+        expected = Alert.objects.order_by('-coinpair', '-id') \
+                                .values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        res = self.client.get(ALERTS_URL, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_invalid_values(self):
+        """Test that a cursor with values of the wrong type is rejected"""
+        pagination = KeysetPagination()
+        for position in (['XBT:EUR', 'abc'], [None, 1], ['x', {}]):
+            res = self.client.get(
+                ALERTS_URL, {'cursor': pagination.encode_cursor(position)})
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_create_alert_succeeds(self):
         payload = {
@@ -104,3 +143,118 @@ class PrivateAlertsApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Alert.objects.count(), 0)
+
+    def create_ladder(self, user, count, coinpair='XBT:EUR'):
+        return [Alert.objects.create(user=user,
+                                     exchange='Kraken',
+                                     coinpair=coinpair,
+                                     indicator='>',
+                                     limit=1000 + level)
+                for level in range(count)]
+
+    def test_bulk_create_alerts(self):
+        """Test that a list of alerts is created in a single insert"""
+        payload = [{'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+                    'indicator': '>', 'limit': 1000 + level}
+                   for level in range(10)]
+
+        with self.assertNumQueries(3):
+            res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 10)
+        self.assertEqual(Alert.objects.filter(user=self.user).count(), 10)
+
+    def test_bulk_create_reports_errors_per_alert(self):
+        """Test that one invalid alert rejects the whole list"""
+        payload = [
+            {'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+             'indicator': '>', 'limit': 1000},
+            {'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+             'indicator': '>', 'limit': 'high'},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('limit', res.data[1])
+        self.assertEqual(Alert.objects.count(), 0)
+
+    @override_settings(ALERT_BULK_MAX_SIZE=2)
+    def test_bulk_create_max_size(self):
+        """Test that lists longer than the maximum are rejected"""
+        payload = [{'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+                    'indicator': '>', 'limit': 1000}] * 3
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Alert.objects.count(), 0)
+
+    def test_bulk_create_requires_list(self):
+        res = self.client.post(BULK_URL, {'exchange': 'Kraken'},
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ALERT_BULK_MAX_SIZE=2)
+    def test_bulk_delete_max_size(self):
+        """Test that neither ids nor a filter delete more than the
+        maximum"""
+        alerts = self.create_ladder(self.user, 3)
+
+        res = self.client.delete(
+            BULK_URL, {'ids': [alert.id for alert in alerts]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', res.data)
+
+        res = self.client.delete(BULK_URL, {'coinpair': 'XBT:EUR'},
+                                 format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Alert.objects.count(), 3)
+
+        alerts[0].delete()
+        res = self.client.delete(BULK_URL, {'coinpair': 'XBT:EUR'},
+                                 format='json')
+        self.assertEqual(res.data['deleted'], 2)
+
+    def test_bulk_delete_by_ids(self):
+        """Test deleting alerts by id, ids of others are not found"""
+        other = get_user_model().objects.create_user(
+            'other@simpletechture.nl',
+            'password1234'
+        )
+        alerts = self.create_ladder(self.user, 3)
+        foreign = self.create_ladder(other, 1)[0]
+        ids = [alerts[0].id, alerts[1].id, foreign.id]
+
+        res = self.client.delete(BULK_URL, {'ids': ids}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['deleted'], 2)
+        self.assertEqual(res.data['not_found'], [foreign.id])
+        self.assertEqual(list(Alert.objects.values_list('id', flat=True)
+                                           .order_by('id')),
+                         [alerts[2].id, foreign.id])
+
+    def test_bulk_delete_by_filter(self):
+        """Test deleting every alert of a coinpair"""
+        self.create_ladder(self.user, 3, 'XBT:EUR')
+        kept = self.create_ladder(self.user, 1, 'ETH:EUR')[0]
+
+        res = self.client.delete(BULK_URL, {'coinpair': 'XBT:EUR'},
+                                 format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['deleted'], 3)
+        self.assertEqual(list(Alert.objects.all()), [kept])
+
+    def test_bulk_delete_requires_ids_or_filter(self):
+        """Test that an empty request does not delete every alert"""
+        self.create_ladder(self.user, 2)
+
+        res = self.client.delete(BULK_URL, {}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Alert.objects.count(), 2)
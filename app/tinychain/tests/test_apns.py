@@ -0,0 +1,382 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from unittest import skipUnless
+
+from apns2.client import APNsClient, Notification
+from apns2.credentials import Credentials
+from apns2.payload import Payload, PayloadAlert
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import DataReceived, RequestReceived, StreamEnded
+from h2.exceptions import ProtocolError
+from h2.settings import SettingCodes
+from hyper import HTTP20Connection
+
+from core.models import Alert, DeviceToken, NotificationOutbox
+from tinychain.alerting import Notifier
+from tinychain.apns import AsyncAPNsBackend, AsyncAPNsClient
+
+
+class BearerCredentials(Credentials):
+
+    def get_authorization_header(self, topic):
+        return 'bearer test'
+
+
+class FakeAPNsServer:
+    """HTTP/2 server on localhost that answers like APNs
+
+    Every response is delayed by latency seconds plus a random part of
+    jitter seconds, the tokens in errors are rejected with their reason and
+    the first connection is dropped when it receives more than drop_after
+    requests and connections after max_connections are closed right away.
+    Like APNs, it allows 500 concurrent streams.
+    """
+
+    def __init__(self, latency=0, jitter=0, errors=None, drop_after=None,
+                 max_streams=500, max_connections=None):
+        self.latency = latency
+        self.max_connections = max_connections
+        self.jitter = jitter
+        self.max_streams = max_streams
+        self.errors = errors or {}
+        self.drop_after = drop_after
+        self.requests = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, '127.0.0.1', 0),
+            self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def shutdown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        if self.max_connections is not None and \
+                self.connections > self.max_connections:
+            writer.close()
+            return
+        drop_after = self.drop_after if self.connections == 1 else None
+        connection = H2Connection(
+            config=H2Configuration(client_side=False))
+        connection.initiate_connection()
+        connection.update_settings(
+            {SettingCodes.MAX_CONCURRENT_STREAMS: self.max_streams})
+        writer.write(connection.data_to_send())
+
+        received = 0
+        requests = {}
+        while True:
+            data = await reader.read(65535)
+            if not data:
+                break
+            for event in connection.receive_data(data):
+                if isinstance(event, RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), [])
+                elif isinstance(event, DataReceived):
+                    requests[event.stream_id][1].append(event.data)
+                    connection.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    received += 1
+                    if drop_after is not None and received > drop_after:
+                        writer.close()
+                        return
+                    self.requests.append((headers, b''.join(body)))
+                    asyncio.ensure_future(self.respond(
+                        connection, writer, event.stream_id, headers))
+            writer.write(connection.data_to_send())
+
+    async def respond(self, connection, writer, stream_id, headers):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency +
+                                random.uniform(0, self.jitter))
+        finally:
+            self.in_flight -= 1
+
+        reason = self.errors.get(headers[':path'].rsplit('/', 1)[1])
+        try:
+            if reason is None:
+                connection.send_headers(stream_id, [
+                    (':status', '200'), ('apns-id', str(uuid.uuid4()))],
+                    end_stream=True)
+            else:
+                body = json.dumps({'reason': reason}).encode('utf-8')
+                connection.send_headers(stream_id, [
+                    (':status', '400'),
+                    ('content-type', 'application/json'),
+                    ('content-length', str(len(body)))])
+                connection.send_data(stream_id, body, end_stream=True)
+            writer.write(connection.data_to_send())
+        except ProtocolError:
+            # the client reset the stream
+            pass
+
+
+class ServerAPNsBackend(AsyncAPNsBackend):
+    """Asyncio backend connected to the fake server"""
+
+    def __init__(self, server, window=10, timeout=5.0):
+        super().__init__()
+        self.server = server
+        self.window = window
+        self.timeout = timeout
+
+    def create_client(self, credentials):
+        return AsyncAPNsClient('127.0.0.1', self.server.port,
+                               BearerCredentials(), self.window,
+                               self.timeout, secure=False)
+
+
+def create_notifications(count):
+    payload = Payload(alert=PayloadAlert(title='Price alert', body='Test'),
+                      sound='chime', badge=1)
+    return [Notification(token=f'{index:064x}', payload=payload)
+            for index in range(count)]
+
+
+class AsyncAPNsBackendTest(SimpleTestCase):
+    """Test sending notifications over HTTP/2 with asyncio"""
+
+    def start_server(self, **kwargs):
+        server = FakeAPNsServer(**kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def create_backend(self, server, **kwargs):
+        backend = ServerAPNsBackend(server, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_batch_multiplexed_within_window(self):
+        """Test that a batch is sent as concurrent streams of one
+        connection, never more than the window at once"""
+        server = self.start_server(latency=0.05)
+        backend = self.create_backend(server, window=5)
+        notifications = create_notifications(20)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertEqual(results, {notification.token: 'Success'
+                                   for notification in notifications})
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.max_in_flight, 5)
+
+        headers, body = server.requests[0]
+        self.assertEqual(headers[':path'],
+                         f'/3/device/{notifications[0].token}')
+        self.assertEqual(headers['apns-topic'], 'topic')
+        self.assertEqual(headers['authorization'], 'bearer test')
+        self.assertEqual(json.loads(body),
+                         notifications[0].payload.dict())
+
+    def test_rejected_tokens_reported(self):
+        """Test that the reason of every rejected token is returned"""
+        notifications = create_notifications(3)
+        server = self.start_server(errors={
+            notifications[0].token: 'BadDeviceToken',
+            notifications[2].token: 'Unregistered',
+        })
+        backend = self.create_backend(server)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertEqual(results, {
+            notifications[0].token: 'BadDeviceToken',
+            notifications[1].token: 'Success',
+            notifications[2].token: 'Unregistered',
+        })
+
+    def test_connection_reused(self):
+        """Test that batches are sent over the same connection"""
+        server = self.start_server()
+        backend = self.create_backend(server)
+
+        backend.send_notification_batch(create_notifications(2), 'topic')
+        backend.send_notification_batch(create_notifications(2), 'topic')
+
+        self.assertEqual(server.connections, 1)
+
+    def test_dropped_connection_resent(self):
+        """Test that the notifications lost with a dropped connection are
+        sent again over a new connection"""
+        server = self.start_server(latency=0.01, drop_after=3)
+        backend = self.create_backend(server)
+        notifications = create_notifications(10)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertEqual(results, {notification.token: 'Success'
+                                   for notification in notifications})
+        self.assertEqual(server.connections, 2)
+
+    def test_failed_reconnect_keeps_results(self):
+        """Test that the notifications delivered before the connection
+        dropped keep their result when no new connection can be opened"""
+        server = self.start_server(drop_after=3, max_connections=1)
+        backend = self.create_backend(server, window=1)
+        notifications = create_notifications(6)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertEqual(list(results.values())[:3], ['Success'] * 3)
+        self.assertEqual(len(results), 6)
+        for result in list(results.values())[3:]:
+            self.assertTrue(result.startswith('ConnectionResetError'))
+
+    def test_connect_timeout_reported(self):
+        """Test that a server that never completes the connection fails
+        the batch instead of raising"""
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        backend = self.create_backend(
+            SimpleNamespace(port=listener.getsockname()[1]), timeout=0.05)
+        notifications = create_notifications(2)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertEqual(len(results), 2)
+        for result in results.values():
+            self.assertTrue(result.startswith(
+                'ConnectionResetError: Could not connect to APNs'))
+
+    def test_timeout_reported(self):
+        """Test that a notification without a timely response is reported
+        as failed and not sent again, it may have been delivered"""
+        server = self.start_server(latency=0.5)
+        backend = self.create_backend(server, timeout=0.05)
+        notifications = create_notifications(1)
+
+        results = backend.send_notification_batch(notifications, 'topic')
+
+        self.assertTrue(
+            results[notifications[0].token].startswith('TimeoutError'))
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(server.connections, 1)
+
+
+class NotifierAsyncBackendTest(TestCase):
+    """Test delivering the outbox with the asyncio backend"""
+
+    def test_outbox_delivered(self):
+        server = FakeAPNsServer()
+        server.start()
+        self.addCleanup(server.stop)
+        backend = ServerAPNsBackend(server)
+        self.addCleanup(backend.close)
+        user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        DeviceToken.objects.create(user=user, device_type='IOS',
+                                   token='a' * 64)
+        alert = Alert.objects.create(user=user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=100.00, is_active=True,
+                                     trigger_value=105.23)
+        NotificationOutbox.objects.create(alert=alert)
+
+        stats = Notifier({'IOS': backend}).notifyAlerts()
+
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(server.requests[0][0][':path'],
+                         f'/3/device/{"a" * 64}')
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_notified)
+
+
+def serve(ports, **kwargs):
+    server = FakeAPNsServer(**kwargs)
+    server.start()
+    ports.put(server.port)
+    server.thread.join()
+
+
+@skipUnless(os.environ.get('BENCHMARK'), 'Set BENCHMARK=1 to run')
+class PushBenchmarkTest(SimpleTestCase):
+    """Compare the apns2 client and the asyncio client
+
+    The server runs in a process of its own, so the CPU time of this
+    process is the time spent by the client.
+    """
+
+    def start_server(self, **kwargs):
+        context = multiprocessing.get_context('fork')
+        ports = context.Queue()
+        process = context.Process(target=serve, args=(ports,), kwargs=kwargs,
+                                  daemon=True)
+        process.start()
+        self.addCleanup(process.terminate)
+        return SimpleNamespace(port=ports.get())
+
+    def sync_client(self, server):
+        client = APNsClient(credentials=BearerCredentials())
+        client._connection = HTTP20Connection('127.0.0.1', server.port,
+                                              secure=False)
+        self.addCleanup(client._connection.close)
+        return client
+
+    def measure(self, send, notifications):
+        send(notifications[:10])
+        start = time.perf_counter()
+        cpu = time.process_time()
+        results = send(notifications)
+        cpu = time.process_time() - cpu
+        elapsed = time.perf_counter() - start
+        self.assertEqual(set(results.values()), {'Success'})
+        return len(notifications) / elapsed, len(notifications) / cpu
+
+    def test_benchmark(self):
+        notifications = create_notifications(2000)
+        for latency, jitter in ((0, 0), (0.02, 0.2), (0.2, 0)):
+            server = self.start_server(latency=latency, jitter=jitter)
+            client = self.sync_client(server)
+            backend = ServerAPNsBackend(server, window=500)
+            self.addCleanup(backend.close)
+
+            sync_rate, sync_cpu = self.measure(
+                lambda batch: client.send_notification_batch(batch, 'topic'),
+                notifications)
+            async_rate, async_cpu = self.measure(
+                lambda batch: backend.send_notification_batch(batch,
+                                                              'topic'),
+                notifications)
+
+            print(f'\n{latency * 1000:>4.0f}ms latency, {jitter * 1000:.0f}'
+                  f'ms jitter: apns2 {sync_rate:.0f}/s '
+                  f'({sync_cpu:.0f}/s of CPU), asyncio {async_rate:.0f}/s '
+                  f'({async_cpu:.0f}/s of CPU)')
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.backends.utils import CursorWrapper
+from django.test import AsyncClient, Client, TransactionTestCase, \
+    override_settings
+from rest_framework.authtoken.models import Token
+
+from app import settings_asgi
+from core.models import Alert, DeviceToken
+
+
+ALERTS_URL = '/api/tinychain/alerts/'
+DEVICETOKENS_URL = '/api/tinychain/devicetokens/'
+ME_URL = '/api/user/me/'
+
+# Seconds added to every query by the slow database stand-in
+QUERY_LATENCY = 0.02
+
+
+def slow_database():
+    """Delay every query like a database across a slow network"""
+    execute = CursorWrapper.execute
+
+    def slow_execute(self, sql, params=None):
+        time.sleep(QUERY_LATENCY)
+        return execute(self, sql, params)
+
+    return mock.patch.object(CursorWrapper, 'execute', slow_execute)
+
+
+@override_settings(ROOT_URLCONF=settings_asgi.ROOT_URLCONF,
+                   MIDDLEWARE=settings_asgi.MIDDLEWARE)
+class AsyncViewTests(TransactionTestCase):
+    """Test the async views of the ASGI service"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123', name='Test')
+        token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+        self.async_headers = {'authorization': f'Token {token.key}'}
+        Alert.objects.create(user=self.user, exchange='Kraken',
+                             coinpair='XBT:EUR', indicator='>', limit=8200)
+        DeviceToken.objects.create(user=self.user, token='1234',
+                                   device_type='IOS')
+
+    async def test_same_responses_as_sync_views(self):
+        """Test that the async views answer like the DRF views"""
+        for url in (ALERTS_URL, DEVICETOKENS_URL, ME_URL):
+            res = await AsyncClient().get(url, **self.async_headers)
+            expected = await sync_to_async(self.sync_get)(url)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.content, expected.content)
+
+    def sync_get(self, url):
+        with override_settings(ROOT_URLCONF='app.urls'):
+            return Client().get(url, **self.headers)
+
+    async def test_login_required(self):
+        res = await AsyncClient().get(ALERTS_URL)
+
+        self.assertEqual(res.status_code, 401)
+
+    async def test_create_alert(self):
+        res = await AsyncClient().post(
+            ALERTS_URL, {'exchange': 'Kraken', 'coinpair': 'ETH:EUR',
+                         'indicator': '<', 'limit': 150},
+            content_type='application/json', **self.async_headers)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['coinpair'], 'ETH:EUR')
+
+
+@skipUnless(os.environ.get('BENCHMARK'), 'Set BENCHMARK=1 to run')
+@override_settings(ROOT_URLCONF=settings_asgi.ROOT_URLCONF,
+                   MIDDLEWARE=settings_asgi.MIDDLEWARE)
+class AsyncViewBenchmarkTests(TransactionTestCase):
+    """Compare the throughput of concurrent requests on a slow database"""
+    requests = 50
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+        self.async_headers = {'authorization': f'Token {token.key}'}
+        Alert.objects.bulk_create(
+            Alert(user=self.user, exchange='Kraken', coinpair='XBT:EUR',
+                  indicator='>', limit=8000 + index)
+            for index in range(100))
+
+    def sync_throughput(self):
+        client = Client()
+        cache.clear()
+        start = time.perf_counter()
+        with override_settings(ROOT_URLCONF='app.urls'):
+            for _ in range(self.requests):
+                client.get(ALERTS_URL, **self.headers)
+        return self.requests / (time.perf_counter() - start)
+
+    async def get_all(self):
+        client = AsyncClient()
+        return await asyncio.gather(*[
+            client.get(ALERTS_URL, **self.async_headers)
+            for _ in range(self.requests)])
+
+    def async_throughput(self):
+        cache.clear()
+        start = time.perf_counter()
+        responses = asyncio.run(self.get_all())
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(res.status_code == 200 for res in responses))
+        return self.requests / elapsed
+
+    def test_benchmark(self):
+        with slow_database():
+            sync_throughput = self.sync_throughput()
+            async_throughput = self.async_throughput()
+
+        print(f'\n{self.requests} requests, {QUERY_LATENCY * 1000:.0f}ms '
+              f'per query: sync {sync_throughput:.1f} req/s, async '
+              f'{async_throughput:.1f} req/s')
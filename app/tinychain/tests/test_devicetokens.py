@@ -49,10 +49,11 @@ class PrivateAlertsApiTests(TestCase):
         res = self.client.get(DEVICETOKENS_URL)
 
         deviceTokens = DeviceToken.objects.all().order_by(
-            '-device_type')
+            '-device_type', '-id')
         serializer = DeviceTokenSerializer(deviceTokens, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+        self.assertIsNone(res.data['next'])
 
     def test_devicetokens_limited_to_user(self):
         """Test that alerts returned are for authenticated user"""
@@ -70,8 +71,8 @@ class PrivateAlertsApiTests(TestCase):
         res = self.client.get(DEVICETOKENS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['token'],
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['token'],
                          deviceToken.token)
 
     def test_create_device_token_succeeds(self):
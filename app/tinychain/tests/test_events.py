@@ -0,0 +1,165 @@
+import asyncio
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+from redis.exceptions import ConnectionError
+from rest_framework.authtoken.models import Token
+
+from core.models import Alert
+
+from tinychain.alerting import AlertProcessor
+from tinychain.events import RedisBroker, alert_event, get_broker, \
+    publish_prices
+from tinychain.prices import PriceCache
+from tinychain.sse import alert_event_stream
+
+
+class StreamConnection:
+    """Client side of an ASGI connection to the event stream"""
+
+    def __init__(self, headers):
+        self.headers = [(name.encode(), value.encode())
+                        for name, value in headers.items()]
+        self.sent = asyncio.Queue()
+        self.received = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        scope = {'type': 'http', 'method': 'GET',
+                 'path': '/api/tinychain/alerts/stream/',
+                 'headers': self.headers}
+        self.task = asyncio.ensure_future(
+            alert_event_stream(scope, self.received.get, self.sent.put))
+        return await self.next_message()
+
+    async def next_message(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def next_body(self):
+        return (await self.next_message())['body'].decode()
+
+    async def disconnect(self):
+        await self.received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+class AlertEventStreamTests(TransactionTestCase):
+    """Test streaming alert and price events"""
+
+    def setUp(self):
+        cache.clear()
+        get_broker().clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        token = Token.objects.create(user=self.user)
+        self.headers = {'authorization': f'Token {token.key}'}
+        alert = Alert.objects.create(user=self.user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=8000)
+        self.alert = Alert.objects.get(id=alert.id)
+
+    def publish_alert(self):
+        get_broker().publish_alerts(
+            {self.user.id: [alert_event(self.alert)]})
+
+    async def test_login_required(self):
+        connection = StreamConnection({})
+
+        start = await connection.connect()
+
+        self.assertEqual(start['status'], 401)
+
+    async def test_streams_alert_events(self):
+        connection = StreamConnection(self.headers)
+        start = await connection.connect()
+
+        self.publish_alert()
+        body = await connection.next_body()
+        await connection.disconnect()
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      start['headers'])
+        self.assertRegex(body,
+                         r'^id: \d+-\d+\nevent: alert\ndata: \{.*\}\n\n$')
+        self.assertIn('"coinpair":"XBT:EUR"', body)
+        self.assertIn('"limit":"8000.00000"', body)
+
+    async def test_streams_prices_of_user_pairs(self):
+        """Test that only prices of the coinpairs of the user are sent"""
+        connection = StreamConnection(self.headers)
+        await connection.connect()
+
+        publish_prices({'ETH:EUR': Decimal('150')})
+        publish_prices({'XBT:EUR': Decimal('9000.1')})
+        body = await connection.next_body()
+        await connection.disconnect()
+
+        self.assertEqual(body, 'event: price\n'
+                               'data: {"coinpair":"XBT:EUR","price":"9000.1"}'
+                               '\n\n')
+
+    async def test_starts_with_cached_prices(self):
+        PriceCache().store({'XBT:EUR': Decimal('9000.1')})
+        connection = StreamConnection(self.headers)
+        await connection.connect()
+
+        body = await connection.next_body()
+        await connection.disconnect()
+
+        self.assertIn('event: price', body)
+
+    async def test_resumes_from_last_event_id(self):
+        """Test that a reconnecting client receives the events it missed"""
+        self.publish_alert()
+        self.publish_alert()
+        first, second = get_broker().history(self.user.id, '0-0')
+        connection = StreamConnection(
+            dict(self.headers, **{'last-event-id': first['id']}))
+        await connection.connect()
+
+        body = await connection.next_body()
+        await connection.disconnect()
+
+        self.assertTrue(body.startswith(f'id: {second["id"]}\n'))
+
+    @override_settings(ALERT_EVENTS_HEARTBEAT=0.01)
+    async def test_idle_stream_sends_heartbeat(self):
+        connection = StreamConnection(self.headers)
+        await connection.connect()
+
+        body = await connection.next_body()
+        await connection.disconnect()
+
+        self.assertEqual(body, ': keepalive\n\n')
+
+    def test_processor_publishes_changed_alerts(self):
+        self.alert.is_active = True
+
+        AlertProcessor().save_changed([self.alert])
+
+        events = get_broker().history(self.user.id, '0-0')
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0]['data']['is_active'])
+
+
+class FailingRedis:
+    """Redis client that cannot reach the server"""
+
+    def xrange(self, *args, **kwargs):
+        raise ConnectionError('Connection refused')
+
+
+class RedisBrokerTests(SimpleTestCase):
+    """Test the Redis broker when Redis fails"""
+
+    def test_history_error_returns_no_events(self):
+        broker = RedisBroker(FailingRedis())
+
+        with self.assertLogs('tinychain.events', 'WARNING'):
+            events = broker.history(1, '1-0')
+
+        self.assertEqual(events, [])
@@ -0,0 +1,94 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from tinychain.index import PairIndex, ThresholdIndex, to_fixed, \
+    to_fixed_price
+
+
+def price(value):
+    return to_fixed_price(Decimal(value))
+
+
+class PairIndexTest(SimpleTestCase):
+    """Test finding crossed alerts in the threshold index"""
+
+    def setUp(self):
+        self.index = PairIndex()
+        self.index.insert(1, '>', Decimal('100'))
+        self.index.insert(2, '>', Decimal('200'))
+        self.index.insert(3, '<', Decimal('150'))
+        self.index.insert(4, '<', Decimal('250'))
+
+    def test_active(self):
+        """Test the active alerts for a price"""
+        self.assertEqual(self.index.active(price('175')), {1, 4})
+        self.assertEqual(self.index.active(price('100')), {3, 4})
+
+    def test_crossed_price_up(self):
+        """Test a rising price activates higher and ends lower alerts"""
+        activated, deactivated = self.index.crossed(price('120'),
+                                                    price('220'))
+
+        self.assertEqual(activated, {2})
+        self.assertEqual(deactivated, {3})
+
+    def test_crossed_price_down(self):
+        """Test a falling price activates lower and ends higher alerts"""
+        activated, deactivated = self.index.crossed(price('220'),
+                                                    price('120'))
+
+        self.assertEqual(activated, {3})
+        self.assertEqual(deactivated, {2})
+
+    def test_crossed_matches_active(self):
+        """Test that crossings agree with evaluating both prices"""
+        prices = [price(value) for value in
+                  ('50', '100', '150', '175', '200', '250', '300',
+                   '99.999999', '100.000001', '150.000004')]
+        for previous in prices:
+            for current in prices:
+                activated, deactivated = self.index.crossed(previous,
+                                                            current)
+                before = self.index.active(previous)
+                after = self.index.active(current)
+
+                self.assertEqual(activated, after - before)
+                self.assertEqual(deactivated, before - after)
+
+    def test_prices_with_more_decimals(self):
+        """Test exact comparison of prices finer than the limits"""
+        self.assertTrue(self.index.is_active(1, price('100.000001')))
+        self.assertFalse(self.index.is_active(1, price('100')))
+        self.assertTrue(self.index.is_active(3, price('149.999999')))
+        self.assertFalse(self.index.is_active(3, price('150')))
+
+    def test_insert(self):
+        """Test that inserted alerts are found and inserted once"""
+        self.index.insert(5, '>', Decimal('120'))
+        self.index.insert(5, '>', Decimal('120'))
+
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.max_id, 5)
+        self.assertEqual(self.index.active(price('150')), {1, 4, 5})
+
+    def test_to_fixed(self):
+        """Test converting limits to fixed point"""
+        self.assertEqual(to_fixed(Decimal('8000.65')), 800065000)
+        self.assertEqual(to_fixed(8000.65), 800065000)
+
+
+class ThresholdIndexTest(SimpleTestCase):
+    """Test keeping the index per coinpair"""
+
+    def test_load_replaces_pair(self):
+        """Test that loading a pair replaces it and keeps its version"""
+        index = ThresholdIndex()
+        index.load('XBT:EUR', [(1, '>', Decimal('100'))])
+
+        pair_index = index.load('XBT:EUR', [(2, '<', Decimal('10'))], 'v2')
+
+        self.assertIs(index.get('XBT:EUR'), pair_index)
+        self.assertEqual(list(pair_index.limits), [2])
+        self.assertEqual(pair_index.version, 'v2')
+        self.assertNotIn('ETH:EUR', index)
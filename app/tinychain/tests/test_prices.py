@@ -0,0 +1,129 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Alert
+from tinychain.prices import PriceCache
+
+from unittest.mock import patch
+
+
+PRICES_URL = reverse('tinychain:prices')
+
+
+def ticker_json(**prices):
+    return {
+        'error': [],
+        'result': {ticker: {'a': [price, '1', '1.000']}
+                   for ticker, price in prices.items()}
+    }
+
+
+class PriceCacheTest(TestCase):
+    """Test sharing prices through the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.prices = PriceCache()
+
+    @patch('krakenex.API.query_public')
+    def test_cached_prices_not_fetched(self, mock_query_public):
+        """Test that a cached price does not cause an upstream call"""
+        mock_query_public.return_value = ticker_json(XXBTZEUR='9000.10000')
+
+        self.prices.get_prices(['XBT:EUR'])
+        prices = self.prices.get_prices(['XBT:EUR'])
+
+        self.assertEqual(prices, {'XBT:EUR': Decimal('9000.10000')})
+        self.assertEqual(mock_query_public.call_count, 1)
+
+    @override_settings(PRICE_CACHE_LOCK_TIMEOUT=1)
+    @patch('krakenex.API.query_public')
+    def test_single_flight_refresh(self, mock_query_public):
+        """Test that a pair being fetched elsewhere is not fetched again"""
+        mock_query_public.return_value = ticker_json(XETHZEUR='181.45000')
+        cache.add(self.prices.lock_key('XBT:EUR'), True)
+        cache.set(self.prices.key('XBT:EUR'),
+                  {'price': '9000.10000', 'fetched_at': 0})
+
+        prices = self.prices.refresh(['XBT:EUR', 'ETH:EUR'])
+
+        mock_query_public.assert_called_once_with('Ticker',
+                                                  {'pair': 'XETHZEUR'})
+        self.assertEqual(prices, {'XBT:EUR': Decimal('9000.10000'),
+                                  'ETH:EUR': Decimal('181.45000')})
+
+
+class PublicPricesApiTests(TestCase):
+    """Test the public cached prices API"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = get_user_model().objects.create_user(
+            'test@simpletechture.nl',
+            'test123'
+        )
+        for coinpair in ('XBT:EUR', 'ETH:EUR'):
+            Alert.objects.create(user=user,
+                                 exchange='Kraken',
+                                 coinpair=coinpair,
+                                 indicator='>',
+                                 limit=100.00)
+
+    @patch('krakenex.API.query_public')
+    def test_list_prices(self, mock_query_public):
+        """Test that the prices of all alert pairs are listed"""
+        PriceCache().store({'XBT:EUR': Decimal('9000.10000'),
+                            'ETH:EUR': Decimal('181.45000')})
+
+        res = self.client.get(PRICES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(price['coinpair'], price['price'])
+                          for price in res.data],
+                         [('ETH:EUR', '181.45000'),
+                          ('XBT:EUR', '9000.10000')])
+        self.assertIn('public', res['Cache-Control'])
+        self.assertIn('max-age=', res['Cache-Control'])
+        mock_query_public.assert_not_called()
+
+    def test_coinpairs_cached(self):
+        """Test that listing the prices does not query the alerts while
+        the coinpairs are cached"""
+        PriceCache().store({'XBT:EUR': Decimal('9000.10000'),
+                            'ETH:EUR': Decimal('181.45000')})
+        self.client.get(PRICES_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PRICES_URL)
+
+        self.assertEqual(len(res.data), 2)
+
+    def test_refresher_stores_coinpairs(self):
+        """Test that the coinpairs stored by the refresher are listed"""
+        PriceCache().store_coinpairs(['XBT:EUR'])
+        PriceCache().store({'XBT:EUR': Decimal('9000.10000')})
+
+        res = self.client.get(PRICES_URL)
+
+        self.assertEqual([price['coinpair'] for price in res.data],
+                         ['XBT:EUR'])
+
+    @patch('krakenex.API.query_public')
+    def test_filter_pairs(self, mock_query_public):
+        """Test that only requested pairs with alerts are returned"""
+        mock_query_public.return_value = ticker_json(XXBTZEUR='9000.10000')
+
+        res = self.client.get(PRICES_URL, {'pairs': 'XBT:EUR,DOGE:EUR'})
+
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['coinpair'], 'XBT:EUR')
+        mock_query_public.assert_called_once_with('Ticker',
+                                                  {'pair': 'XXBTZEUR'})
@@ -0,0 +1,348 @@
+import json
+import threading
+
+import requests
+from apns2.client import Notification
+from apns2.payload import Payload, PayloadAlert
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.models import Alert, DeviceToken, NotificationHistory, \
+    NotificationOutbox
+from tinychain.alerting import Notifier
+from tinychain.apns import LocalAPNsBackend
+from tinychain.fcm import FCMBackend, LocalFCMBackend
+from tinychain.push import APNsConnection, LocalPushBackend, \
+    send_notifications
+from tinychain.wns import WNSBackend
+
+from unittest.mock import patch
+
+
+def create_notifications(prefix, count):
+    payload = Payload(alert=PayloadAlert(title='Price alert',
+                                         body='XBT:EUR > 100 & rising'),
+                      sound='chime', badge=1)
+    return [Notification(token=f'{prefix}{index}', payload=payload)
+            for index in range(count)]
+
+
+def create_response(status_code, body=''):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body.encode()
+    return response
+
+
+class APNsConnectionTest(SimpleTestCase):
+    """Test sharing the APNs client between notifications"""
+
+    def setUp(self):
+        self.connection = APNsConnection()
+        self.addCleanup(self.connection.close)
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_client_reused(self, mock_send_notification_batch):
+        """Test that batches are sent over the same client"""
+        mock_send_notification_batch.return_value = {}
+
+        self.connection.send_notification_batch([], 'topic')
+        client = self.connection.client
+        self.connection.send_notification_batch([], 'topic')
+
+        self.assertIs(self.connection.client, client)
+        self.assertEqual(mock_send_notification_batch.call_count, 2)
+
+    @patch('apns2.client.APNsClient.send_notification_batch')
+    def test_reconnects_after_dropped_connection(
+            self, mock_send_notification_batch):
+        """Test that a dropped connection is replaced and the batch resent"""
+        mock_send_notification_batch.side_effect = [
+            ConnectionResetError(), {'token': 'Success'}]
+
+        self.connection.get_client()
+        client = self.connection.client
+        result = self.connection.send_notification_batch([], 'topic')
+
+        self.assertEqual(result, {'token': 'Success'})
+        self.assertIsNot(self.connection.client, client)
+
+    @patch('os.getpid')
+    def test_new_client_after_fork(self, mock_getpid):
+        """Test that a forked worker process creates its own client"""
+        mock_getpid.return_value = 1
+        client = self.connection.get_client()
+
+        mock_getpid.return_value = 2
+
+        self.assertIsNot(self.connection.get_client(), client)
+
+
+class SendNotificationsTest(SimpleTestCase):
+    """Test sending notifications with the backend of every device type"""
+
+    def setUp(self):
+        LocalPushBackend.reset()
+        self.addCleanup(LocalPushBackend.reset)
+
+    def test_grouped_per_backend(self):
+        """Test that the device types of a backend are sent together, in
+        batches of the size of the backend"""
+        apns = LocalAPNsBackend()
+        fcm = LocalFCMBackend()
+        notifications = {
+            'IOS': create_notifications('ios', 2),
+            'MAC': create_notifications('mac', 1),
+            'ADR': create_notifications('adr', 501),
+        }
+
+        results = send_notifications(notifications, 'topic',
+                                     {'IOS': apns, 'MAC': apns, 'ADR': fcm})
+
+        self.assertEqual(len(results), 504)
+        self.assertEqual(set(results.values()), {'Success'})
+        batches = sorted((type(backend).__name__, len(batch))
+                         for backend, batch in LocalPushBackend.sent)
+        self.assertEqual(batches, [('LocalAPNsBackend', 3),
+                                   ('LocalFCMBackend', 1),
+                                   ('LocalFCMBackend', 500)])
+
+    def test_backends_sent_in_parallel(self):
+        """Test that the backends send at the same time"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        class WaitingBackend(LocalPushBackend):
+            def send_notification_batch(self, notifications, topic):
+                barrier.wait()
+                return super().send_notification_batch(notifications, topic)
+
+        results = send_notifications(
+            {'IOS': create_notifications('ios', 1),
+             'WIN': create_notifications('win', 1)},
+            'topic', {'IOS': WaitingBackend(), 'WIN': WaitingBackend()})
+
+        self.assertEqual(results, {'ios0': 'Success', 'win0': 'Success'})
+
+    def test_failed_batch_reported(self):
+        """Test that the tokens of a batch that could not be sent, or of a
+        device type without backend, get the error"""
+        class FailingBackend(LocalPushBackend):
+            def send_notification_batch(self, notifications, topic):
+                raise ConnectionResetError('reset')
+
+        results = send_notifications(
+            {'IOS': create_notifications('ios', 1),
+             'WIN': create_notifications('win', 1)},
+            'topic', {'IOS': FailingBackend()})
+
+        self.assertEqual(results, {
+            'ios0': 'ConnectionResetError: reset',
+            'win0': 'No push backend for WIN',
+        })
+
+    def test_raising_backend_reported(self):
+        """Test that any error of a backend fails only its own tokens"""
+        class RaisingBackend(LocalPushBackend):
+            def send_notification_batch(self, notifications, topic):
+                raise TypeError('broken')
+
+        results = send_notifications(
+            {'IOS': create_notifications('ios', 1),
+             'ADR': create_notifications('adr', 1)},
+            'topic', {'IOS': LocalAPNsBackend(), 'ADR': RaisingBackend()})
+
+        self.assertEqual(results, {'ios0': 'Success',
+                                   'adr0': 'TypeError: broken'})
+
+
+class NotifierBackendsTest(TestCase):
+    """Test delivering notifications to devices of every type"""
+
+    def setUp(self):
+        LocalPushBackend.reset()
+        self.addCleanup(LocalPushBackend.reset)
+
+    @override_settings(PUSH_BACKENDS={
+        'IOS': 'tinychain.apns.LocalAPNsBackend',
+        'ADR': 'tinychain.fcm.LocalFCMBackend',
+        'WIN': 'tinychain.wns.LocalWNSBackend',
+    })
+    def test_sent_to_every_device(self):
+        """Test that every device is sent the notification and that the
+        tokens rejected for good are deleted"""
+        user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        for device_type, token in (('IOS', 'ios'), ('ADR', 'adr'),
+                                   ('WIN', 'win')):
+            DeviceToken.objects.create(user=user, device_type=device_type,
+                                       token=token)
+        alert = Alert.objects.create(user=user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=100.00, is_active=True,
+                                     trigger_value=105.23)
+        NotificationOutbox.objects.create(alert=alert)
+        LocalPushBackend.results = {'ios': 'Unregistered',
+                                    'adr': 'UNREGISTERED'}
+
+        stats = Notifier().notifyAlerts()
+
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(
+            sorted((type(backend).__name__, batch[0].token)
+                   for backend, batch in LocalPushBackend.sent),
+            [('LocalAPNsBackend', 'ios'), ('LocalFCMBackend', 'adr'),
+             ('LocalWNSBackend', 'win')])
+        self.assertEqual(
+            list(DeviceToken.objects.values_list('token', flat=True)),
+            ['win'])
+
+    @override_settings(PUSH_BACKENDS={
+        'IOS': 'tinychain.apns.LocalAPNsBackend',
+        'ADR': 'tinychain.fcm.FCMBackend',
+    }, FCM_CREDENTIALS_PATH=None)
+    def test_unconfigured_backend_disabled(self):
+        """Test that a backend without settings is left out and the
+        notification still delivered to the other devices"""
+        user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        DeviceToken.objects.create(user=user, device_type='IOS', token='ios')
+        DeviceToken.objects.create(user=user, device_type='ADR', token='adr')
+        alert = Alert.objects.create(user=user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=100.00, is_active=True,
+                                     trigger_value=105.23)
+        NotificationOutbox.objects.create(alert=alert)
+
+        notifier = Notifier()
+        stats = notifier.notifyAlerts()
+
+        self.assertEqual(set(notifier.backends), {'IOS'})
+        self.assertEqual(stats['sent'], 1)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(NotificationHistory.objects.count(), 1)
+
+
+@override_settings(PUSH_HTTP_THREADS=4)
+class FCMBackendTest(SimpleTestCase):
+    """Test sending notifications with the HTTP v1 API of FCM"""
+
+    def setUp(self):
+        self.backend = FCMBackend()
+        self.backend.credentials = {
+            'project_id': 'tinychain',
+            'client_email': 'push@tinychain.iam.gserviceaccount.com',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'private_key': rsa.generate_private_key(
+                65537, 2048, default_backend()).private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption()).decode(),
+        }
+        self.addCleanup(self.backend.close)
+
+    @patch('requests.Session.post')
+    def test_messages_sent(self, mock_post):
+        """Test that an access token is requested once and every token is
+        sent its message"""
+        def post(url, **kwargs):
+            if url == 'https://oauth2.googleapis.com/token':
+                return create_response(
+                    200, '{"access_token": "access", "expires_in": 3599}')
+            if kwargs['json']['message']['token'] == 'adr1':
+                return create_response(404, json.dumps({'error': {
+                    'status': 'NOT_FOUND',
+                    'details': [{'errorCode': 'UNREGISTERED'}]}}))
+            return create_response(200, '{"name": "message"}')
+        mock_post.side_effect = post
+
+        results = self.backend.send(create_notifications('adr', 3), None)
+
+        self.assertEqual(results, {'adr0': 'Success',
+                                   'adr1': 'UNREGISTERED',
+                                   'adr2': 'Success'})
+        urls = [call[0][0] for call in mock_post.call_args_list]
+        self.assertEqual(urls.count('https://oauth2.googleapis.com/token'), 1)
+        self.assertIn(
+            'https://fcm.googleapis.com/v1/projects/tinychain/messages:send',
+            urls)
+        call = mock_post.call_args_list[-1][1]
+        self.assertEqual(call['headers']['Authorization'], 'Bearer access')
+        self.assertEqual(call['json']['message']['notification'],
+                         {'title': 'Price alert',
+                          'body': 'XBT:EUR > 100 & rising'})
+
+    @patch('requests.Session.post')
+    def test_unauthorized_token_renewed(self, mock_post):
+        """Test that an access token FCM no longer accepts is renewed"""
+        mock_post.side_effect = [
+            create_response(200, '{"access_token": "a", "expires_in": 3599}'),
+            create_response(401, '{}'),
+            create_response(200, '{"access_token": "b", "expires_in": 3599}'),
+            create_response(200, '{}'),
+        ]
+
+        results = self.backend.send(create_notifications('adr', 1), None)
+
+        self.assertEqual(results, {'adr0': 'Success'})
+        self.assertEqual(
+            mock_post.call_args_list[-1][1]['headers']['Authorization'],
+            'Bearer b')
+
+
+@override_settings(PUSH_HTTP_THREADS=4, WNS_CLIENT_ID='id',
+                   WNS_CLIENT_SECRET='secret')
+class WNSBackendTest(SimpleTestCase):
+    """Test sending toast notifications with WNS"""
+
+    def setUp(self):
+        self.backend = WNSBackend()
+        self.addCleanup(self.backend.close)
+
+    @patch('requests.Session.post')
+    def test_toasts_sent(self, mock_post):
+        """Test that a toast is posted to the channel URI of every device
+        and that expired channels are reported"""
+        def post(url, **kwargs):
+            if url == WNSBackend.token_url:
+                return create_response(
+                    200, '{"access_token": "access", "expires_in": 86400}')
+            if url.endswith('expired'):
+                return create_response(410)
+            return create_response(200)
+        mock_post.side_effect = post
+        channel = 'https://db5p.notify.windows.com/?token='
+        notifications = [
+            notification._replace(token=channel + notification.token)
+            for notification in create_notifications('win', 1)]
+        notifications.extend(
+            notification._replace(token=channel + 'expired')
+            for notification in create_notifications('', 1))
+
+        results = self.backend.send(notifications, None)
+
+        self.assertEqual(results, {channel + 'win0': 'Success',
+                                   channel + 'expired': 'Gone'})
+        call = [call for call in mock_post.call_args_list
+                if call[0][0] == channel + 'win0'][0][1]
+        self.assertEqual(call['headers']['X-WNS-Type'], 'wns/toast')
+        self.assertIn(b'<text>XBT:EUR &gt; 100 &amp; rising</text>',
+                      call['data'])
+
+    @patch('requests.Session.post')
+    def test_foreign_uri_not_posted(self, mock_post):
+        """Test that a token that is not a WNS channel URI is not posted"""
+        mock_post.return_value = create_response(
+            200, '{"access_token": "access", "expires_in": 86400}')
+        notifications = [notification._replace(token=token)
+                         for notification, token in zip(
+                             create_notifications('', 2),
+                             ('http://db5p.notify.windows.com/',
+                              'https://notify.windows.com.example.org/'))]
+
+        results = self.backend.send(notifications, None)
+
+        self.assertEqual(set(results.values()), {'InvalidChannelUri'})
+        self.assertEqual(mock_post.call_count, 1)
@@ -0,0 +1,231 @@
+import json
+import os
+import time
+from unittest import skipUnless
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+import msgpack
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.models import Alert, DeviceToken
+
+from tinychain.renderers import MessagePackRenderer, ORJSONRenderer
+from tinychain.serializers import (AlertSerializer, DeviceTokenSerializer,
+                                   RowSerializer)
+
+
+ALERTS_URL = reverse('tinychain:alert-list')
+DEVICETOKENS_URL = reverse('tinychain:devicetoken-list')
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """Test that orjson renders the same bytes as JSONRenderer"""
+
+    def assertSameBytes(self, data):
+        self.assertEqual(ORJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    def test_strings(self):
+        self.assertSameBytes({
+            'quotes': 'a "b" \\ c / d',
+            'control': '\x00\x08\t\n\x1f\x7f',
+            'unicode': 'é € 😀',
+            'separators': 'line\u2028paragraph\u2029',
+        })
+
+    def test_values(self):
+        self.assertSameBytes(OrderedDict([
+            ('next', None),
+            ('results', [1, -2, True, False, None, 1.5, [], {}]),
+            ('decimal', Decimal('8200.12345')),
+            ('datetime', datetime(2020, 6, 1, 12, 0, 0, 123456,
+                                  timezone.utc)),
+            (3, 'integer key'),
+        ]))
+
+    def test_indent_uses_json_renderer(self):
+        data = {'results': [1, 2]}
+        context = {'indent': 4}
+
+        self.assertEqual(
+            ORJSONRenderer().render(data, renderer_context=context),
+            JSONRenderer().render(data, renderer_context=context))
+
+    def test_none_is_empty(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+
+class RowSerializerTests(TestCase):
+    """Test the list endpoints read from .values() rows"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def render_model_serializer(self, serializer_class, queryset):
+        return JSONRenderer().render(OrderedDict([
+            ('next', None),
+            ('results', serializer_class(queryset, many=True).data),
+        ]))
+
+    def test_alert_list_bytes_unchanged(self):
+        """Test that the alert list matches the ModelSerializer output"""
+        for coinpair, limit in (('XBT:EUR', '8200'),
+                                ('ETH:EUR', '0.00001'),
+                                ('ÉTH:€\u2028', '12345.6789'),
+                                ('"x"\\y', '99999.99999')):
+            Alert.objects.create(user=self.user, exchange='Kraken',
+                                 coinpair=coinpair, indicator='>',
+                                 limit=Decimal(limit))
+
+        res = self.client.get(ALERTS_URL)
+
+        alerts = Alert.objects.order_by('-coinpair', '-id')
+        self.assertEqual(res.content,
+                         self.render_model_serializer(AlertSerializer,
+                                                      alerts))
+
+    def test_device_token_list_bytes_unchanged(self):
+        for token, device_type in (('1234', 'IOS'), ('5678', 'ADR')):
+            DeviceToken.objects.create(user=self.user, token=token,
+                                       device_type=device_type)
+
+        res = self.client.get(DEVICETOKENS_URL)
+
+        tokens = DeviceToken.objects.order_by('-device_type', '-id')
+        self.assertEqual(res.content,
+                         self.render_model_serializer(DeviceTokenSerializer,
+                                                      tokens))
+
+    def test_unquantized_decimal_uses_field(self):
+        """Test that decimals with other decimal places are quantized"""
+        rows = RowSerializer(AlertSerializer).to_representation(
+            [{'id': 1, 'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+              'indicator': '>', 'limit': Decimal('8200.1')}])
+
+        self.assertEqual(rows[0]['limit'], '8200.10000')
+
+
+class MessagePackTests(TestCase):
+    """Test serving and accepting MessagePack"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_decimals_are_lossless(self):
+        value = Decimal('8200.123456789012345678901234567890')
+
+        content = MessagePackRenderer().render({'limit': value})
+
+        self.assertEqual(Decimal(msgpack.unpackb(content)['limit']), value)
+
+    def test_list_as_msgpack(self):
+        """Test that MessagePack holds the same data as JSON"""
+        Alert.objects.create(user=self.user, exchange='Kraken',
+                             coinpair='XBT:EUR', indicator='>',
+                             limit=Decimal('8200.12345'))
+
+        res = self.client.get(ALERTS_URL, HTTP_ACCEPT='application/msgpack')
+        json_res = self.client.get(ALERTS_URL)
+
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(json_res['Content-Type'], 'application/json')
+        self.assertEqual(msgpack.unpackb(res.content),
+                         json.loads(json_res.content))
+        self.assertNotEqual(res['ETag'], json_res['ETag'])
+
+    def test_create_from_msgpack(self):
+        payload = {'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+                   'indicator': '>', 'limit': '8200.12345'}
+
+        res = self.client.post(ALERTS_URL, msgpack.packb(payload),
+                               content_type='application/msgpack')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(Alert.objects.get().limit, Decimal('8200.12345'))
+
+    def test_invalid_msgpack(self):
+        res = self.client.post(ALERTS_URL, b'\xc1',
+                               content_type='application/msgpack')
+
+        self.assertEqual(res.status_code, 400)
+
+
+@skipUnless(os.environ.get('BENCHMARK'), 'Set BENCHMARK=1 to run')
+class ListBenchmarkTests(TestCase):
+    """Compare the ModelSerializer and the .values() list paths"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl', 'test123')
+
+    def model_path(self):
+        alerts = Alert.objects.filter(user=self.user).order_by('-id')
+        return JSONRenderer().render(AlertSerializer(alerts, many=True).data)
+
+    def values_path(self):
+        serializer = RowSerializer(AlertSerializer)
+        rows = Alert.objects.filter(user=self.user).order_by('-id') \
+                            .values(*serializer.sources)
+        return ORJSONRenderer().render(serializer.to_representation(rows))
+
+    def measure(self, path, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            content = path()
+        return (time.perf_counter() - start) / repeat, content
+
+    def test_benchmark(self):
+        created = 0
+        for rows, repeat in ((10, 200), (1000, 20), (50000, 2)):
+            Alert.objects.bulk_create(
+                Alert(user=self.user, exchange='Kraken', coinpair='XBT:EUR',
+                      indicator='>', limit=Decimal(index) / 7)
+                for index in range(created, rows))
+            created = rows
+
+            model_time, model_content = self.measure(self.model_path, repeat)
+            values_time, values_content = self.measure(self.values_path,
+                                                       repeat)
+
+            self.assertEqual(values_content, model_content)
+            print(f'\n{rows:>6} rows: ModelSerializer {model_time * 1000:.2f}'
+                  f'ms, values {values_time * 1000:.2f}ms, '
+                  f'{model_time / values_time:.1f}x')
+
+    def test_payload_size(self):
+        """Compare the size and encode time of JSON and MessagePack"""
+        Alert.objects.bulk_create(
+            Alert(user=self.user, exchange='Kraken', coinpair='XBT:EUR',
+                  indicator='>', limit=Decimal(index) / 7)
+            for index in range(1000))
+        serializer = RowSerializer(AlertSerializer)
+
+        for rows in (10, 100, 1000):
+            data = OrderedDict([
+                ('next', None),
+                ('results', serializer.to_representation(
+                    Alert.objects.order_by('-id')
+                                 .values(*serializer.sources)[:rows])),
+            ])
+            for renderer in (JSONRenderer(), ORJSONRenderer(),
+                             MessagePackRenderer()):
+                encode_time, content = self.measure(
+                    lambda: renderer.render(data), 200)
+                print(f'\n{rows:>4} alerts: {type(renderer).__name__} '
+                      f'{len(content)} bytes, {encode_time * 1e6:.0f}us')
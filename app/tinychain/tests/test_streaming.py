@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+
+import websockets
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core.models import Alert
+from tinychain.alerting import AlertProcessor
+from tinychain.streaming import PriceStream
+
+from unittest.mock import MagicMock
+
+
+TICKS_PATH = os.path.join(os.path.dirname(__file__), 'fixtures',
+                          'kraken_ticker.json')
+
+
+class ReplayFeed:
+    """Local stand-in for the Kraken feed that replays recorded ticks
+
+    Every connection gets the next list of recorded messages, after which the
+    connection is closed by the server.
+    """
+
+    def __init__(self, replays):
+        self.replays = list(replays)
+        self.subscriptions = []
+
+    async def handler(self, websocket, path):
+        self.subscriptions.append(json.loads(await websocket.recv()))
+        messages = self.replays.pop(0) if self.replays else []
+        for message in messages:
+            await websocket.send(json.dumps(message))
+
+    async def serve(self, scenario):
+        async with websockets.serve(self.handler, '127.0.0.1', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            return await scenario(f'ws://127.0.0.1:{port}')
+
+
+class RecordingStream(PriceStream):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.processed = {}
+
+    def process_prices(self, prices):
+        stats = super().process_prices(prices)
+        self.processed.update(prices)
+        return stats
+
+
+@override_settings(PRICE_STREAM_BACKOFF_MIN=0.01)
+class PriceStreamTest(TestCase):
+    """Test evaluating alerts from a streaming price feed"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl',
+            'test123'
+        )
+        self.btc = Alert.objects.create(user=self.user,
+                                        exchange='Kraken',
+                                        coinpair='XBT:EUR',
+                                        indicator='>',
+                                        limit=9000.00)
+        self.eth = Alert.objects.create(user=self.user,
+                                        exchange='Kraken',
+                                        coinpair='ETH:EUR',
+                                        indicator='<',
+                                        limit=150.00)
+        with open(TICKS_PATH) as ticks:
+            self.ticks = json.load(ticks)
+
+    def stream(self, feed, expected):
+        """Run a stream against the feed until the expected prices are
+        evaluated"""
+        notify = MagicMock()
+
+        async def scenario(url):
+            stream = RecordingStream(url, AlertProcessor(), notify)
+            task = asyncio.ensure_future(stream.run())
+            for _ in range(500):
+                if all(str(stream.processed.get(pair)) == price
+                       for pair, price in expected.items()):
+                    break
+                await asyncio.sleep(0.01)
+            stream.stop()
+            await asyncio.wait_for(task, 5)
+            return stream
+
+        stream = async_to_sync(feed.serve)(scenario)
+        return stream, notify
+
+    def test_replayed_ticks_trigger_alerts(self):
+        """Test that streamed ticks trigger the alerts of their pair"""
+        feed = ReplayFeed([self.ticks])
+
+        stream, notify = self.stream(feed, {'XBT:EUR': '9012.40000',
+                                            'ETH:EUR': '148.10000'})
+
+        self.assertEqual(feed.subscriptions[0]['pair'],
+                         ['ETH/EUR', 'XBT/EUR'])
+        self.btc.refresh_from_db()
+        self.eth.refresh_from_db()
+        self.assertTrue(self.btc.is_active)
+        self.assertTrue(self.eth.is_active)
+        self.assertTrue(notify.called)
+
+    def test_reconnects_after_disconnect(self):
+        """Test that the stream reconnects and resubscribes"""
+        feed = ReplayFeed([self.ticks[:4], self.ticks[4:]])
+
+        stream, notify = self.stream(feed, {'XBT:EUR': '9012.40000',
+                                            'ETH:EUR': '148.10000'})
+
+        self.assertGreaterEqual(len(feed.subscriptions), 2)
+        self.eth.refresh_from_db()
+        self.assertTrue(self.eth.is_active)
@@ -0,0 +1,98 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core.models import Alert
+from tinychain import tasks
+
+from unittest.mock import patch
+
+
+class ProcessAlertsTaskTest(TestCase):
+    """Test sharding the evaluation of the alerts"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl',
+            'test123'
+        )
+
+    def test_shard_coinpairs(self):
+        """Test that every coinpair ends up in exactly one stable shard"""
+        coinpairs = ['XBT:EUR', 'ETH:EUR', 'LTC:EUR', 'XRP:EUR', 'XBT:USD']
+
+        shards = tasks.shard_coinpairs(coinpairs, 3)
+
+        self.assertLessEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), sorted(coinpairs))
+        self.assertEqual(shards, tasks.shard_coinpairs(coinpairs[::-1], 3))
+
+    @override_settings(ALERT_SHARD_COUNT=2)
+    @patch('tinychain.tasks.chord')
+    def test_process_alerts_fans_out(self, mock_chord):
+        """Test that the coordinator starts one task per shard"""
+        for coinpair in ('XBT:EUR', 'ETH:EUR', 'LTC:EUR'):
+            Alert.objects.create(user=self.user,
+                                 exchange='Kraken',
+                                 coinpair=coinpair,
+                                 indicator='>',
+                                 limit=100.00)
+
+        tasks.process_alerts()
+
+        header = list(mock_chord.call_args[0][0])
+        self.assertEqual(
+            sorted(sum((task.args[0] for task in header), [])),
+            ['ETH:EUR', 'LTC:EUR', 'XBT:EUR'])
+        self.assertEqual(header[0].task, 'tinychain.tasks.process_alert_shard')
+
+    @patch('krakenex.API.query_public')
+    def test_process_alert_shard(self, mock_query_public):
+        """Test that a shard only evaluates its own coinpairs"""
+        mock_query_public.return_value = {
+            'error': [],
+            'result': {'XXBTZEUR': {'a': ['9000.0', '1', '1.000']}}
+        }
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='XBT:EUR',
+                             indicator='>',
+                             limit=100.00)
+        Alert.objects.create(user=self.user,
+                             exchange='Kraken',
+                             coinpair='ETH:EUR',
+                             indicator='>',
+                             limit=100.00)
+
+        stats = tasks.process_alert_shard(['XBT:EUR'])
+
+        self.assertEqual(stats, {'scanned': 1, 'changed': 1})
+        mock_query_public.assert_called_once_with('Ticker',
+                                                  {'pair': 'XXBTZEUR'})
+
+    @patch('tinychain.tasks.deliver_notifications.delay')
+    def test_notify_alerts_collects_stats(self, mock_delay):
+        """Test that the chord callback sums the shard stats and starts the
+        delivery"""
+        stats = tasks.notify_alerts([{'scanned': 3, 'changed': 1},
+                                     {'scanned': 2, 'changed': 2}])
+
+        self.assertEqual(stats, {'shards': 2, 'scanned': 5, 'changed': 3})
+        mock_delay.assert_called_once_with()
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2)
+    @patch('tinychain.alerting.Notifier.notifyAlerts')
+    def test_deliver_notifications_drains_batches(self, mock_notify_alerts):
+        """Test that delivery continues until a batch is not full"""
+        mock_notify_alerts.side_effect = [
+            {'claimed': 2, 'sent': 2, 'retried': 0, 'dead': 0},
+            {'claimed': 2, 'sent': 1, 'retried': 1, 'dead': 0},
+            {'claimed': 1, 'sent': 0, 'retried': 0, 'dead': 1},
+        ]
+
+        stats = tasks.deliver_notifications()
+
+        self.assertEqual(stats, {'claimed': 5, 'sent': 3, 'retried': 1,
+                                 'dead': 1})
+        self.assertEqual(mock_notify_alerts.call_count, 3)
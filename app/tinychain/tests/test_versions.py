@@ -0,0 +1,149 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Alert, DeviceToken
+
+from tinychain.alerting import AlertProcessor
+from tinychain.index import ThresholdIndex
+from tinychain.versions import get_pair_versions, get_version
+
+
+ALERTS_URL = reverse('tinychain:alert-list')
+DEVICETOKENS_URL = reverse('tinychain:devicetoken-list')
+
+
+def create_user(email='test@simpletechture.nl'):
+    return get_user_model().objects.create_user(email, 'test123')
+
+
+class ConditionalListTests(TestCase):
+    """Test answering conditional requests of the list endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_returns_etag(self):
+        first = self.client.get(ALERTS_URL)
+        second = self.client.get(ALERTS_URL)
+
+        self.assertTrue(first['ETag'])
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etag_is_not_modified(self):
+        """Test that a matching etag is answered without any query"""
+        etag = self.client.get(ALERTS_URL)['ETag']
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ALERTS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertFalse(res.content)
+
+    def test_stale_etag_returns_list(self):
+        res = self.client.get(ALERTS_URL, HTTP_IF_NONE_MATCH='"stale"')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_etag_differs_per_page_and_user(self):
+        etag = self.client.get(ALERTS_URL)['ETag']
+        page_etag = self.client.get(ALERTS_URL, {'page_size': 1})['ETag']
+        self.client.force_authenticate(create_user('other@tinychain.nl'))
+        other_etag = self.client.get(ALERTS_URL)['ETag']
+
+        self.assertEqual(len({etag, page_etag, other_etag}), 3)
+
+
+class VersionBumpTests(TransactionTestCase):
+    """Test that changes to the rows of a user change their version"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_created_alert_changes_etag(self):
+        etag = self.client.get(ALERTS_URL)['ETag']
+        self.client.post(ALERTS_URL, {'exchange': 'Kraken',
+                                      'coinpair': 'XBT:EUR',
+                                      'indicator': '>',
+                                      'limit': 8000})
+
+        res = self.client.get(ALERTS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_device_token_changes_etag(self):
+        etag = self.client.get(DEVICETOKENS_URL)['ETag']
+        DeviceToken.objects.create(user=self.user, token='1234',
+                                   device_type='IOS')
+
+        res = self.client.get(DEVICETOKENS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_bulk_create_changes_version(self):
+        version = get_version(self.user.id)
+        self.client.post(reverse('tinychain:alert-bulk'),
+                         [{'exchange': 'Kraken', 'coinpair': 'XBT:EUR',
+                           'indicator': '>', 'limit': 8000}],
+                         format='json')
+
+        self.assertNotEqual(get_version(self.user.id), version)
+
+    def test_evaluated_alerts_change_version(self):
+        """Test that alert state written by the processor bumps versions"""
+        alert = Alert.objects.create(user=self.user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=8000)
+        other = create_user('other@tinychain.nl')
+        version = get_version(self.user.id)
+        other_version = get_version(other.id)
+
+        alert.is_active = True
+        AlertProcessor().save_changed([alert])
+
+        self.assertNotEqual(get_version(self.user.id), version)
+        self.assertEqual(get_version(other.id), other_version)
+
+    def test_edited_limit_reevaluated(self):
+        """Test that a pair whose price did not move is evaluated again
+        after the limit of one of its alerts was edited"""
+        alert = Alert.objects.create(user=self.user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=8000)
+        processor = AlertProcessor(ThresholdIndex())
+        processor.process_prices({'XBT:EUR': Decimal('7000')})
+        version = get_pair_versions(['XBT:EUR'])
+
+        alert.limit = 6000
+        alert.save()
+        stats = processor.process_prices({'XBT:EUR': Decimal('7000')})
+
+        self.assertNotEqual(get_pair_versions(['XBT:EUR']), version)
+        self.assertEqual(stats['changed'], 1)
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_active)
+
+    def test_deleted_alert_keeps_pair_version(self):
+        """Test that deleting an alert leaves the version of its pair"""
+        alert = Alert.objects.create(user=self.user, exchange='Kraken',
+                                     coinpair='XBT:EUR', indicator='>',
+                                     limit=8000)
+        version = get_pair_versions(['XBT:EUR'])
+
+        alert.delete()
+
+        self.assertEqual(get_pair_versions(['XBT:EUR']), version)
@@ -11,5 +11,6 @@ router.register('devicetokens', views.DeviceTokenViewSet)
 app_name = 'tinychain'
 
 urlpatterns = [
+    path('prices/', views.PriceListView.as_view(), name='prices'),
     path('', include(router.urls))
 ]
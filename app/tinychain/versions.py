@@ -0,0 +1,72 @@
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(user_id):
+    return f'versions:user:{user_id}'
+
+
+def get_version(user_id):
+    """Return the version of the alerts and device tokens of the user
+
+    A missing version, never set or bumped, is replaced by a new random one.
+    """
+    key = version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(user_ids):
+    """Change the version of the users once the transaction commits
+
+    Bumping before the commit would let a concurrent request store the old
+    rows under the new version.
+    """
+    keys = [version_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_etag(request):
+    """Return the ETag of a list response of the authenticated user"""
+    version = get_version(request.user.id)
+    value = f'{version}:{request.get_full_path()}:' \
+            f'{request.META.get("HTTP_ACCEPT", "")}'
+    return '"%s"' % hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def user_row_changed(sender, instance, *args, **kwargs):
+    bump_versions([instance.user_id])
+
+
+def pair_version_key(coinpair):
+    return f'versions:pair:{coinpair}'
+
+
+def get_pair_versions(coinpairs):
+    """Return the version of the alert limits of every coinpair"""
+    keys = {coinpair: pair_version_key(coinpair) for coinpair in coinpairs}
+    versions = cache.get_many(keys.values())
+    for key in set(keys.values()) - versions.keys():
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+    if len(versions) < len(keys):
+        versions = cache.get_many(keys.values())
+    return {coinpair: versions.get(key) for coinpair, key in keys.items()}
+
+
+def alert_changed(sender, instance, created=False, *args, **kwargs):
+    """Change the version of the coinpair of an edited alert once the
+    transaction commits
+
+    New alerts grow the (count, max id) of their pair instead and deleted
+    alerts are no longer read, which keeps evaluating a pair incremental.
+    """
+    if not created:
+        key = pair_version_key(instance.coinpair)
+        transaction.on_commit(lambda: cache.delete(key))
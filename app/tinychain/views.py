@@ -1,47 +1,184 @@
-from rest_framework import viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from core.models import Alert, DeviceToken
+from core.throttling import AlertWriteThrottle
+from user.authentication import CachedTokenAuthentication
 
 from tinychain import serializers
+from tinychain.pagination import KeysetPagination
+from tinychain.prices import PriceCache
+from tinychain.renderers import MessagePackRenderer, ORJSONRenderer
+from tinychain.versions import bump_versions, get_etag
+
+
+class ConditionalListModelMixin(mixins.ListModelMixin):
+    """List the objects of the user with an ETag of the user's version
+
+    A request with a matching If-None-Match is answered with 304 Not
+    Modified without querying or serializing the objects.
+    """
+
+    def list(self, request, *args, **kwargs):
+        etag = get_etag(request)
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+
+        response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+
+class ValuesListModelMixin(mixins.ListModelMixin):
+    """List the objects from .values() rows instead of model instances
+
+    The rows are represented by a RowSerializer of the serializer class,
+    the response is the same as the one of ListModelMixin.
+    """
+    def list(self, request, *args, **kwargs):
+        serializer = serializers.RowSerializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()) \
+                       .values(*serializer.sources)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializer.to_representation(page))
+
+        return Response(serializer.to_representation(queryset))
 
 
 class AlertViewSet(viewsets.GenericViewSet,
-                   mixins.ListModelMixin,
+                   ConditionalListModelMixin,
+                   ValuesListModelMixin,
                    mixins.CreateModelMixin,
                    mixins.DestroyModelMixin):
     """Manage Alerts in the database."""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    throttle_classes = (AlertWriteThrottle,)
     queryset = Alert.objects.all()
     serializer_class = serializers.AlertSerializer
+    renderer_classes = (ORJSONRenderer, MessagePackRenderer,
+                        BrowsableAPIRenderer)
+    pagination_class = KeysetPagination
+    ordering = ('-coinpair', '-id')
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
         return self.queryset.filter(user=self.request.user).order_by(
-            '-exchange').order_by('-coinpair')
+            *self.ordering)
 
     def perform_create(self, serializer):
         """Create a new alert"""
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Create a list of alerts in a single insert
+
+        Either every alert is created or, when one of them is invalid, none
+        of them and the errors are returned at the position of the alert.
+        """
+        serializer = self.get_serializer(data=request.data, many=True,
+                                         allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save(user=request.user)
+            bump_versions([request.user.id])
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk.mapping.delete
+    def bulk_delete(self, request):
+        """Delete the alerts with the given ids or matching a filter"""
+        serializer = serializers.AlertBulkDeleteSerializer(
+            data=request.data, context={'queryset': self.get_queryset()})
+        serializer.is_valid(raise_exception=True)
+        conditions = dict(serializer.validated_data)
+        ids = conditions.pop('ids', None)
+
+        queryset = self.get_queryset().filter(**conditions)
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+
+        with transaction.atomic():
+            alerts = list(queryset.only('id', 'coinpair'))
+            Alert.objects.filter(id__in=[alert.id for alert in alerts]) \
+                         .delete()
+
+        deleted = {alert.id for alert in alerts}
+        return Response({
+            'deleted': len(deleted),
+            'not_found': [alert_id for alert_id in ids or ()
+                          if alert_id not in deleted],
+        })
+
 
 class DeviceTokenViewSet(viewsets.GenericViewSet,
-                         mixins.ListModelMixin,
+                         ConditionalListModelMixin,
+                         ValuesListModelMixin,
                          mixins.CreateModelMixin,
                          mixins.DestroyModelMixin):
     """Manage DeviceTokens in the database."""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = DeviceToken.objects.all()
     serializer_class = serializers.DeviceTokenSerializer
+    renderer_classes = (ORJSONRenderer, MessagePackRenderer,
+                        BrowsableAPIRenderer)
+    pagination_class = KeysetPagination
+    ordering = ('-device_type', '-id')
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
         return self.queryset.filter(user=self.request.user).order_by(
-            '-device_type')
+            *self.ordering)
 
     def perform_create(self, serializer):
         """Create a new devicetoken"""
         serializer.save(user=self.request.user)
+
+
+class PriceListView(APIView):
+    """List the cached prices of the coinpairs that have alerts"""
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request, format=None):
+        price_cache = PriceCache()
+        coinpairs = price_cache.get_coinpairs()
+        requested = request.query_params.get('pairs')
+        if requested:
+            requested = set(requested.split(','))
+            coinpairs = [coinpair for coinpair in coinpairs
+                         if coinpair in requested]
+
+        entries = price_cache.get_entries(coinpairs)
+        prices = [
+            {
+                'coinpair': coinpair,
+                'price': entry['price'],
+                'fetched_at': datetime.fromtimestamp(entry['fetched_at'],
+                                                     timezone.utc),
+            }
+            for coinpair, entry in sorted(entries.items())
+        ]
+
+        serializer = serializers.PriceSerializer(prices, many=True)
+        response = Response(serializer.data)
+        patch_cache_control(response, public=True,
+                            max_age=settings.PRICE_CACHE_MAX_AGE)
+        return response
@@ -0,0 +1,69 @@
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from tinychain.push import HTTPPushBackend, LocalPushBackend, get_alert
+
+
+class WNSBackend(HTTPPushBackend):
+    """Push backend of the Windows Push Notification Services
+
+    The device token of a Windows device is the channel URI WNS gave it,
+    every notification is a toast posted to that URI. Only URIs of WNS
+    are posted to, as the URI comes from the client. Access tokens are
+    requested with the WNS_CLIENT_ID and WNS_CLIENT_SECRET of the app.
+    """
+    token_url = 'https://login.live.com/accesstoken.srf'
+    errors = {404: 'NotFound', 410: 'Gone'}
+    invalid_token_reasons = frozenset({'NotFound', 'Gone',
+                                       'InvalidChannelUri'})
+
+    def is_configured(self):
+        return bool(settings.WNS_CLIENT_ID and settings.WNS_CLIENT_SECRET)
+
+    def request_access_token(self):
+        response = self.session.post(self.token_url, data={
+            'grant_type': 'client_credentials',
+            'client_id': settings.WNS_CLIENT_ID,
+            'client_secret': settings.WNS_CLIENT_SECRET,
+            'scope': 'notify.windows.com',
+        }, timeout=settings.PUSH_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        token = response.json()
+        return token['access_token'], token['expires_in']
+
+    def send_notification(self, notification):
+        if not self.is_channel_uri(notification.token):
+            return 'InvalidChannelUri'
+
+        response = self.post(
+            notification.token,
+            data=self.get_toast(notification.payload).encode('utf-8'),
+            headers={'Content-Type': 'text/xml', 'X-WNS-Type': 'wns/toast'})
+        if response.status_code == 200:
+            return 'Success'
+        return self.errors.get(
+            response.status_code,
+            response.headers.get('X-WNS-Error-Description') or
+            f'HTTP {response.status_code}')
+
+    def is_channel_uri(self, uri):
+        try:
+            parts = urlsplit(uri)
+            hostname = parts.hostname or ''
+        except ValueError:
+            return False
+        return parts.scheme == 'https' and \
+            hostname.endswith('.notify.windows.com')
+
+    def get_toast(self, payload):
+        title, body = get_alert(payload)
+        return (f'<toast><visual><binding template="ToastGeneric">'
+                f'<text>{escape(title)}</text><text>{escape(body)}</text>'
+                f'</binding></visual></toast>')
+
+
+class LocalWNSBackend(LocalPushBackend):
+    """Stand-in for WNS in tests"""
+    invalid_token_reasons = WNSBackend.invalid_token_reasons
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 
 
 class UserConfig(AppConfig):
     name = 'user'
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+        from user import authentication
+
+        post_delete.connect(authentication.token_post_delete, sender=Token)
+        post_save.connect(authentication.user_post_save,
+                          sender=get_user_model())
@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from redis.exceptions import RedisError
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from app.logger import get_module_logger
+from app.redis import redis_or_local
+
+
+logger = get_module_logger(__name__)
+
+# Fields of the user kept in the shared cache, the other fields, the
+# password hash among them, are loaded from the database when used
+USER_SNAPSHOT_FIELDS = ('id', 'email', 'name', 'is_active', 'is_staff',
+                        'is_superuser', 'is_verified', 'is_apple_user')
+
+
+class LocalCache:
+    """Thread safe least recently used cache with a time to live"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_users = LocalCache(settings.AUTH_TOKEN_LOCAL_SIZE,
+                         settings.AUTH_TOKEN_LOCAL_TTL)
+
+
+class RedisInvalidations:
+    """Invalidated tokens announced to the per process cache of every
+    process through Redis
+
+    Every process that authenticates runs a single listener thread. The
+    per process cache is only used while the listener is subscribed and is
+    cleared when it subscribes, as invalidations published in between are
+    lost.
+    """
+    channel = 'auth:invalidate'
+
+    def __init__(self, client):
+        self.client = client
+        self.pid = None
+        self.listening = threading.Event()
+        self.lock = threading.Lock()
+
+    def publish(self, keys):
+        try:
+            self.client.publish(self.channel, json.dumps(keys))
+        except RedisError as error:
+            logger.warning(f'Could not publish token invalidations: {error}')
+
+    def start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.listening = threading.Event()
+                threading.Thread(target=self.listen, daemon=True,
+                                 name='auth-invalidations').start()
+
+    def is_listening(self):
+        return self.listening.is_set()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.dispatch(message)
+            except RedisError as error:
+                self.listening.clear()
+                logger.warning(f'Token invalidation listener disconnected: '
+                               f'{error}')
+                time.sleep(1)
+
+    def dispatch(self, message):
+        if message['type'] == 'subscribe':
+            local_users.clear()
+            self.listening.set()
+        elif message['type'] == 'message':
+            for key in json.loads(message['data']):
+                local_users.delete(key)
+
+
+class LocalInvalidations:
+    """Invalidations without other processes to tell, the per process
+    cache is always up to date"""
+
+    def publish(self, keys):
+        pass
+
+    def start(self):
+        pass
+
+    def is_listening(self):
+        return True
+
+
+get_invalidations = redis_or_local(RedisInvalidations, LocalInvalidations)
+
+
+def token_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def invalidate_tokens(keys):
+    """Forget the cached user of the tokens in every process once the
+    transaction commits
+
+    Invalidating before the commit would let a concurrent request cache the
+    old row of the user again.
+    """
+    if keys:
+        transaction.on_commit(lambda: forget_tokens(keys))
+
+
+def forget_tokens(keys):
+    for key in keys:
+        local_users.delete(key)
+    cache.delete_many([token_cache_key(key) for key in keys])
+    get_invalidations().publish(keys)
+
+
+def invalidate_token(key):
+    """Forget the cached user of a token"""
+    invalidate_tokens([key])
+
+
+def invalidate_user(user):
+    """Forget the cached user of all tokens of the user"""
+    invalidate_tokens(list(Token.objects.filter(user=user)
+                                        .values_list('key', flat=True)))
+
+
+def get_snapshot(user):
+    return {field: getattr(user, field) for field in USER_SNAPSHOT_FIELDS}
+
+
+def from_snapshot(snapshot):
+    """Return the user of a snapshot, with the other fields deferred"""
+    UserModel = get_user_model()
+    fields = [field.attname for field in UserModel._meta.concrete_fields
+              if field.attname in snapshot]
+    return UserModel.from_db(None, fields,
+                             [snapshot[field] for field in fields])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches the user of every token
+
+    A small per process cache answers repeated requests without any round
+    trip, the shared cache answers requests handled by other processes with
+    a snapshot of the user. Deleting a token or saving its user invalidates
+    the shared cache and, through RedisInvalidations, the per process cache
+    of every process right away.
+    """
+
+    def authenticate_credentials(self, key):
+        invalidations = get_invalidations()
+        invalidations.start()
+        use_local = invalidations.is_listening()
+
+        user = local_users.get(key) if use_local else None
+        if user is None:
+            snapshot = cache.get(token_cache_key(key))
+            if snapshot is None:
+                user, token = super().authenticate_credentials(key)
+                cache.set(token_cache_key(key), get_snapshot(user),
+                          settings.AUTH_TOKEN_CACHE_TTL)
+            else:
+                user = from_snapshot(snapshot)
+            if use_local:
+                local_users.set(key, user)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+
+        return (user, Token(key=key, user=user))
+
+
+def token_post_delete(sender, instance, *args, **kwargs):
+    invalidate_token(instance.key)
+
+
+def user_post_save(sender, instance, *args, **kwargs):
+    invalidate_user(instance)
@@ -0,0 +1,161 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from user import authentication
+from user.authentication import CachedTokenAuthentication, LocalCache, \
+    RedisInvalidations, local_users, token_cache_key
+
+from unittest.mock import MagicMock, patch
+
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TransactionTestCase):
+    """Test caching the user of an auth token"""
+
+    def setUp(self):
+        cache.clear()
+        local_users.clear()
+        self.addCleanup(local_users.clear)
+        self.user = get_user_model().objects.create_user(
+            'test@simpletechture.nl',
+            'test123'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def test_cached_user_needs_no_queries(self):
+        """Test that a known token is authenticated without the database"""
+        self.authentication.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(
+                self.token.key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_shared_cache_used_by_other_processes(self):
+        """Test that the shared cache serves an empty local cache"""
+        self.authentication.authenticate_credentials(self.token.key)
+        local_users.clear()
+
+        with self.assertNumQueries(0):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_deleted_token_invalidated(self):
+        """Test that a deleted token no longer authenticates"""
+        self.authentication.authenticate_credentials(self.token.key)
+
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_invalidated_on_commit(self):
+        """Test that a user saved in a transaction is invalidated once it
+        commits, a request running before cannot cache the old row again"""
+        self.authentication.authenticate_credentials(self.token.key)
+
+        with transaction.atomic():
+            self.user.is_active = False
+            self.user.save()
+            self.assertIsNotNone(cache.get(token_cache_key(self.token.key)))
+
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_shared_cache_holds_snapshot(self):
+        """Test that the shared cache holds no more of the user than the
+        views need, the password hash is left out"""
+        self.authentication.authenticate_credentials(self.token.key)
+        local_users.clear()
+
+        snapshot = cache.get(token_cache_key(self.token.key))
+        user, token = self.authentication.authenticate_credentials(
+            self.token.key)
+
+        self.assertNotIn('password', snapshot)
+        self.assertEqual(snapshot['email'], self.user.email)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertTrue(user.is_active)
+        self.assertIn('password', user.get_deferred_fields())
+
+    def test_invalidation_published(self):
+        """Test that other processes are told about a deleted token and
+        drop it from their cache"""
+        client = MagicMock()
+        key = self.token.key
+        with patch.object(authentication, 'get_invalidations',
+                          return_value=RedisInvalidations(client)):
+            self.token.delete()
+
+        channel, data = client.publish.call_args[0]
+        self.assertEqual(channel, RedisInvalidations.channel)
+        self.assertEqual(json.loads(data), [key])
+
+        local_users.set(key, self.user)
+        RedisInvalidations(client).dispatch({'type': 'message',
+                                             'data': data})
+        self.assertIsNone(local_users.get(key))
+
+    @patch.object(RedisInvalidations, 'start')
+    def test_local_cache_needs_listener(self, mock_start):
+        """Test that the per process cache is only used while the
+        listener receives invalidations, and cleared when it subscribes"""
+        redis_invalidations = RedisInvalidations(MagicMock())
+        with patch.object(authentication, 'get_invalidations',
+                          return_value=redis_invalidations):
+            self.authentication.authenticate_credentials(self.token.key)
+            self.assertIsNone(local_users.get(self.token.key))
+
+            redis_invalidations.dispatch({'type': 'subscribe'})
+            self.authentication.authenticate_credentials(self.token.key)
+            self.assertIsNotNone(local_users.get(self.token.key))
+
+            redis_invalidations.dispatch({'type': 'subscribe'})
+            self.assertIsNone(local_users.get(self.token.key))
+
+    def test_deactivated_user_invalidated(self):
+        """Test that deleting the user through the API revokes the token"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(client.get(ME_URL).status_code, status.HTTP_200_OK)
+
+        res = client.delete(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        res = client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LocalCacheTests(TestCase):
+    """Test the per process least recently used cache"""
+
+    def test_evicts_least_recently_used(self):
+        local = LocalCache(max_size=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+
+        self.assertEqual(local.get('a'), 1)
+        self.assertIsNone(local.get('b'))
+
+    def test_expires_entries(self):
+        local = LocalCache(max_size=2, ttl=-1)
+        local.set('a', 1)
+
+        self.assertIsNone(local.get('a'))
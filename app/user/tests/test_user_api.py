@@ -5,6 +5,8 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.throttling import get_buckets
+
 
 CREATE_USER_URL = reverse('user:create')
 CREATE_APPLE_USER_URL = reverse('user:createapple')
@@ -23,6 +25,7 @@ class PublicUserApiTests(TestCase):
     """Test the users API (public)"""
 
     def setUp(self):
+        get_buckets().clear()
         self.client = APIClient()
 
     def test_create_valid_user_success(self):
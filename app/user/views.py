@@ -1,4 +1,4 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 from rest_framework.views import APIView
@@ -7,41 +7,50 @@ from rest_framework import status
 
 from user.serializers import UserSerializer, AppleUserSerializer,\
     AuthTokenSerializer
+from user.authentication import CachedTokenAuthentication
 from core.models import User
+from core.throttling import AuthThrottle, RegisterThrottle
 
 
 class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system"""
     serializer_class = UserSerializer
+    throttle_classes = (RegisterThrottle,)
 
 
 class CreateAppleUserView(generics.CreateAPIView):
     """Create a new apple user in the system"""
     serializer_class = AppleUserSerializer
+    throttle_classes = (RegisterThrottle,)
 
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for the user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_classes = (AuthThrottle,)
 
 
 class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
-        return self.request.user
+        # the authenticated user is a cached snapshot, changes are made to
+        # the user as stored
+        return User.objects.get(pk=self.request.user.pk)
 
     def destroy(self, request, pk=None):
-        self.request.user.is_active = False
-        self.request.user.save()
+        user = self.get_object()
+        user.is_active = False
+        user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ValidateApiView(APIView):
+    throttle_classes = (AuthThrottle,)
 
     def get(self, request, format=None):
         verification_id = request.query_params.get('verification_id')
@@ -58,6 +67,7 @@ class ValidateApiView(APIView):
 
 
 class AppleUserApiView(APIView):
+    throttle_classes = (AuthThrottle,)
 
     def get(self, request, format=None):
         apple_user_id = request.query_params.get('apple_user_id')
@@ -0,0 +1,9 @@
+#!/bin/sh
+
+# The pool processes write their metrics to this directory and the worker
+# exports their sum on WORKER_METRICS_PORT, it must be empty on start
+export PROMETHEUS_MULTIPROC_DIR=/tmp/metrics
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+exec celery -A app worker "$@"